@@ -0,0 +1,174 @@
+from __future__ import annotations
+import io
+import logging
+import queue
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Union
+
+from PIL import Image
+
+from utilidades import escribir_atomico
+
+# bytes ya listos, un archivo a copiar, o una función que los produce (se llama en el hilo escritor)
+Contenido = Union[bytes, Path, Callable[[], bytes]]
+
+
+def png(img: Image.Image) -> Callable[[], bytes]:
+    """Codificación PNG diferida: corre en el hilo escritor, fuera del camino foto → pantalla."""
+    def _codificar() -> bytes:
+        salida = io.BytesIO()
+        img.save(salida, format="PNG")
+        return salida.getvalue()
+    return _codificar
+
+
+class EscritorArtefactos:
+    """
+    Escribe vistas previas, cuadros empaquetados y capturas desde un hilo propio.
+
+    Cada `guardar()` crea una entrada con marca de tiempo en `<directorio>/historial/` y, además,
+    actualiza los archivos "últimos" en `<directorio>/` (p.ej. vista_previa_1bit.png).
+    El historial rota solo: se borran las entradas más viejas al pasar de `max_entradas` o de
+    `max_bytes` (`max_entradas=0`: sin historial, solo los últimos). La cola es acotada y `guardar()` nunca bloquea: si está llena, el artefacto se
+    descarta (y se cuenta) en lugar de frenar el ciclo.
+    """
+
+    def __init__(self, directorio: Path, max_entradas: int = 20, max_bytes: int = 64 << 20, capacidad: int = 8):
+        self.directorio = directorio
+        self.historial = directorio / "historial"
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._cola: queue.Queue = queue.Queue(maxsize=capacidad)
+        self._entradas: list[tuple[Path, int]] = []  # (carpeta, bytes), de la más vieja a la más nueva
+        self._secuencia = 0
+        self.escritos = 0
+        self.descartados = 0
+        self.fallidos = 0
+        self.historial.mkdir(parents=True, exist_ok=True)
+        self._cargar_historial()
+        self._hilo = threading.Thread(target=self._bucle, name="Artefactos", daemon=True)
+        self._hilo.start()
+
+    def guardar(self, archivos: dict[str, Contenido], ultimos: Iterable[str] | None = None,
+                despues: Callable[[dict[str, bytes]], None] | None = None) -> bool:
+        """
+        Encola una entrada {nombre: contenido}. Los nombres en `ultimos` (todos si es None) también
+        reemplazan <directorio>/<nombre>.
+        `despues` recibe los bytes ya producidos (p.ej. para guardar el PNG en la caché).
+        Retorna False si la cola estaba llena y se descartó.
+        """
+        try:
+            self._cola.put_nowait((archivos, ultimos, despues))
+            return True
+        except queue.Full:
+            self.descartados += 1
+            logging.debug(f"[Artefactos] Cola llena; descarto {', '.join(archivos)}")
+            return False
+
+    def vaciar(self) -> None:
+        """Bloquea hasta que todo lo encolado esté en disco."""
+        self._cola.join()
+
+    def cerrar(self) -> None:
+        if self._hilo.is_alive():
+            self._cola.put(None)
+            self._hilo.join()
+
+    def estadisticas(self) -> dict[str, int]:
+        return {
+            "escritos": self.escritos, "descartados": self.descartados, "fallidos": self.fallidos,
+            "entradas": len(self._entradas), "bytes_historial": sum(b for _, b in self._entradas),
+        }
+
+    # --- Hilo escritor ---
+    def _bucle(self) -> None:
+        while True:
+            item = self._cola.get()
+            try:
+                if item is None:
+                    return
+                self._escribir(*item)
+                self.escritos += 1
+            except Exception as e:
+                self.fallidos += 1
+                logging.warning(f"[Artefactos] No se pudo escribir: {e}")
+            finally:
+                self._cola.task_done()
+
+    def _escribir(self, archivos: dict[str, Contenido], ultimos: Iterable[str] | None,
+                  despues: Callable[[dict[str, bytes]], None] | None) -> None:
+        producidos = {nombre: _producir(contenido) for nombre, contenido in archivos.items()}
+        for nombre in producidos if ultimos is None else ultimos:
+            escribir_atomico(self.directorio / nombre, producidos[nombre])
+        if self.max_entradas > 0:
+            self._secuencia += 1
+            carpeta = self.historial / f"{datetime.now():%Y%m%d-%H%M%S-%f}-{self._secuencia:04d}"
+            carpeta.mkdir()
+            for nombre, datos in producidos.items():
+                (carpeta / nombre).write_bytes(datos)
+            self._entradas.append((carpeta, sum(len(d) for d in producidos.values())))
+            self._rotar()
+        if despues is not None:
+            despues(producidos)
+
+    def _rotar(self) -> None:
+        total = sum(b for _, b in self._entradas)
+        while self._entradas and (len(self._entradas) > self.max_entradas or total > self.max_bytes):
+            carpeta, tam = self._entradas.pop(0)
+            shutil.rmtree(carpeta, ignore_errors=True)
+            total -= tam
+
+    def _cargar_historial(self) -> None:
+        """Retoma el historial de ejecuciones anteriores para que la rotación lo incluya."""
+        for carpeta in sorted(p for p in self.historial.iterdir() if p.is_dir()):
+            tam = sum(f.stat().st_size for f in carpeta.iterdir() if f.is_file())
+            self._entradas.append((carpeta, tam))
+        self._rotar()
+
+
+class LoteArtefactos:
+    """
+    Junta varios `guardar()` en una sola entrada del historial: con varias pantallas, los cuadros
+    y vistas de todas las especificaciones de un ciclo quedan en la misma carpeta.
+    Se usa en lugar del escritor (misma firma de `guardar()`, seguro entre hilos) y `confirmar()`
+    encola la entrada completa.
+    """
+
+    def __init__(self, escritor: EscritorArtefactos):
+        self.escritor = escritor
+        self._archivos: dict[str, Contenido] = {}
+        self._ultimos: list[str] = []
+        self._despues: list[Callable[[dict[str, bytes]], None]] = []
+        self._lock = threading.Lock()
+
+    def guardar(self, archivos: dict[str, Contenido], ultimos: Iterable[str] | None = None,
+                despues: Callable[[dict[str, bytes]], None] | None = None) -> bool:
+        with self._lock:
+            self._archivos.update(archivos)
+            self._ultimos.extend(archivos if ultimos is None else ultimos)
+            if despues is not None:
+                self._despues.append(despues)
+        return True
+
+    def confirmar(self) -> bool:
+        with self._lock:
+            archivos, ultimos, despues = self._archivos, self._ultimos, self._despues
+            self._archivos, self._ultimos, self._despues = {}, [], []
+        if not archivos:
+            return True
+
+        def _todos(producidos: dict[str, bytes]) -> None:
+            for d in despues:
+                d(producidos)
+        return self.escritor.guardar(archivos, ultimos=tuple(ultimos), despues=_todos if despues else None)
+
+
+def _producir(contenido: Contenido) -> bytes:
+    if isinstance(contenido, bytes):
+        return contenido
+    if isinstance(contenido, Path):
+        return contenido.read_bytes()
+    return contenido()
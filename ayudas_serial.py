@@ -1,101 +1,93 @@
 from __future__ import annotations
-import time
 import logging
-from contextlib import contextmanager
-from threading import Thread
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
 
-from enviar_serial import abrir_serial, enviar_cuadro_bn, enviar_dormir
+from enviar_serial import ResultadoEnvio
+from sesion_epd import obtener_sesion
 
 
-@contextmanager
-def _open_serial_ctx_with_retry(puerto: str, baud: int, intentos: int = 3, pausa_s: float = 0.25):
+def mostrar_imagen(puerto: str, baud: int, datos: bytes, modo_prueba: bool,
+                   delta: bool = False, ancho: int | None = None, comprimir: bool = False,
+                   baud_max: int | None = None, tramas: bool = False) -> ResultadoEnvio:
     """
-    Abre el serial con reintentos y asegura cierre al salir del contexto.
+    Envío síncrono (bloqueante). Sin 'despertar' previo para evitar estados raros.
     """
-    ultimo = None
-    ser = None
-    for i in range(intentos):
-        try:
-            ser = abrir_serial(puerto, baud)
-            break
-        except Exception as e:
-            ultimo = e
-            logging.warning(f"[EPD] Serial fallo intento {i+1}/{intentos}: {e}")
-            time.sleep(pausa_s)
-    if ser is None:
-        raise RuntimeError(f"No se pudo abrir serial {puerto}: {ultimo}")
-    try:
-        yield ser
-    finally:
-        try:
-            ser.close()
-        except Exception:
-            pass
+    return mostrar_imagen_async(puerto, baud, datos, modo_prueba, delta=delta, ancho=ancho,
+                                comprimir=comprimir, baud_max=baud_max, tramas=tramas).result()
 
 
-def _despertar_best_effort(puerto: str, baud: int, modo_prueba: bool) -> None:
+def mostrar_imagen_async(puerto: str, baud: int, datos: bytes, modo_prueba: bool,
+                         delta: bool = False, ancho: int | None = None, comprimir: bool = False,
+                         baud_max: int | None = None, tramas: bool = False) -> Future:
     """
-    Intenta 'despertar' el micro de la EPD si quedó dormido.
-    No depende de comandos especiales: envía un newline y espera un instante.
+    Encola el envío en la sesión persistente del puerto (un hilo reutilizado entre ciclos) y
+    retorna un Future[ResultadoEnvio] con confirmación, bytes y tiempos. No bloquea.
+    Con delta=True (requiere `ancho`) solo se envían las filas que cambiaron desde el último cuadro.
+    Con comprimir=True los cuadros completos viajan en PackBits cuando así ocupan menos.
+    Con baud_max la sesión negocia velocidad y control de flujo al conectar; con tramas, los
+    cuadros completos van en bloques con CRC si el firmware lo admite.
+    Un fallo queda en el Future (y en el log); nunca se pierde en un hilo suelto.
     """
     if modo_prueba:
-        return
-    try:
-        with _open_serial_ctx_with_retry(puerto, baud) as ser:
-            try:
-                ser.write(b"\n")
-                if hasattr(ser, "flush"):
-                    ser.flush()
-            except Exception:
-                pass
-            time.sleep(0.2)
-    except Exception as e:
-        logging.debug(f"[EPD] Despertar best-effort no crítico: {e}")
+        logging.info("[EPD] Modo prueba: no envío serial")
+        fut: Future = Future()
+        fut.set_result(ResultadoEnvio('prueba', 'ninguno', len(datos), 0))
+        return fut
 
+    sesion = obtener_sesion(puerto, baud, baud_max, tramas)
+    if delta:
+        if ancho is None:
+            raise ValueError("el modo delta requiere el ancho de la pantalla")
+        fut = sesion.cuadro_delta_async(datos, (ancho + 7) // 8, comprimir=comprimir)
+    else:
+        fut = sesion.cuadro_async(datos, comprimir=comprimir)
+    fut.add_done_callback(_registrar_envio)
+    return fut
 
-def mostrar_imagen(puerto: str, baud: int, datos: bytes, modo_prueba: bool) -> None:
-    """
-    Envío síncrono (bloqueante). Sin 'despertar' previo para evitar estados raros.
-    """
-    import logging
-    from enviar_serial import enviar_cuadro_bn  # import aquí por claridad
 
-    if modo_prueba:
-        logging.info("[EPD] Modo prueba: no envío serial")
+def _registrar_envio(fut: Future) -> None:
+    if fut.cancelled():
+        logging.info("[EPD] Envío de imagen cancelado")
         return
-
-    with _open_serial_ctx_with_retry(puerto, baud) as ser:
-        conf = enviar_cuadro_bn(ser, datos)
-        logging.info(f"[EPD] Imagen mostrada ({conf})")
+    error = fut.exception()
+    if error is not None:
+        logging.error(f"[EPD] Fallo al enviar imagen: {error}")
+        return
+    res = fut.result()
+    ratio = f", ratio {res.ratio:.1f}x" if res.ratio else ""
+    velocidad = f", {res.bytes_por_s / 1024:.1f} KiB/s" if res.bytes_por_s else ""
+    if res.modo == 'tramas' and res.goodput:
+        velocidad += f", útil {res.goodput / 1024:.1f} KiB/s, {res.retransmitidos} bloques reenviados"
+    logging.info(f"[EPD] Imagen mostrada ({res.confirmacion}, {res.modo}, "
+                 f"{res.bytes_enviados}/{res.bytes_cuadro} bytes{ratio}{velocidad}, {res.duracion_s:.2f}s)")
+    logging.debug("[EPD] Tiempos: " + ", ".join(f"{etapa} {s * 1e3:.0f}ms" for etapa, s in res.etapas().items()))
 
 
-def mostrar_imagen_async(puerto: str, baud: int, datos: bytes, modo_prueba: bool) -> Thread:
+def esperar_envio(fut: Future, plazo_s: float | None) -> ResultadoEnvio | None:
     """
-    Lanza el envío en un hilo aparte y lo retorna. No bloquea.
+    Espera la confirmación del envío hasta `plazo_s` (None: sin plazo). None si sigue en vuelo,
+    falló o se canceló (el motivo ya quedó en el log).
     """
-    import logging
-
-    def _send():
-        try:
-            mostrar_imagen(puerto, baud, datos, modo_prueba)
-        except Exception as e:
-            logging.error(f"[EPD] Fallo al enviar imagen: {e}")
-
-    th = Thread(target=_send, name="EPDSender", daemon=True)
-    th.start()
-    return th
+    try:
+        return fut.result(timeout=plazo_s)
+    except FuturesTimeout:
+        logging.warning(f"[EPD] El cuadro sigue en vuelo tras {plazo_s:.1f}s")
+    except Exception:
+        pass  # fallo o cancelación: ya registrado por _registrar_envio
+    return None
 
 
-def limpiar_y_dormir(puerto: str, baud: int, ancho: int, alto: int, dormir: bool, modo_prueba: bool) -> None:
+def limpiar_y_dormir(puerto: str, baud: int, ancho: int, alto: int, dormir: bool, modo_prueba: bool,
+                     comprimir: bool = False, baud_max: int | None = None, tramas: bool = False) -> None:
     if modo_prueba:
         logging.info("[EPD] Modo prueba: no envío limpiar/dormir")
         return
     bytes_por_fila = (ancho + 7) // 8
     total_bytes = bytes_por_fila * alto
     cuadro_blanco = bytes([0xFF] * total_bytes)
-    with _open_serial_ctx_with_retry(puerto, baud) as ser:
-        conf = enviar_cuadro_bn(ser, cuadro_blanco)
-        logging.info(f"[EPD] Limpiar OK ({conf})")
-        if dormir:
-            conf2 = enviar_dormir(ser)
-            logging.info(f"[EPD] Dormir OK ({conf2})")
+    sesion = obtener_sesion(puerto, baud, baud_max, tramas)  # reutiliza el enlace del último envío
+    conf = sesion.cuadro(cuadro_blanco, comprimir=comprimir).confirmacion
+    logging.info(f"[EPD] Limpiar OK ({conf})")
+    if dormir:
+        conf2 = sesion.dormir()
+        logging.info(f"[EPD] Dormir OK ({conf2})")
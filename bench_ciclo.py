@@ -0,0 +1,171 @@
+from __future__ import annotations
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import corpus
+from emulador_epd import EmuladorPTY, FirmwareEPD
+
+# Etapa → (línea de log que la abre, línea de log que la cierra). None = arranque del proceso.
+ETAPAS = {
+    "preparar": (None, "[Imagen] Vista previa"),
+    "primera_nota": (None, "[Motores] 🎵 Iniciando canción"),
+    "envio_epd": ("[EPD] Envío de imagen lanzado", "[EPD] Imagen mostrada"),
+    "cancion": ("[Motores] 🎵 Iniciando canción", "[Motores] ✓ Canción terminada"),
+    "limpiar": ("[EPD] Limpio y duermo", "[EPD] Limpiar OK"),
+    "dormir": ("[EPD] Limpiar OK", "[EPD] Dormir OK"),
+}
+
+
+# Lo que el host informa del envío en tramas (ver ayudas_serial.mostrar_imagen)
+_UTIL = re.compile(r"útil ([\d.]+) KiB/s, (\d+) bloques reenviados")
+
+
+def _imagen_sintetica(ruta: Path) -> Path:
+    ruta.write_bytes(corpus.jpeg("circulos", 800, 600, calidad=95))
+    return ruta
+
+
+def correr_ciclo(puerto: str, imagen: Path, salida: Path, extra: list[str]) -> tuple[dict[str, float], str]:
+    """
+    Corre `main.py` una vez contra el puerto dado y mide cada etapa por la llegada de sus logs.
+    Retorna también la línea de log con el resultado del envío ("" si no la hubo).
+    """
+    comando = [sys.executable, "-u", str(Path(__file__).with_name("main.py")),
+               "--puerto", puerto, "--imagen", str(imagen), "--salida", str(salida)] + extra
+    marcas: dict[str, float] = {}
+    envio = ""
+    inicio = time.perf_counter()
+    proc = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    assert proc.stderr is not None
+    for linea in proc.stderr:
+        ahora = time.perf_counter() - inicio
+        if linea.startswith("[EPD] Imagen mostrada"):
+            envio = linea.strip()
+        for abre, cierra in ETAPAS.values():
+            for marca in (abre, cierra):
+                if marca and linea.startswith(marca):
+                    marcas.setdefault(marca, ahora)
+    codigo = proc.wait()
+    tiempos = {"total": time.perf_counter() - inicio}
+    if codigo != 0:
+        raise RuntimeError(f"main.py terminó con código {codigo}")
+    for etapa, (abre, cierra) in ETAPAS.items():
+        if cierra in marcas and (abre is None or abre in marcas):
+            tiempos[etapa] = marcas[cierra] - (marcas[abre] if abre else 0.0)
+    return tiempos, envio
+
+
+def verificar_enlace(firmware: FirmwareEPD, emulador: EmuladorPTY, imagen: Path, salida: Path,
+                     extra: list[str], ciclos: int) -> tuple[list[dict[str, float]], list[str]]:
+    """
+    Ciclos con ruido en la línea: tras cada uno, el cuadro que quedó en el firmware debe ser bit a
+    bit el que preparó el host (<salida>/cuadro_bn.bin). Retorna los tiempos y los errores.
+    """
+    resultados, errores = [], []
+    for i in range(ciclos):
+        firmware.marco[:] = bytes(len(firmware.marco))  # que no pase por bueno el cuadro del ciclo anterior
+        rechazados, recibidos, invertidos = firmware.bloques_rechazados, firmware.bytes_recibidos, emulador.bits_invertidos
+        tiempos, envio = correr_ciclo(emulador.puerto, imagen, salida, extra)
+        resultados.append(tiempos)
+        esperado = (salida / "cuadro_bn.bin").read_bytes()
+        distintos = sum(a != b for a, b in zip(firmware.marco, esperado)) + abs(len(firmware.marco) - len(esperado))
+        util = _UTIL.search(envio)
+        print(f"  ciclo {i + 1}: {emulador.bits_invertidos - invertidos} bits invertidos, "
+              f"{firmware.bloques_rechazados - rechazados} bloques rechazados, "
+              f"{util.group(2) if util else '?'} reenviados por el host, "
+              f"útil {util.group(1) + ' KiB/s' if util else '?'}, "
+              f"{firmware.bytes_recibidos - recibidos} bytes en la línea para {len(esperado)} de cuadro, "
+              f"{'cuadro idéntico' if not distintos else f'{distintos} bytes distintos'}")
+        if distintos:
+            errores.append(f"ciclo {i + 1}: el cuadro del firmware difiere en {distintos} bytes ({envio or 'sin envío'})")
+    return resultados, errores
+
+
+def principal():
+    analizador = argparse.ArgumentParser(description="Benchmark de ciclo completo contra una EPD emulada")
+    analizador.add_argument("--imagen", help="Imagen fuente (por defecto: una sintética)")
+    analizador.add_argument("--ciclos", type=int, default=3, help="Ciclos a medir (por defecto: 3)")
+    analizador.add_argument("--ancho-pantalla", type=int, default=104, help="Ancho de pantalla (por defecto: 104)")
+    analizador.add_argument("--alto-pantalla", type=int, default=212, help="Alto de pantalla (por defecto: 212)")
+    analizador.add_argument("--baudios", type=int, default=115200, help="Velocidad simulada del enlace")
+    analizador.add_argument("--refresco", type=float, default=4.5, help="Segundos de refresco completo simulado")
+    analizador.add_argument("--refresco-parcial", type=float, default=0.6, help="Segundos de refresco parcial simulado")
+    analizador.add_argument("--bpm", type=float, default=600.0,
+                            help="Tempo de la canción; alto para ciclos cortos (por defecto: 600)")
+    analizador.add_argument("--sleep", action="store_true", help="Incluye limpiar+dormir al final del ciclo")
+    analizador.add_argument("--limite-total", type=float,
+                            help="Falla (código 1) si la mediana del ciclo total supera estos segundos")
+    analizador.add_argument("--tasa-error-bits", type=float, default=0.0,
+                            help="Invierte cada bit que llega al emulador con esta probabilidad (p.ej. 1e-5): "
+                                 "envía en tramas por un enlace crudo y otro con créditos y verifica el "
+                                 "cuadro bit a bit; falla (código 1) si difiere")
+    analizador.add_argument("--semilla", type=int, default=0, help="Semilla del ruido (por defecto: 0)")
+    argumentos, extra = analizador.parse_known_args()
+    if argumentos.tasa_error_bits and argumentos.sleep:
+        analizador.error("--sleep borra el cuadro antes de poder verificarlo; no va con --tasa-error-bits")
+
+    baudios = argumentos.baudios or 115200
+    extra += ["--ancho-pantalla", str(argumentos.ancho_pantalla), "--alto-pantalla", str(argumentos.alto_pantalla),
+              "--baud", str(baudios), "--bpm", str(argumentos.bpm)]
+    if argumentos.sleep:
+        extra.append("--sleep")
+    # Con ruido, los dos enlaces que el firmware distingue: sin negociar y con créditos (--baud-max a
+    # la misma velocidad activa el control de flujo sin cambiar el costo por byte)
+    enlaces = {"": []} if not argumentos.tasa_error_bits else {
+        "crudo": ["--tramas"], "creditos": ["--tramas", "--baud-max", str(baudios)]}
+
+    resultados, errores = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        salida = Path(tmp)
+        imagen = Path(argumentos.imagen) if argumentos.imagen else _imagen_sintetica(salida / "fuente.jpg")
+        for enlace, opciones in enlaces.items():
+            firmware = FirmwareEPD(argumentos.ancho_pantalla, argumentos.alto_pantalla)
+            emulador = EmuladorPTY(firmware, baudios=argumentos.baudios, refresco_s=argumentos.refresco,
+                                   refresco_parcial_s=argumentos.refresco_parcial,
+                                   tasa_error_bits=argumentos.tasa_error_bits, semilla=argumentos.semilla)
+            with emulador:
+                if enlace:
+                    print(f"enlace {enlace} (tasa de error {argumentos.tasa_error_bits:g} por bit):")
+                    tiempos, fallos = verificar_enlace(firmware, emulador, imagen, salida, extra + opciones,
+                                                       argumentos.ciclos)
+                    resultados += tiempos
+                    errores += [f"{enlace}, {f}" for f in fallos]
+                    if enlace == "creditos" and not firmware.creditos_emitidos:
+                        errores.append("creditos: el firmware no emitió créditos (¿falló la negociación?)")
+                else:
+                    for i in range(argumentos.ciclos):
+                        tiempos, _ = correr_ciclo(emulador.puerto, imagen, salida, extra)
+                        resultados.append(tiempos)
+                        print(f"ciclo {i + 1}: " + ", ".join(f"{k}={v:.3f}s" for k, v in tiempos.items()))
+            print(f"Emulador{' ' + enlace if enlace else ''}: {firmware.refrescos_completos} refrescos completos, "
+                  f"{firmware.refrescos_parciales} parciales, {firmware.bytes_recibidos} bytes recibidos, "
+                  f"{emulador.bits_invertidos} bits invertidos, {firmware.bloques_rechazados} bloques rechazados, "
+                  f"{firmware.creditos_emitidos} créditos")
+
+    print(f"\n{'etapa':<12} {'p50 s':>8} {'min s':>8} {'max s':>8}")
+    for etapa in ["total"] + list(ETAPAS):
+        valores = [r[etapa] for r in resultados if etapa in r]
+        if valores:
+            print(f"{etapa:<12} {statistics.median(valores):>8.3f} {min(valores):>8.3f} {max(valores):>8.3f}")
+    for error in errores:
+        print(f"ERROR {error}")
+    if errores:
+        sys.exit(1)
+
+    if argumentos.limite_total is not None:
+        mediana = statistics.median(r["total"] for r in resultados)
+        if mediana > argumentos.limite_total:
+            print(f"REGRESIÓN: ciclo total {mediana:.3f}s > límite {argumentos.limite_total:.3f}s")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("PYTHONUNBUFFERED", "1")
+    principal()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+import argparse
+import time
+
+from PIL import Image, ImageFilter
+
+import corpus
+import difuminado
+from bench_empaquetado import TAMANOS
+
+try:
+    import numpy as np  # type: ignore
+except Exception:
+    np = None
+
+
+def _imagen_prueba(ancho: int, alto: int, ruta: str | None = None) -> Image.Image:
+    """Degradado con círculos (rampa de grises + bordes duros) o la imagen dada, recortada al tamaño."""
+    if ruta is not None:
+        return Image.open(ruta).convert("L").resize((ancho, alto), Image.LANCZOS)
+    return corpus.imagen("circulos", ancho, alto).convert("L")
+
+
+def error_percibido(gris: Image.Image, blanco: "np.ndarray", radio: float = 1.5) -> float:
+    """
+    Error medio (0..255) entre original y difuminado tras un desenfoque gaussiano, que imita
+    cómo el ojo promedia los puntos a distancia de lectura. Menor = más fiel en tonos.
+    """
+    bn = Image.fromarray((blanco * np.uint8(255)).astype(np.uint8), "L")
+    a = np.asarray(gris.filter(ImageFilter.GaussianBlur(radio)), dtype=np.int16)
+    b = np.asarray(bn.filter(ImageFilter.GaussianBlur(radio)), dtype=np.int16)
+    return float(np.abs(a - b).mean())
+
+
+def _medir(algoritmo: str, gris: "np.ndarray", repeticiones: int) -> float:
+    difuminado.difuminar_y_empaquetar(gris, algoritmo)  # calienta las tablas memorizadas
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        difuminado.difuminar_y_empaquetar(gris, algoritmo)
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def principal():
+    analizador = argparse.ArgumentParser(description="Costo y calidad de cada difuminado por tamaño de panel")
+    analizador.add_argument("--imagen", help="Imagen de prueba (por defecto: degradado sintético)")
+    analizador.add_argument("--repeticiones", type=int, default=10, help="Repeticiones por caso (por defecto: 10)")
+    analizador.add_argument("--algoritmos", nargs="+", default=[a for a in difuminado.ALGORITMOS if a != "bayer"],
+                            choices=difuminado.ALGORITMOS)
+    argumentos = analizador.parse_args()
+    if not difuminado.disponible():
+        raise SystemExit("bench_difuminado requiere NumPy")
+
+    print(f"{'panel':>11} {'algoritmo':>13} {'ms/cuadro':>10} {'Mpx/s':>8} {'error':>7}")
+    for ancho, alto in TAMANOS:
+        gris_img = _imagen_prueba(ancho, alto, argumentos.imagen)
+        gris = np.asarray(gris_img)
+        for algoritmo in argumentos.algoritmos:
+            t = _medir(algoritmo, gris, argumentos.repeticiones)
+            error = error_percibido(gris_img, difuminado.difuminar(gris, algoritmo))
+            print(f"{ancho:>5}x{alto:<5} {algoritmo:>13} {t * 1e3:>10.3f} {ancho * alto / t / 1e6:>8.1f} {error:>7.2f}")
+
+
+if __name__ == "__main__":
+    principal()
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from PIL import Image
+
+from dither import _empaquetar_bn_por_pixel, empaquetar_bn_bit_mas_significativo_primero
+
+# Tamaños de panel (ancho, alto): desde la 2.13" hasta paneles grandes
+TAMANOS = [(104, 212), (122, 250), (212, 104), (296, 128), (400, 300), (640, 384), (800, 480), (1304, 984)]
+
+
+def _imagen_aleatoria(ancho: int, alto: int, semilla: int = 0) -> Image.Image:
+    rnd = random.Random(semilla)
+    gris = Image.frombytes("L", (ancho, alto), bytes(rnd.getrandbits(8) for _ in range(ancho * alto)))
+    return gris.convert("1", dither=Image.NONE)
+
+
+def verificar_paridad(tamanos=TAMANOS) -> None:
+    """Compara byte a byte la versión rápida contra la de referencia (incluye filas parciales)."""
+    casos = list(tamanos) + [(1, 1), (7, 3), (9, 2), (15, 5), (17, 4)]
+    for ancho, alto in casos:
+        for semilla, fondo in ((0, None), (1, 0), (2, 255)):
+            img = _imagen_aleatoria(ancho, alto, semilla) if fondo is None else Image.new("1", (ancho, alto), fondo)
+            ref = _empaquetar_bn_por_pixel(img)
+            rapido = empaquetar_bn_bit_mas_significativo_primero(img)
+            if ref != rapido:
+                raise AssertionError(f"Paridad rota en {ancho}x{alto} (semilla {semilla}, fondo {fondo})")
+    print(f"Paridad OK en {len(casos)} tamaños")
+
+
+def _medir(fn, img: Image.Image, repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        fn(img)
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def principal():
+    analizador = argparse.ArgumentParser(description="Paridad y microbenchmark del empaquetado 1-bit")
+    analizador.add_argument("--repeticiones", type=int, default=20, help="Repeticiones por tamaño (por defecto: 20)")
+    analizador.add_argument("--sin-referencia", action="store_true", help="No medir la versión píxel a píxel")
+    argumentos = analizador.parse_args()
+
+    verificar_paridad()
+
+    print(f"{'panel':>11} {'bytes':>8} {'referencia ms':>14} {'rápido ms':>10} {'aceleración':>12}")
+    for ancho, alto in TAMANOS:
+        img = _imagen_aleatoria(ancho, alto)
+        t_rapido = _medir(empaquetar_bn_bit_mas_significativo_primero, img, argumentos.repeticiones)
+        bytes_cuadro = ((ancho + 7) // 8) * alto
+        if argumentos.sin_referencia:
+            print(f"{ancho:>5}x{alto:<5} {bytes_cuadro:>8} {'-':>14} {t_rapido * 1e3:>10.3f} {'-':>12}")
+            continue
+        t_ref = _medir(_empaquetar_bn_por_pixel, img, max(1, argumentos.repeticiones // 10))
+        print(f"{ancho:>5}x{alto:<5} {bytes_cuadro:>8} {t_ref * 1e3:>14.3f} {t_rapido * 1e3:>10.3f} "
+              f"{t_ref / t_rapido:>11.1f}x")
+
+
+if __name__ == "__main__":
+    principal()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import corpus
+import difuminado
+from dither import EspecificacionPantalla, cargar_y_empaquetar
+
+# Resoluciones de la fuente: webcam, modo binned del HQ (IMX477) y sensor completo
+RESOLUCIONES = [(640, 480), (2028, 1520), (4056, 3040)]
+PANELES = [(104, 212), (296, 128), (400, 300), (800, 480)]
+TIPOS = ("foto", "degradado", "texto", "ruido")  # de corpus.TIPOS
+ORIENTACIONES = [(r, e) for r in (0, 90, 180, 270) for e in (False, True)]
+
+
+def _percentil(ordenados: list[float], p: float) -> float:
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def _rss_mib() -> float:
+    """
+    RSS pico de este proceso. VmHWM es por espacio de memoria y empieza de cero tras exec;
+    ru_maxrss (respaldo fuera de Linux) arrastra el pico del padre que hizo el fork.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _medir_caso(ruta: Path, algoritmo: str, panel: tuple[int, int], orientaciones,
+                repeticiones: int) -> dict:
+    """
+    Un caso (algoritmo, panel, tipo y resolución de la fuente) sobre todas sus orientaciones.
+    Corre en un proceso nuevo: su RSS pico es el de este caso, no el del generador ni de casos
+    anteriores. La primera llamada no se mide (importaciones tardías, cachés de PIL/NumPy).
+    """
+    muestras, medianas = [], []
+    rss_base = _rss_mib()
+    jpeg = ruta.read_bytes()
+    cargar_y_empaquetar(Image.open(io.BytesIO(jpeg)), EspecificacionPantalla(*panel, *orientaciones[0]),
+                        difuminado=algoritmo)
+    for rotacion, espejo in orientaciones:
+        spec = EspecificacionPantalla(panel[0], panel[1], rotacion, espejo)
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            cargar_y_empaquetar(Image.open(io.BytesIO(jpeg)), spec, difuminado=algoritmo)
+            tiempos.append(time.perf_counter() - inicio)
+        medianas.append(statistics.median(tiempos))
+        muestras.extend(tiempos)
+    ordenados = sorted(muestras)
+    return {
+        "cuadros_s": len(ordenados) / sum(ordenados),
+        # Rotar 90° cuesta distinto que 0°: el p50 de todo junto salta entre modos, esto no
+        "mediana_ms": statistics.fmean(medianas) * 1e3,
+        "p50_ms": _percentil(ordenados, 0.50) * 1e3,
+        "p99_ms": _percentil(ordenados, 0.99) * 1e3,
+        "muestras": len(ordenados),
+        "rss_pico_mib": _rss_mib(),
+        "rss_base_mib": rss_base,  # intérprete + PIL/NumPy, antes de la primera imagen
+    }
+
+
+def medir(rutas: dict[tuple[str, int, int], Path], paneles, algoritmos, orientaciones,
+          repeticiones: int, rondas: int = 1) -> dict[str, dict]:
+    """
+    Corre el corpus (ya en disco) por cargar_y_empaquetar en toda la matriz, un proceso por caso
+    (algoritmo, panel, tipo y resolución de la fuente); cada caso junta las orientaciones. Los
+    tipos no se mezclan: un p50 sobre ruido y degradado juntos cae entre los dos y no es estable.
+    Los casos van de a uno para que no compitan por la CPU. Con `rondas` > 1 la matriz entera se
+    repite y cada caso se queda con su ronda más rápida: una ráfaga de carga ajena a la medición
+    cae en una sola ronda.
+    """
+    salida: dict[str, dict] = {}
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for _ in range(rondas):
+            for (tipo, ancho_f, alto_f), ruta in rutas.items():
+                for algoritmo in algoritmos:
+                    for ancho, alto in paneles:
+                        clave = f"{algoritmo} {ancho}x{alto} <- {tipo} {ancho_f}x{alto_f}"
+                        m = pool.apply(_medir_caso, (ruta, algoritmo, (ancho, alto), orientaciones, repeticiones))
+                        if clave not in salida or m["mediana_ms"] < salida[clave]["mediana_ms"]:
+                            salida[clave] = m
+    return salida
+
+
+def comparar(actual: dict, base: dict, tolerancia: float, tolerancia_caso: float) -> list[str]:
+    """
+    Regresiones contra la base: la media geométrica de (mediana / mediana base) de cada algoritmo
+    por encima de `tolerancia`, un caso suelto por encima de `tolerancia_caso` o su RSS pico por
+    encima de `tolerancia` (fracciones). Un caso solo dura decenas de ms y en una máquina
+    compartida varía más que el 25%; juntando los de un algoritmo el ruido se promedia.
+    """
+    regresiones = []
+    logs: dict[str, list[float]] = {}
+    for clave, m in actual["casos"].items():
+        ref = base["casos"].get(clave)
+        if ref is None or "mediana_ms" not in ref:  # base de antes de separar por tipo
+            continue
+        logs.setdefault(clave.split()[0], []).append(math.log(m["mediana_ms"] / ref["mediana_ms"]))
+        if m["mediana_ms"] > ref["mediana_ms"] * (1 + tolerancia_caso):
+            regresiones.append(f"{clave}: mediana {m['mediana_ms']:.2f}ms (base {ref['mediana_ms']:.2f}ms)")
+        if "rss_pico_mib" in ref and m["rss_pico_mib"] > ref["rss_pico_mib"] * (1 + tolerancia):
+            regresiones.append(f"{clave}: RSS pico {m['rss_pico_mib']:.1f} MiB (base {ref['rss_pico_mib']:.1f} MiB)")
+    for algoritmo, valores in logs.items():
+        razon = math.exp(statistics.fmean(valores))
+        if razon > 1 + tolerancia:
+            regresiones.append(f"{algoritmo}: {razon:.2f}x la base (media geométrica de {len(valores)} casos)")
+    return regresiones
+
+
+def principal():
+    analizador = argparse.ArgumentParser(
+        description="Tubería de imagen (decodificar → escalar → orientar → difuminar → empaquetar) sobre un "
+                    "corpus sintético en toda la matriz de difuminados, orientaciones y paneles")
+    analizador.add_argument("--repeticiones", type=int, default=5,
+                            help="Corridas por caso y orientación (por defecto: 5)")
+    analizador.add_argument("--rondas", type=int, default=2,
+                            help="Pasadas por la matriz; cada caso se queda con la más rápida (por defecto: 2)")
+    analizador.add_argument("--algoritmos", nargs="+", default=[a for a in difuminado.ALGORITMOS if a != "bayer"],
+                            choices=difuminado.ALGORITMOS)
+    analizador.add_argument("--rapido", action="store_true",
+                            help="Solo la resolución media, rotación 0 y 90 sin espejo (humo)")
+    analizador.add_argument("--guardar-base", metavar="JSON", help="Guarda los resultados como base")
+    analizador.add_argument("--base", metavar="JSON", help="Compara contra una base y falla si hay regresión")
+    analizador.add_argument("--corpus", metavar="DIR",
+                            help="Carpeta donde generar (o reutilizar) el corpus (por defecto: una temporal)")
+    analizador.add_argument("--tolerancia", type=float, default=0.25,
+                            help="Margen por algoritmo y de RSS antes de contar una regresión "
+                                 "(por defecto: 0.25 = 25%%)")
+    analizador.add_argument("--tolerancia-caso", type=float, default=1.0,
+                            help="Margen de un caso suelto (por defecto: 1.0 = el doble)")
+    argumentos = analizador.parse_args()
+
+    resoluciones, orientaciones = RESOLUCIONES, ORIENTACIONES
+    if argumentos.rapido:
+        resoluciones, orientaciones = [RESOLUCIONES[1]], [(0, False), (90, False)]
+
+    # El corpus va a disco antes de medir: generarlo no cuenta en el tiempo ni en la memoria de los casos
+    with tempfile.TemporaryDirectory() as tmp:
+        rutas = corpus.generar(Path(argumentos.corpus or tmp), resoluciones, TIPOS)
+        inicio = time.perf_counter()
+        casos = medir(rutas, PANELES, argumentos.algoritmos, orientaciones, argumentos.repeticiones,
+                      argumentos.rondas)
+    actual = {"casos": casos, "numpy": difuminado.disponible()}
+
+    print(f"{'caso':>44} {'cuadros/s':>10} {'mediana':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MiB':>8}")
+    for clave, m in casos.items():
+        print(f"{clave:>44} {m['cuadros_s']:>10.1f} {m['mediana_ms']:>8.2f} {m['p50_ms']:>8.2f} "
+              f"{m['p99_ms']:>8.2f} {m['rss_pico_mib']:>8.1f}")
+    base_rss = min(m["rss_base_mib"] for m in casos.values())
+    print(f"{len(casos)} casos en {time.perf_counter() - inicio:.1f}s; RSS del intérprete con PIL/NumPy "
+          f"{base_rss:.1f} MiB{'' if actual['numpy'] else ' (sin NumPy: difuminado PIL)'}")
+
+    if argumentos.guardar_base:
+        Path(argumentos.guardar_base).write_text(json.dumps(actual, indent=1, sort_keys=True), encoding="utf-8")
+        print(f"Base guardada en {argumentos.guardar_base}")
+    if argumentos.base:
+        base = json.loads(Path(argumentos.base).read_text(encoding="utf-8"))
+        regresiones = comparar(actual, base, argumentos.tolerancia, argumentos.tolerancia_caso)
+        for r in regresiones:
+            print(f"REGRESIÓN {r}")
+        if regresiones:
+            sys.exit(1)
+        print(f"Sin regresiones contra {argumentos.base} (tolerancia {argumentos.tolerancia:.0%} por algoritmo, "
+              f"{argumentos.tolerancia_caso:.0%} por caso)")
+
+
+if __name__ == "__main__":
+    principal()
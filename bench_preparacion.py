@@ -0,0 +1,73 @@
+from __future__ import annotations
+import argparse
+import io
+import resource
+import statistics
+import time
+
+from PIL import Image, ImageChops
+
+import corpus
+
+from dither import (EspecificacionPantalla, MedicionEtapa, _Cronometro, _cargar_gris, _cargar_gris_referencia)
+
+ROTACIONES = (0, 90, 180, 270)
+
+
+def _correr(fn, jpeg: bytes, spec: EspecificacionPantalla, repeticiones: int):
+    """Mediana por etapa de `repeticiones` corridas; retorna (imagen, {etapa: MedicionEtapa})."""
+    corridas: list[dict[str, MedicionEtapa]] = []
+    for _ in range(repeticiones):
+        etapas: dict[str, MedicionEtapa] = {}
+        inicio = time.perf_counter()
+        img = fn(Image.open(io.BytesIO(jpeg)), spec, _Cronometro(etapas))
+        etapas["total"] = MedicionEtapa(sum(m.cpu_s for m in etapas.values()), time.perf_counter() - inicio,
+                                        max(m.bytes_buffer for m in etapas.values()))
+        corridas.append(etapas)
+    medianas = {
+        etapa: MedicionEtapa(statistics.median(c[etapa].cpu_s for c in corridas),
+                             statistics.median(c[etapa].pared_s for c in corridas),
+                             corridas[0][etapa].bytes_buffer)
+        for etapa in corridas[0]
+    }
+    return img, medianas
+
+
+def _diferencia_media(a: Image.Image, b: Image.Image) -> float:
+    hist = ImageChops.difference(a, b).histogram()
+    return sum(i * n for i, n in enumerate(hist)) / max(1, sum(hist))
+
+
+def principal():
+    analizador = argparse.ArgumentParser(
+        description="Preparación completa (referencia) vs. decodificación reducida + transposiciones, por etapa")
+    analizador.add_argument("--imagen", help="JPEG fuente (por defecto: uno sintético)")
+    analizador.add_argument("--ancho-fuente", type=int, default=2028, help="Ancho del JPEG sintético")
+    analizador.add_argument("--alto-fuente", type=int, default=1520, help="Alto del JPEG sintético")
+    analizador.add_argument("--ancho-pantalla", type=int, default=104)
+    analizador.add_argument("--alto-pantalla", type=int, default=212)
+    analizador.add_argument("--repeticiones", type=int, default=5)
+    argumentos = analizador.parse_args()
+
+    if argumentos.imagen:
+        with open(argumentos.imagen, "rb") as f:
+            jpeg = f.read()
+    else:
+        jpeg = corpus.jpeg("circulos", argumentos.ancho_fuente, argumentos.alto_fuente, calidad=95)
+
+    print(f"{'rot':>4} {'camino':>10} {'etapa':>12} {'cpu ms':>9} {'pared ms':>9} {'búfer KiB':>10}")
+    for rotacion in ROTACIONES:
+        spec = EspecificacionPantalla(argumentos.ancho_pantalla, argumentos.alto_pantalla, rotacion, False)
+        ref, m_ref = _correr(_cargar_gris_referencia, jpeg, spec, argumentos.repeticiones)
+        nueva, m_nueva = _correr(_cargar_gris, jpeg, spec, argumentos.repeticiones)
+        for camino, medidas in (("referencia", m_ref), ("reducida", m_nueva)):
+            for etapa, m in medidas.items():
+                print(f"{rotacion:>4} {camino:>10} {etapa:>12} {m.cpu_s * 1e3:>9.2f} {m.pared_s * 1e3:>9.2f} "
+                      f"{m.bytes_buffer / 1024:>10.0f}")
+        print(f"{rotacion:>4} diferencia media de gris vs. referencia: {_diferencia_media(ref, nueva):.2f}/255; "
+              f"aceleración {m_ref['total'].pared_s / m_nueva['total'].pared_s:.1f}x")
+    print(f"RSS máximo del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    principal()
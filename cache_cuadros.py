@@ -0,0 +1,155 @@
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from utilidades import escribir_atomico
+
+# Cambiar al modificar el pipeline de imagen: invalida todo lo guardado antes
+_VERSION = 3
+
+
+class CacheCuadros:
+    """
+    Caché de cuadros ya preparados (bytes empaquetados + PNG de vista previa).
+
+    La clave combina el hash del contenido de la fuente con la geometría de la pantalla y el
+    difuminado, así que renombrar o copiar la imagen no invalida nada. El hash se memoriza por
+    (ruta, mtime, tamaño) para no releer el archivo en cada ciclo.
+    Dos niveles: LRU en memoria y un directorio en disco, ambos con límite en bytes.
+    """
+
+    def __init__(self, directorio: Path | None, max_bytes_memoria: int = 8 << 20,
+                 max_bytes_disco: int = 64 << 20):
+        self.directorio = directorio
+        self.max_bytes_memoria = max_bytes_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self._memoria: OrderedDict[str, tuple[bytes, bytes | None]] = OrderedDict()
+        self._bytes_memoria = 0
+        self._huellas: dict[tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        if directorio is not None:
+            directorio.mkdir(parents=True, exist_ok=True)
+
+    # --- Claves ---
+    def huella_fuente(self, ruta: Path) -> str:
+        st = ruta.stat()
+        rapida = (str(ruta.resolve()), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            huella = self._huellas.get(rapida)
+        if huella is None:
+            h = hashlib.sha256()
+            with open(ruta, "rb") as f:
+                for bloque in iter(lambda: f.read(1 << 16), b""):
+                    h.update(bloque)
+            huella = h.hexdigest()
+            with self._lock:
+                self._huellas[rapida] = huella
+        return huella
+
+    def clave(self, ruta: Path, ancho: int, alto: int, rotacion: int, espejo: bool, difuminado: str) -> str:
+        partes = f"{_VERSION}|{self.huella_fuente(ruta)}|{ancho}x{alto}|{rotacion}|{int(espejo)}|{difuminado}"
+        return hashlib.sha256(partes.encode("utf-8")).hexdigest()[:32]
+
+    # --- Lectura / escritura ---
+    def obtener(self, clave: str) -> tuple[bytes, bytes | None] | None:
+        """Retorna (datos, png_vista) o None."""
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return entrada
+
+        entrada = self._leer_disco(clave)
+        with self._lock:
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self.aciertos_disco += 1
+        self._guardar_memoria(clave, entrada)
+        return entrada
+
+    def guardar(self, clave: str, datos: bytes, png_vista: bytes | None = None) -> None:
+        self._guardar_memoria(clave, (datos, png_vista))
+        if self.directorio is None:
+            return
+        try:
+            escribir_atomico(self.directorio / f"{clave}.bin", datos)
+            if png_vista is not None:
+                escribir_atomico(self.directorio / f"{clave}.png", png_vista)
+            self._podar_disco()
+        except OSError as e:
+            logging.warning(f"[Cache] No se pudo guardar en disco: {e}")
+
+    def estadisticas(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "entradas_memoria": len(self._memoria),
+                "bytes_memoria": self._bytes_memoria,
+            }
+
+    # --- Internos ---
+    def _guardar_memoria(self, clave: str, entrada: tuple[bytes, bytes | None]) -> None:
+        tam = _tam(entrada)
+        if tam > self.max_bytes_memoria:
+            return
+        with self._lock:
+            anterior = self._memoria.pop(clave, None)
+            if anterior is not None:
+                self._bytes_memoria -= _tam(anterior)
+            self._memoria[clave] = entrada
+            self._bytes_memoria += tam
+            while self._bytes_memoria > self.max_bytes_memoria:
+                _, viejo = self._memoria.popitem(last=False)
+                self._bytes_memoria -= _tam(viejo)
+
+    def _leer_disco(self, clave: str) -> tuple[bytes, bytes | None] | None:
+        if self.directorio is None:
+            return None
+        ruta_bin = self.directorio / f"{clave}.bin"
+        ruta_png = self.directorio / f"{clave}.png"
+        try:
+            datos = ruta_bin.read_bytes()
+            os.utime(ruta_bin)  # marca de uso para la poda LRU
+        except OSError:
+            return None
+        try:
+            png = ruta_png.read_bytes()
+        except OSError:
+            png = None
+        return datos, png
+
+    def _podar_disco(self) -> None:
+        """Borra las entradas menos usadas (por mtime) hasta quedar bajo `max_bytes_disco`."""
+        assert self.directorio is not None
+        entradas: dict[str, list] = {}
+        for ruta in self.directorio.iterdir():
+            if ruta.suffix not in (".bin", ".png"):
+                continue
+            st = ruta.stat()
+            e = entradas.setdefault(ruta.stem, [0.0, 0, []])
+            if ruta.suffix == ".bin":
+                e[0] = st.st_mtime
+            e[1] += st.st_size
+            e[2].append(ruta)
+        total = sum(e[1] for e in entradas.values())
+        for _, tam, rutas in sorted(entradas.values(), key=lambda e: e[0]):
+            if total <= self.max_bytes_disco:
+                break
+            for ruta in rutas:
+                ruta.unlink(missing_ok=True)
+            total -= tam
+
+
+def _tam(entrada: tuple[bytes, bytes | None]) -> int:
+    return len(entrada[0]) + (len(entrada[1]) if entrada[1] is not None else 0)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+import io
+import logging
+import shutil
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+from utilidades import ABORTO, esperar_proceso
+
+_EJECUTABLES_STILL = ("rpicam-still", "libcamera-still")
+_EJECUTABLES_VID = ("rpicam-vid", "libcamera-vid")
+_SOI, _EOI = b"\xff\xd8", b"\xff\xd9"
+
+
+@lru_cache(maxsize=None)
+def resolver_ejecutable(candidatos: tuple[str, ...]) -> str:
+    """Primer ejecutable disponible en el PATH; se resuelve una sola vez por proceso."""
+    for ejecutable in candidatos:
+        if shutil.which(ejecutable):
+            return ejecutable
+    raise RuntimeError(f"{' o '.join(candidatos)} no encontrado")
+
+
+class Camara(ABC):
+    """Interfaz común: `capturar()` devuelve un JPEG en memoria; `capturar_imagen()` una imagen PIL."""
+
+    def iniciar(self) -> "Camara":
+        return self
+
+    def detener(self) -> None:
+        pass
+
+    @abstractmethod
+    def capturar(self) -> bytes:
+        """Una foto como JPEG en memoria."""
+
+    def capturar_imagen(self) -> Image.Image:
+        # Sin load(): así el preparador puede pedir decodificación reducida (draft) del JPEG
+        return Image.open(io.BytesIO(self.capturar()))
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.detener()
+
+
+class CamaraRpicamStill(Camara):
+    """Una invocación de rpicam-still por foto, pero con JPEG por stdout (sin pasar por disco)."""
+
+    def __init__(self, ancho: int = 800, alto: int = 600, calentamiento_ms: int = 1000):
+        self.ancho = ancho
+        self.alto = alto
+        self.calentamiento_ms = calentamiento_ms
+
+    def capturar(self) -> bytes:
+        comando = [resolver_ejecutable(_EJECUTABLES_STILL), "-n", "-o", "-", "-t", str(self.calentamiento_ms),
+                   "--width", str(self.ancho), "--height", str(self.alto), "-q", "95"]
+        proc = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        # El lector drena stdout mientras esperar_proceso bloquea en el proceso o en un abort
+        salida: list[bytes] = []
+        lector = threading.Thread(target=lambda: salida.append(proc.stdout.read()), daemon=True)
+        lector.start()
+        codigo = esperar_proceso(proc)
+        lector.join()
+        if codigo != 0:
+            raise subprocess.CalledProcessError(codigo, comando)
+        return salida[0]
+
+
+class CamaraRpicamVid(Camara):
+    """
+    Cámara siempre caliente: un rpicam-vid de larga vida emite MJPEG por stdout y un hilo lector
+    conserva el último cuadro completo. Capturar es tomar ese cuadro (decenas de ms), sin
+    arranque del sensor ni ida y vuelta al disco.
+    """
+
+    def __init__(self, ancho: int = 800, alto: int = 600, fps: int = 10, espera_s: float = 5.0):
+        self.ancho = ancho
+        self.alto = alto
+        self.fps = fps
+        self.espera_s = espera_s
+        self._proc: subprocess.Popen | None = None
+        self._hilo: threading.Thread | None = None
+        self._cond = threading.Condition()
+        self._ultimo: bytes | None = None
+        self._t_ultimo = 0.0
+        self.cuadros = 0
+
+    def iniciar(self) -> "CamaraRpicamVid":
+        if self._proc is not None:
+            return self
+        comando = [resolver_ejecutable(_EJECUTABLES_VID), "-n", "-t", "0", "--codec", "mjpeg",
+                   "--width", str(self.ancho), "--height", str(self.alto),
+                   "--framerate", str(self.fps), "-o", "-"]
+        self._proc = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        self._hilo = threading.Thread(target=self._leer, name="CamaraMJPEG", daemon=True)
+        self._hilo.start()
+        logging.info(f"[Cámara] Flujo MJPEG {self.ancho}x{self.alto}@{self.fps} iniciado")
+        return self
+
+    def detener(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=2.0)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._hilo is not None:
+            self._hilo.join(timeout=2.0)
+            self._hilo = None
+
+    def capturar(self) -> bytes:
+        """Último cuadro si es de hace menos de dos periodos; si no, espera el siguiente."""
+        if self._proc is None:
+            self.iniciar()
+        max_edad = 2.0 / self.fps
+        limite = time.monotonic() + self.espera_s
+        with self._cond:
+            while self._ultimo is None or time.monotonic() - self._t_ultimo > max_edad:
+                if ABORTO.cancelado:
+                    raise InterruptedError("captura interrumpida por abort")
+                restante = limite - time.monotonic()
+                if restante <= 0 or self._proc is None:
+                    raise RuntimeError("La cámara no entregó cuadros a tiempo")
+                self._cond.wait(min(restante, 2.0 / self.fps))
+            return self._ultimo
+
+    def _leer(self) -> None:
+        proc = self._proc
+        assert proc is not None and proc.stdout is not None
+        buf = bytearray()
+        while True:
+            trozo = proc.stdout.read(65536)
+            if not trozo:
+                break
+            buf += trozo
+            while True:
+                inicio = buf.find(_SOI)
+                if inicio < 0:
+                    buf.clear()
+                    break
+                fin = buf.find(_EOI, inicio + 2)
+                if fin < 0:
+                    del buf[:inicio]
+                    break
+                cuadro = bytes(buf[inicio:fin + 2])
+                del buf[:fin + 2]
+                with self._cond:
+                    self._ultimo = cuadro
+                    self._t_ultimo = time.monotonic()
+                    self.cuadros += 1
+                    self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+        logging.debug("[Cámara] Flujo MJPEG terminado")
+
+
+class CamaraFalsa(Camara):
+    """Para pruebas y modo prueba: devuelve siempre la misma imagen (archivo o sintética)."""
+
+    def __init__(self, ancho: int = 800, alto: int = 600, ruta: str | None = None):
+        if ruta is not None:
+            with open(ruta, "rb") as f:
+                self._jpeg = f.read()
+        else:
+            img = Image.linear_gradient("L").resize((ancho, alto))
+            ImageDraw.Draw(img).ellipse((ancho // 4, alto // 4, 3 * ancho // 4, 3 * alto // 4), outline=0, width=8)
+            salida = io.BytesIO()
+            img.save(salida, format="JPEG", quality=95)
+            self._jpeg = salida.getvalue()
+        self.capturas = 0
+
+    def capturar(self) -> bytes:
+        self.capturas += 1
+        return self._jpeg
+
+
+CAMARAS = {"still": CamaraRpicamStill, "vid": CamaraRpicamVid, "falsa": CamaraFalsa}
+
+
+def crear_camara(tipo: str, ancho: int = 800, alto: int = 600) -> Camara:
+    try:
+        return CAMARAS[tipo](ancho=ancho, alto=alto)
+    except KeyError:
+        raise ValueError(f"cámara desconocida: {tipo!r} (opciones: {', '.join(CAMARAS)})") from None
@@ -1,4 +1,9 @@
 # Notas / figuras y utilidades musicales
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable
+
 DO, RE, MI, FA, SOL, LA, SI = 0, 2, 4, 5, 7, 9, 11
 NATURAL, SOSTENIDO, BEMOL = 0, +1, -1
 (
@@ -19,15 +24,18 @@ F_MIN, F_MAX = 30.0, 3000.0
 PULSE_MIN_US = 3
 
 
-def duracion_ms(figura: int) -> int:
-    negra = 60000.0 / EM.bpm
-    factor = {
-        REDONDA: 4, BLANCA: 2, NEGRA: 1, CORCHEA: 0.5,
-        SEMICORCHEA: 0.25, FUSA: 0.125, SEMIFUSA: 0.0625,
-        P_REDONDA: 6, P_BLANCA: 3, P_NEGRA: 1.5, P_CORCHEA: 0.75,
-        T_NEGRA: (2/3), T_CORCHEA: (1/3), T_SEMICORCHEA: (0.5/3),
-    }.get(figura, 1)
-    return int(negra * factor)
+# Figura → negras que dura
+FACTORES = {
+    REDONDA: 4, BLANCA: 2, NEGRA: 1, CORCHEA: 0.5,
+    SEMICORCHEA: 0.25, FUSA: 0.125, SEMIFUSA: 0.0625,
+    P_REDONDA: 6, P_BLANCA: 3, P_NEGRA: 1.5, P_CORCHEA: 0.75,
+    T_NEGRA: (2/3), T_CORCHEA: (1/3), T_SEMICORCHEA: (0.5/3),
+}
+
+
+def duracion_ms(figura: int, bpm: float | None = None) -> int:
+    negra = 60000.0 / (EM.bpm if bpm is None else bpm)
+    return int(negra * FACTORES.get(figura, 1))
 
 
 def midi_a_hz(m: int) -> float:
@@ -37,6 +45,82 @@ def midi_a_hz(m: int) -> float:
 def nota_a_midi(n: int, octava: int, alt: int = NATURAL) -> int:
     return 12 * (octava + 1) + (int(n) + int(alt))
 
+
+def hz_a_medio_periodo_us(hz: float) -> int:
+    """Semiperiodo del pulso STEP para `hz`, acotado a F_MIN..F_MAX y a PULSE_MIN_US."""
+    f = max(F_MIN, min(F_MAX, float(hz)))
+    return max(PULSE_MIN_US, int(round(1_000_000.0 / (2.0 * f))))
+
+
+# --- Partitura compilada ---
+@dataclass(frozen=True)
+class LineaTiempo:
+    """
+    Partitura lista para tocar: un evento por nota/silencio en arreglos compactos.
+    medio_periodo_us = 0 es silencio. No modificar: las instancias se comparten desde la caché.
+    Con `voces` (polifonía) cada arreglo es una voz y el motor i toca voces[i % len(voces)];
+    medio_periodo_us queda como la primera voz.
+    """
+    medio_periodo_us: array  # 'I'
+    duracion_us: array       # 'I'
+    direccion: array         # 'B' (1 = dirección alta)
+    voces: tuple | None = None  # tuple[array('I'), ...]
+
+    def __len__(self) -> int:
+        return len(self.duracion_us)
+
+    @property
+    def duracion_total_us(self) -> int:
+        return sum(self.duracion_us)
+
+
+class Grabadora:
+    """Hace las veces de Motores para registrar una pieza en vez de tocarla."""
+
+    def __init__(self, bpm: float, transposicion: int, direccion_inicial: bool):
+        self.bpm = bpm
+        self.transposicion = transposicion
+        self.direccionAlta = direccion_inicial
+        self.medios: list[tuple[int, ...]] = []
+        self.duracion_us = array("I")
+        self.direccion = array("B")
+
+    def _evento(self, medios_us: tuple[int, ...], figura: int) -> None:
+        self.medios.append(medios_us)
+        self.duracion_us.append(duracion_ms(figura, self.bpm) * 1000)  # mismo redondeo que en vivo
+        self.direccion.append(1 if self.direccionAlta else 0)
+
+    def _medio(self, n: int, octava: int, alt: int = NATURAL) -> int:
+        return hz_a_medio_periodo_us(midi_a_hz(nota_a_midi(n, octava, alt) + self.transposicion))
+
+    def linea(self) -> LineaTiempo:
+        n_voces = max((len(m) for m in self.medios), default=1)
+        voces = tuple(array("I", (m[v % len(m)] for m in self.medios)) for v in range(n_voces))
+        return LineaTiempo(voces[0], self.duracion_us, self.direccion, voces if n_voces > 1 else None)
+
+    def nota(self, n: int, octava: int, figura: int, alt: int = 0) -> None:
+        self._evento((self._medio(n, octava, alt),), figura)
+        self.direccionAlta = not self.direccionAlta
+
+    def silencio(self, figura: int) -> None:
+        self._evento((0,), figura)
+
+    def acorde(self, notas, figura: int) -> None:
+        self._evento(tuple(self._medio(*n) for n in notas), figura)
+        self.direccionAlta = not self.direccionAlta
+
+
+@lru_cache(maxsize=32)
+def compilar_partitura(pieza: Callable, bpm: float, transposicion: int = 0,
+                       direccion_inicial: bool = False) -> LineaTiempo:
+    """
+    Ejecuta una pieza escrita con m.nota()/m.silencio() contra una grabadora y devuelve su
+    LineaTiempo. Memorizada por (pieza, bpm, transposicion, direccion_inicial).
+    """
+    g = Grabadora(bpm, transposicion, direccion_inicial)
+    pieza(g)
+    return g.linea()
+
 # Partitura (un pase)
 _alternarDireccion = False
 
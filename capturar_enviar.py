@@ -3,26 +3,26 @@ import argparse
 import subprocess
 from pathlib import Path
 
-from dither import EspecificacionPantalla, cargar_y_preparar, empaquetar_bn_bit_mas_significativo_primero
-from enviar_serial import abrir_serial, enviar_limpiar, enviar_cuadro_bn, enviar_dormir
+from artefactos import EscritorArtefactos, png
+from camara import resolver_ejecutable
+from difuminado import ALGORITMOS
+from dither import EspecificacionPantalla, cargar_y_empaquetar
+from enviar_serial import (ESTADISTICAS, abrir_serial, consultar_tramas, control_flujo, enviar_limpiar,
+                           enviar_cuadro_bn, enviar_cuadro_tramas, enviar_dormir, negociar_baudios,
+                           restaurar_baudios)
+from utilidades import esperar_proceso
 
 
 def capturar_con_rpicam(ruta_salida: Path, ancho: int, alto: int) -> None:
-    """Captura foto usando rpicam-still."""
-    comando_base = None
-    for ejecutable in ["rpicam-still", "libcamera-still"]:
-        if subprocess.run(["which", ejecutable], capture_output=True).returncode == 0:
-            comando_base = ejecutable
-            break
-    
-    if not comando_base:
-        raise RuntimeError("rpicam-still o libcamera-still no encontrado")
-    
+    """Captura foto usando rpicam-still (el ejecutable se resuelve una sola vez)."""
+    comando_base = resolver_ejecutable(("rpicam-still", "libcamera-still"))
     comando = [comando_base, "-n", "-o", str(ruta_salida), "-t", "1000",
                "--width", str(ancho), "--height", str(alto), "-q", "95"]
-    
+
     print(f"Capturando con {comando_base}...")
-    subprocess.run(comando, check=True)
+    codigo = esperar_proceso(subprocess.Popen(comando))  # se corta ante abort
+    if codigo != 0:
+        raise subprocess.CalledProcessError(codigo, comando)
 
 
 def principal():
@@ -31,7 +31,7 @@ def principal():
     analizador.add_argument("--imagen", help="Usa imagen existente en lugar de capturar")
     analizador.add_argument("--capturar", action="store_true", help="Captura nueva foto desde la cámara")
     analizador.add_argument("--salida", default="out", help="Directorio de salida (por defecto: out)")
-    analizador.add_argument("--difuminado", choices=["floyd", "bayer", "ninguno"], default="floyd",
+    analizador.add_argument("--difuminado", choices=ALGORITMOS, default="floyd",
                     help="Algoritmo de difuminado (por defecto: floyd)")
     analizador.add_argument("--rotacion", type=int, default=0, choices=[0, 90, 180, 270],
                     help="Ángulo de rotación (por defecto: 0)")
@@ -39,6 +39,11 @@ def principal():
     analizador.add_argument("--ancho-pantalla", type=int, default=104, help="Ancho de pantalla (por defecto: 104)")
     analizador.add_argument("--alto-pantalla", type=int, default=212, help="Alto de pantalla (por defecto: 212)")
     analizador.add_argument("--enviar", action="store_true", help="Enviar a pantalla de tinta electrónica")
+    analizador.add_argument("--baud", type=int, default=115200, help="Velocidad inicial del serial (por defecto: 115200)")
+    analizador.add_argument("--baud-max", type=int,
+                            help="Negocia la mayor velocidad hasta este valor y envía con control de flujo")
+    analizador.add_argument("--tramas", action="store_true",
+                            help="Envía en bloques con CRC y reenvío selectivo si el firmware lo admite")
     analizador.add_argument("--limpiar", action="store_true",
                     help="Limpiar pantalla antes de enviar (NO recomendado - causa problemas)")
     argumentos = analizador.parse_args()
@@ -63,39 +68,59 @@ def principal():
 
     # Procesa imagen
     print(f"Cargando y difuminando {ruta_fuente}...")
-    imagen_1bit = cargar_y_preparar(str(ruta_fuente), pantalla, difuminado=argumentos.difuminado)
-
-    # Guarda vista previa y binario
-    ruta_vista_previa = directorio_salida / "vista_previa_1bit.png"
-    imagen_1bit.save(ruta_vista_previa)
-    print(f"Vista previa guardada: {ruta_vista_previa}")
-
-    datos = empaquetar_bn_bit_mas_significativo_primero(imagen_1bit)
-    ruta_binario = directorio_salida / "cuadro_bn.bin"
-    ruta_binario.write_bytes(datos)
-    print(f"Cuadro escrito: {ruta_binario} ({len(datos)} bytes)")
-
-    # Envía a pantalla
-    if argumentos.enviar:
-        if not argumentos.puerto:
-            analizador.error("--enviar requiere --puerto")
-        
-        print(f"Abriendo serial {argumentos.puerto}...")
-        conexion_serial = abrir_serial(argumentos.puerto, 115200)
-        try:
-            # Limpieza opcional (no recomendado)
-            if argumentos.limpiar:
-                print("ADVERTENCIA: Limpiar puede causar problemas de visualización")
-                print("Limpiando pantalla...")
-                print("CONFIRMACIÓN:", enviar_limpiar(conexion_serial))
-            
-            # Envía cuadro
-            print("Enviando cuadro...")
-            print("CONFIRMACIÓN:", enviar_cuadro_bn(conexion_serial, datos))
-        finally:
-            conexion_serial.close()
-            print("Serial cerrado.")
+    imagen_1bit, datos = cargar_y_empaquetar(str(ruta_fuente), pantalla, difuminado=argumentos.difuminado)
+
+    # Vista previa y binario: en segundo plano, con historial rotativo en <salida>/historial
+    artefactos = EscritorArtefactos(directorio_salida)
+    archivos = {"vista_previa_1bit.png": png(imagen_1bit), "cuadro_bn.bin": datos}
+    if argumentos.capturar and not argumentos.imagen:
+        archivos["captura.jpg"] = ruta_fuente
+    artefactos.guardar(archivos, ultimos=("vista_previa_1bit.png", "cuadro_bn.bin"))
+    print(f"Vista previa: {directorio_salida / 'vista_previa_1bit.png'}")
+    print(f"Cuadro: {directorio_salida / 'cuadro_bn.bin'} ({len(datos)} bytes)")
+
+    try:
+        # Envía a pantalla
+        if argumentos.enviar:
+            _enviar(argumentos, analizador, datos)
+    finally:
+        artefactos.cerrar()
+
 
+def _enviar(argumentos, analizador, datos: bytes) -> None:
+    if not argumentos.puerto:
+        analizador.error("--enviar requiere --puerto")
+
+    print(f"Abriendo serial {argumentos.puerto}...")
+    conexion_serial = abrir_serial(argumentos.puerto, argumentos.baud)
+    try:
+        if argumentos.baud_max:
+            baudios = negociar_baudios(conexion_serial, argumentos.baud_max)
+            flujo = control_flujo(conexion_serial)
+            print(f"Enlace a {baudios} baudios" + (f", bloques de {flujo.bloque} bytes" if flujo else
+                                                   " (firmware sin negociación)"))
+
+        # Limpieza opcional (no recomendado)
+        if argumentos.limpiar:
+            print("ADVERTENCIA: Limpiar puede causar problemas de visualización")
+            print("Limpiando pantalla...")
+            print("CONFIRMACIÓN:", enviar_limpiar(conexion_serial))
+
+        # Envía cuadro
+        print("Enviando cuadro...")
+        if argumentos.tramas and consultar_tramas(conexion_serial):
+            res = enviar_cuadro_tramas(conexion_serial, datos)
+            print("CONFIRMACIÓN:", res.confirmacion)
+            print(f"Transferencia: {res.bytes_por_s / 1024:.1f} KiB/s, útil {res.goodput / 1024:.1f} KiB/s, "
+                  f"{res.retransmitidos} bloques reenviados")
+        else:
+            print("CONFIRMACIÓN:", enviar_cuadro_bn(conexion_serial, datos))
+            print(f"Transferencia: {ESTADISTICAS.registros('S')[-1].bytes_s / 1024:.1f} KiB/s")
+    finally:
+        if argumentos.baud_max:
+            restaurar_baudios(conexion_serial, argumentos.baud)
+        conexion_serial.close()
+        print("Serial cerrado.")
 
 if __name__ == "__main__":
     principal()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import re
+
+# Corridas de 3+ bytes iguales: por debajo de eso PackBits no ahorra nada
+_CORRIDA = re.compile(rb"(.)\1{2,}", re.DOTALL)
+
+
+def comprimir_packbits(datos: bytes) -> bytes:
+    """
+    Codifica en PackBits (variante TIFF), orientado a cuadros 1-bit con muchas corridas 0x00/0xFF.
+    Cabecera n (byte con signo): 0..127 → siguen n+1 bytes literales; -1..-127 → el byte
+    siguiente se repite 1-n veces; -128 no se usa.
+    """
+    salida = bytearray()
+    pos = 0
+    for m in _CORRIDA.finditer(datos):
+        _literales(salida, datos[pos:m.start()])
+        byte = m.group(1)
+        restante = m.end() - m.start()
+        while restante > 0:
+            k = min(restante, 128)
+            if k == 1:
+                _literales(salida, byte)
+            else:
+                salida.append(257 - k)  # -(k-1) en complemento a dos
+                salida += byte
+            restante -= k
+        pos = m.end()
+    _literales(salida, datos[pos:])
+    return bytes(salida)
+
+
+def _literales(salida: bytearray, trozo: bytes) -> None:
+    for i in range(0, len(trozo), 128):
+        bloque = trozo[i:i + 128]
+        salida.append(len(bloque) - 1)
+        salida += bloque
+
+
+def descomprimir_packbits(datos: bytes, tam_salida: int | None = None) -> bytes:
+    """Inverso de comprimir_packbits. Si se da `tam_salida`, verifica el tamaño decodificado."""
+    salida = bytearray()
+    i = 0
+    n = len(datos)
+    while i < n:
+        h = datos[i]
+        i += 1
+        if h < 128:
+            if i + h + 1 > n:
+                raise ValueError("PackBits truncado (literales)")
+            salida += datos[i:i + h + 1]
+            i += h + 1
+        elif h > 128:
+            if i >= n:
+                raise ValueError("PackBits truncado (corrida)")
+            salida += datos[i:i + 1] * (257 - h)
+            i += 1
+    if tam_salida is not None and len(salida) != tam_salida:
+        raise ValueError(f"PackBits decodificó {len(salida)} bytes (esperado {tam_salida})")
+    return bytes(salida)
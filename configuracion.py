@@ -3,11 +3,15 @@ from dataclasses import dataclass
 from pathlib import Path
 import argparse
 
+from difuminado import ALGORITMOS
+
 
 @dataclass
 class Config:
     puerto_epd: str
     baud: int
+    baud_max: int | None  # None → sin negociación (siempre --baud, escritura de una vez)
+    tramas: bool         # cuadros en bloques con CRC y reenvío selectivo ('F') si el firmware lo admite
     pantalla_ancho: int
     pantalla_alto: int
     rotacion: int
@@ -21,26 +25,84 @@ class Config:
     gpiochip: str | int  # "auto" | 0..7
     pin_enable: int | None
     espera_epd: float
+    final: str           # qué termina antes de limpiar/dormir: "cancion" | "todo"
+    delta: bool          # envía solo las filas que cambiaron (refresco parcial)
+    comprimir: bool      # cuadros en PackBits ('Z') cuando ocupan menos que crudos
+    cache: bool          # reutiliza cuadros ya preparados de la misma fuente
+    cache_max_mb: float
+    camara: str          # "archivo" (rpicam-still → captura.jpg) | "still" | "vid" | "falsa"
+    partitura: Path | None  # .mid/.midi o texto; None → canción incluida
+    servicio: bool       # queda residente y atiende ciclos por socket UNIX
+    socket: str
+    cola: int
+    ciclos: int          # >1 → ciclos en tubería (prepara el siguiente mientras suena el actual)
+    profundidad: int
+    pantallas: Path | None  # JSON con varias EPD (puerto + geometría cada una)
+    hilos_epd: int
+    historial: int       # entradas en <salida>/historial (0 = solo los últimos archivos)
+    historial_max_mb: float
+    perfil: Path | None  # JSON-lines con los tiempos por etapa de cada ciclo
+    perfil_prometheus: Path | None  # textfile para el node_exporter
 
 
 def build_argparser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Foto → EPD → Canción → Limpiar/Sleep")
     ap.add_argument("--puerto", default="/dev/ttyACM0", help="Puerto serial EPD (p.ej. /dev/ttyACM0)")
-    ap.add_argument("--baud", type=int, default=115200)
+    ap.add_argument("--baud", type=int, default=115200, help="Velocidad inicial del enlace (la del arranque del firmware)")
+    ap.add_argument("--baud-max", type=int,
+                    help="Negocia con el firmware la mayor velocidad hasta este valor y escritura con control "
+                         "de flujo (p.ej. 921600); un firmware sin negociación sigue a --baud")
+    ap.add_argument("--tramas", action="store_true",
+                    help="Cuadros en bloques con CRC y reenvío solo de los dañados, si el firmware lo admite "
+                         "(si no, 'S' de siempre)")
     ap.add_argument("--imagen", help="Ruta a imagen existente en vez de capturar")
     ap.add_argument("--capturar", action="store_true", help="Capturar con rpicam/libcamera")
-    ap.add_argument("--difuminado", choices=["floyd", "bayer", "ninguno"], default="floyd")
+    ap.add_argument("--camara", choices=["archivo", "still", "vid", "falsa"], default="archivo",
+                    help="Backend de captura: archivo (rpicam-still a captura.jpg), still (JPEG por stdout), "
+                         "vid (flujo MJPEG siempre caliente) o falsa (imagen sintética)")
+    ap.add_argument("--difuminado", choices=ALGORITMOS, default="floyd",
+                    help="floyd, floyd-exacto, atkinson, bayer2/4/8 (bayer = 4x4) o ninguno (umbral)")
     ap.add_argument("--rotacion", type=int, default=0, choices=[0, 90, 180, 270])
     ap.add_argument("--espejo", action="store_true")
     ap.add_argument("--ancho-pantalla", type=int, default=104)
     ap.add_argument("--alto-pantalla", type=int, default=212)
     ap.add_argument("--bpm", type=float, default=70.0, help="Tempo de la canción (default 70)")
+    ap.add_argument("--partitura", help="Partitura a tocar: MIDI (.mid) o texto (RE4 NEGRA; SIL CORCHEA...)")
     ap.add_argument("--sleep", dest="sleep_epd", action="store_true", help="Dormir la EPD al final (opt-in)")
     ap.add_argument("--salida", default="out", help="Carpeta de salida para capturas y preview")
     ap.add_argument("--modo-prueba", action="store_true", help="Modo prueba: salta serial/GPIO para validar flujo")
     ap.add_argument("--gpiochip", default="auto", help='"auto" o índice 0..7')
     ap.add_argument("--pin-enable", type=int, default=None, help="GPIO opcional para ENABLE de DRV8825")
-    ap.add_argument("--espera-epd", type=float, default=3.0, help="Segundos de espera tras enviar imagen")
+    ap.add_argument("--espera-epd", type=float, default=3.0, help="Plazo (s) para que la EPD confirme el cuadro tras la canción, "
+                         "antes de limpiar/dormir")
+    ap.add_argument("--final", choices=["cancion", "todo"], default="cancion",
+                    help="Qué debe terminar antes de limpiar/dormir: la canción (y la EPD con --espera-epd de "
+                         "plazo) o la canción y la confirmación de la EPD sin plazo (por defecto: cancion)")
+    ap.add_argument("--delta", action="store_true",
+                    help="Envía solo la franja de filas que cambió respecto al cuadro anterior (refresco parcial)")
+    ap.add_argument("--comprimir", action="store_true",
+                    help="Envía los cuadros comprimidos (PackBits) si así ocupan menos; si no, crudos")
+    ap.add_argument("--cache", action="store_true",
+                    help="Guarda los cuadros preparados en <salida>/cache y los reutiliza si la fuente no cambió")
+    ap.add_argument("--cache-max-mb", type=float, default=64.0, help="Tamaño máximo de la caché en disco (MB)")
+    ap.add_argument("--servicio", action="store_true",
+                    help="Modo servicio: inicializa todo una vez y ejecuta ciclos pedidos por socket UNIX")
+    ap.add_argument("--socket", default="/tmp/oraculo.sock", help="Socket UNIX del modo servicio")
+    ap.add_argument("--cola", type=int, default=2, help="Ciclos pendientes máximos en modo servicio (contrapresión)")
+    ap.add_argument("--ciclos", type=int, default=1,
+                    help="Ciclos seguidos; con más de uno el siguiente cuadro se prepara mientras suena el actual")
+    ap.add_argument("--profundidad", type=int, default=1, help="Cuadros preparados en espera en la tubería")
+    ap.add_argument("--pantallas", help="JSON con varias EPD: [{\"puerto\", \"ancho\", \"alto\", \"rotacion\", "
+                                        "\"espejo\", \"difuminado\"}, ...]; reemplaza --puerto y la geometría")
+    ap.add_argument("--hilos-epd", type=int, default=4, help="Envíos simultáneos máximos con --pantallas")
+    ap.add_argument("--historial", type=int, default=20,
+                    help="Ciclos guardados en <salida>/historial (vista, cuadro, captura); 0 = solo el último")
+    ap.add_argument("--historial-max-mb", type=float, default=64.0, help="Tamaño máximo del historial (MB)")
+    ap.add_argument("--perfil", nargs="?", const="", default=None, metavar="JSONL",
+                    help="Registra los tiempos por etapa de cada ciclo, una línea JSON por ciclo "
+                         "(por defecto <salida>/perfil.jsonl)")
+    ap.add_argument("--perfil-prometheus", metavar="PROM",
+                    help="Además escribe las métricas del último ciclo en este textfile de Prometheus")
     return ap
 
 
@@ -55,9 +117,28 @@ def parse_config() -> tuple[Config, str]:
             raise FileNotFoundError(f"Imagen no encontrada: {p}")
         ruta_imagen = p
 
+    partitura = None
+    if args.partitura:
+        partitura = Path(args.partitura).resolve()
+        if not partitura.exists():
+            raise FileNotFoundError(f"Partitura no encontrada: {partitura}")
+
+    pantallas = None
+    if args.pantallas:
+        pantallas = Path(args.pantallas).resolve()
+        if not pantallas.exists():
+            raise FileNotFoundError(f"Configuración de pantallas no encontrada: {pantallas}")
+
+    # --perfil-prometheus sin --perfil activa el perfil con la ruta por defecto
+    perfil = None
+    if args.perfil is not None or args.perfil_prometheus:
+        perfil = Path(args.perfil) if args.perfil else Path(args.salida) / "perfil.jsonl"
+
     cfg = Config(
         puerto_epd=args.puerto,
         baud=args.baud,
+        baud_max=args.baud_max,
+        tramas=bool(args.tramas),
         pantalla_ancho=args.ancho_pantalla,
         pantalla_alto=args.alto_pantalla,
         rotacion=args.rotacion,
@@ -71,5 +152,23 @@ def parse_config() -> tuple[Config, str]:
         gpiochip=args.gpiochip,
         pin_enable=args.pin_enable,
         espera_epd=args.espera_epd,
+        final=args.final,
+        delta=bool(args.delta),
+        comprimir=bool(args.comprimir),
+        cache=bool(args.cache),
+        cache_max_mb=args.cache_max_mb,
+        camara=args.camara,
+        partitura=partitura,
+        servicio=bool(args.servicio),
+        socket=args.socket,
+        cola=args.cola,
+        ciclos=max(1, args.ciclos),
+        profundidad=max(1, args.profundidad),
+        pantallas=pantallas,
+        hilos_epd=max(1, args.hilos_epd),
+        historial=max(0, args.historial),
+        historial_max_mb=args.historial_max_mb,
+        perfil=perfil,
+        perfil_prometheus=Path(args.perfil_prometheus) if args.perfil_prometheus else None,
     )
     return cfg, args.difuminado
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import io
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Imágenes sintéticas para los benchmarks, reproducibles por semilla
+TIPOS = ("circulos", "foto", "degradado", "texto", "ruido")
+
+
+def _circulos(ancho: int, alto: int, rnd: random.Random) -> Image.Image:
+    """Degradado con círculos: rampa de grises + bordes duros."""
+    img = Image.linear_gradient("L").resize((ancho, alto))
+    dibujo = ImageDraw.Draw(img)
+    paso = max(8, ancho // 10)
+    for x in range(0, ancho, paso):
+        dibujo.ellipse((x, alto // 4, x + paso * 3 // 2, 3 * alto // 4), outline=0, width=max(1, paso // 16))
+    return img.convert("RGB")
+
+
+def _foto(ancho: int, alto: int, rnd: random.Random) -> Image.Image:
+    """Manchas suaves sobre un degradado + grano: tonos continuos y bordes blandos, como una foto."""
+    img = Image.linear_gradient("L").resize((ancho, alto)).convert("RGB")
+    dibujo = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rnd.randrange(ancho), rnd.randrange(alto)
+        r = rnd.randrange(ancho // 20, ancho // 4)
+        dibujo.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(max(1, ancho // 200)))
+    grano = Image.effect_noise((ancho, alto), 12).convert("RGB")
+    return Image.blend(img, grano, 0.15)
+
+
+def _degradado(ancho: int, alto: int, rnd: random.Random) -> Image.Image:
+    return Image.radial_gradient("L").resize((ancho, alto)).convert("RGB")
+
+
+def _texto(ancho: int, alto: int, rnd: random.Random) -> Image.Image:
+    """Texto negro sobre blanco: bordes duros, el peor caso para el escalado y el difuminado."""
+    img = Image.new("RGB", (ancho, alto), "white")
+    dibujo = ImageDraw.Draw(img)
+    fuente = ImageFont.load_default(size=max(10, alto // 25))
+    paso = max(12, alto // 20)
+    for y in range(0, alto, paso):
+        dibujo.text((paso // 2, y), "El oráculo responde: 0123456789 ¿qué ves? " * 4, fill="black", font=fuente)
+    return img
+
+
+def _ruido(ancho: int, alto: int, rnd: random.Random) -> Image.Image:
+    return Image.effect_noise((ancho, alto), 80).convert("RGB")
+
+
+_GENERADORES = {"circulos": _circulos, "foto": _foto, "degradado": _degradado, "texto": _texto, "ruido": _ruido}
+
+
+def imagen(tipo: str, ancho: int, alto: int, semilla: int = 0) -> Image.Image:
+    return _GENERADORES[tipo](ancho, alto, random.Random(semilla))
+
+
+def jpeg(tipo: str, ancho: int, alto: int, semilla: int = 0, calidad: int = 90) -> bytes:
+    salida = io.BytesIO()
+    imagen(tipo, ancho, alto, semilla).save(salida, format="JPEG", quality=calidad)
+    return salida.getvalue()
+
+
+def generar(directorio: Path, resoluciones, tipos=TIPOS, semilla: int = 0) -> dict[tuple[str, int, int], Path]:
+    """
+    {(tipo, ancho, alto): ruta del JPEG} en `directorio`. Los que ya existen no se regeneran, y
+    se generan de a uno para no tener todo el corpus en memoria a la vez.
+    """
+    directorio.mkdir(parents=True, exist_ok=True)
+    rutas = {}
+    for ancho, alto in resoluciones:
+        for tipo in tipos:
+            ruta = directorio / f"{tipo}_{ancho}x{alto}_s{semilla}.jpg"
+            if not ruta.exists():
+                tmp = ruta.with_suffix(".tmp")
+                tmp.write_bytes(jpeg(tipo, ancho, alto, semilla))
+                tmp.replace(ruta)
+            rutas[(tipo, ancho, alto)] = ruta
+    return rutas
@@ -1,8 +1,17 @@
 from __future__ import annotations
+import logging
+import time
 from PIL import Image
 from dataclasses import dataclass
 from typing import Tuple
 
+try:
+    import numpy as np  # type: ignore
+except Exception:
+    np = None
+
+import difuminado as _difuminado
+
 @dataclass
 class EspecificacionPantalla:
     ancho: int = 104
@@ -11,62 +20,195 @@ class EspecificacionPantalla:
     espejo: bool = False  # espejo horizontal después de rotar
 
 
-def cargar_y_preparar(ruta: str, pantalla: EspecificacionPantalla, difuminado: str = "floyd") -> Image.Image:
+@dataclass
+class MedicionEtapa:
+    cpu_s: float       # CPU del hilo que preparó (no cuenta otros hilos del proceso)
+    pared_s: float
+    bytes_buffer: int  # tamaño del búfer de píxeles que deja la etapa
+
+
+class _Cronometro:
+    def __init__(self, destino: dict[str, MedicionEtapa] | None):
+        self.destino = destino
+        self._cpu = time.thread_time()
+        self._pared = time.perf_counter()
+
+    def marcar(self, etapa: str, bytes_buffer: int) -> None:
+        if self.destino is None:
+            return
+        cpu, pared = time.thread_time(), time.perf_counter()
+        self.destino[etapa] = MedicionEtapa(cpu - self._cpu, pared - self._pared, bytes_buffer)
+        self._cpu, self._pared = cpu, pared
+
+
+def _bytes_imagen(img: Image.Image) -> int:
+    if img.mode == "1":
+        return ((img.width + 7) // 8) * img.height
+    return img.width * img.height * len(img.getbands())
+
+
+# Rotaciones rectas: transposiciones sin pérdida en lugar de rotate() con remuestreo
+_TRANSPOSICIONES = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+# El JPEG se decodifica reducido (DCT) hasta ~2x el tamaño final y Image.reduce baja enteros
+# hasta ~2x; LANCZOS solo hace el último tramo, como Image.thumbnail
+_HOLGURA_REDUCCION = 2.0
+
+
+def cargar_y_preparar(ruta: str | Image.Image, pantalla: EspecificacionPantalla, difuminado: str = "floyd") -> Image.Image:
     """
-    Carga una imagen, la redimensiona a la pantalla, y la convierte a 1-bit con difuminado.
+    Carga una imagen (ruta o imagen PIL ya decodificada, p.ej. de la cámara), la redimensiona
+    a la pantalla, y la convierte a 1-bit con difuminado.
     Retorna una imagen PIL en modo '1' donde 1=blanco, 0=negro.
     """
-    img = Image.open(ruta).convert("L")  # escala de grises
-    # Ajusta manteniendo proporción y luego recorta
-    img = img.copy()
+    return cargar_y_empaquetar(ruta, pantalla, difuminado)[0]
+
+
+def cargar_y_empaquetar(ruta: str | Image.Image, pantalla: EspecificacionPantalla, difuminado: str = "floyd",
+                        etapas: dict[str, MedicionEtapa] | None = None) -> Tuple[Image.Image, bytes]:
+    """
+    Como cargar_y_preparar, pero retorna también los bytes listos para la EPD. Con NumPy el
+    difuminado (ver difuminado.py) deja una matriz de bits que se empaqueta directo, sin volver
+    a recorrer la imagen PIL. Si se pasa `etapas`, se llena con la medición de cada etapa.
+    """
+    crono = _Cronometro(etapas)
+    img = _cargar_gris(ruta, pantalla, crono)
+    if _difuminado.disponible():
+        blanco = _difuminado.difuminar(np.asarray(img), difuminado)
+        crono.marcar("difuminar", blanco.nbytes)
+        datos = _difuminado.empaquetar(blanco)
+        img1 = Image.fromarray(blanco)
+    else:
+        img1 = _difuminar_pil(img, difuminado)
+        crono.marcar("difuminar", _bytes_imagen(img1))
+        datos = empaquetar_bn_bit_mas_significativo_primero(img1)
+    crono.marcar("empaquetar", len(datos))
+    return img1, datos
+
+
+def _cargar_gris(ruta: str | Image.Image, pantalla: EspecificacionPantalla,
+                 crono: _Cronometro | None = None) -> Image.Image:
+    """
+    Decodifica, pasa a gris, recorta/escala al tamaño de la pantalla y orienta.
+
+    Con rotaciones rectas se escala primero (en la orientación de la fuente) y se transpone
+    después el cuadro ya chico; el JPEG se decodifica directo en gris y a escala reducida.
+    """
+    crono = crono or _Cronometro(None)
+    fuente = ruta if isinstance(ruta, Image.Image) else Image.open(ruta)
+    transposicion = _TRANSPOSICIONES.get(pantalla.rotacion % 360)
+    if pantalla.rotacion % 360 and transposicion is None:
+        return _cargar_gris_referencia(fuente, pantalla, crono)
+
+    objetivo = (pantalla.ancho, pantalla.alto)
+    if pantalla.rotacion % 180 == 90:
+        objetivo = (pantalla.alto, pantalla.ancho)  # en la orientación de la fuente
+    if fuente.format == "JPEG" and hasattr(fuente, "draft"):
+        try:
+            fuente.draft("L", (int(objetivo[0] * _HOLGURA_REDUCCION), int(objetivo[1] * _HOLGURA_REDUCCION)))
+        except ValueError:
+            pass  # ya decodificada: draft solo aplica antes de load()
+    fuente.load()
+    img = fuente if fuente.mode == "L" else fuente.convert("L")
+    crono.marcar("decodificar", _bytes_imagen(img))
+
+    img = _redimensionar_recorte_centrado(img, objetivo)
+    crono.marcar("escalar", _bytes_imagen(img))
+
+    if transposicion is not None:
+        img = img.transpose(transposicion)
+    if pantalla.espejo:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    crono.marcar("orientar", _bytes_imagen(img))
+    return img
+
+
+def _cargar_gris_referencia(fuente: Image.Image, pantalla: EspecificacionPantalla,
+                            crono: _Cronometro | None = None) -> Image.Image:
+    """
+    Camino completo (decodifica a tamaño real, rota con remuestreo y luego escala).
+    Se usa para rotaciones no rectas y se conserva para comparar con el camino reducido.
+    """
+    crono = crono or _Cronometro(None)
+    img = fuente.convert("L")  # escala de grises
+    crono.marcar("decodificar", _bytes_imagen(img))
 
     # Aplica rotación primero para que el tamaño objetivo tenga la orientación correcta
     if pantalla.rotacion:
         img = img.rotate(pantalla.rotacion, expand=True)
     if pantalla.espejo:
         img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    crono.marcar("orientar", _bytes_imagen(img))
 
     # Redimensiona: recorte centrado para ajustar
     objetivo = (pantalla.ancho, pantalla.alto)
-    img = _redimensionar_recorte_centrado(img, objetivo)
+    img = _redimensionar_recorte_centrado(img, objetivo, reduccion=None)
+    crono.marcar("escalar", _bytes_imagen(img))
+    return img
 
-    # Difuminado
-    if difuminado == "floyd":
-        img1 = img.convert("1", dither=Image.FLOYDSTEINBERG)
-    elif difuminado == "ninguno":
-        img1 = img.point(lambda p: 255 if p > 127 else 0, mode="1")
-    elif difuminado == "bayer":
-        # Difuminado ordenado mediante cuantización a 2 colores
-        img1 = img.convert("P").quantize(colors=2, method=Image.FASTOCTREE).convert("1")
-    else:
-        img1 = img.convert("1", dither=Image.FLOYDSTEINBERG)
-    return img1
 
+def _difuminar_pil(img: Image.Image, difuminado: str) -> Image.Image:
+    """Sin NumPy: solo Floyd–Steinberg (de PIL) y umbral; el resto cae en Floyd–Steinberg."""
+    if difuminado == "ninguno":
+        return img.point([255 if p > 127 else 0 for p in range(256)], mode="1")
+    if difuminado != "floyd":
+        logging.warning(f"[Imagen] Difuminado '{difuminado}' requiere NumPy; uso floyd")
+    return img.convert("1", dither=Image.FLOYDSTEINBERG)
 
-def _redimensionar_recorte_centrado(img: Image.Image, objetivo: Tuple[int, int]) -> Image.Image:
+
+def _redimensionar_recorte_centrado(img: Image.Image, objetivo: Tuple[int, int],
+                                    reduccion: float | None = _HOLGURA_REDUCCION) -> Image.Image:
+    """
+    Escala para LLENAR el objetivo y recorta centrado (sin bordes blancos de letterbox).
+    El recorte va como `box` de resize: no se escala la parte que se descarta.
+    Con `reduccion=None`, LANCZOS completo sin Image.reduce previo.
+    """
     ancho_obj, alto_obj = objetivo
     ancho_img, alto_img = img.size
-    
-    # En lugar de letterbox (que agrega bordes blancos), usa recorte centrado
-    # Calcula escala para LLENAR el objetivo (recorta en lugar de rellenar)
     escala = max(ancho_obj / ancho_img, alto_obj / alto_img)
-    nuevo_ancho = max(1, int(ancho_img * escala))
-    nuevo_alto = max(1, int(alto_img * escala))
-    img_redimensionada = img.resize((nuevo_ancho, nuevo_alto), Image.LANCZOS)
-    
-    # Recorta al tamaño exacto desde el centro
-    desplaz_x = (nuevo_ancho - ancho_obj) // 2
-    desplaz_y = (nuevo_alto - alto_obj) // 2
-    img_recortada = img_redimensionada.crop((desplaz_x, desplaz_y, 
-                                              desplaz_x + ancho_obj, 
-                                              desplaz_y + alto_obj))
-    return img_recortada
+    ancho_caja, alto_caja = min(ancho_img, ancho_obj / escala), min(alto_img, alto_obj / escala)
+    x0, y0 = max(0.0, (ancho_img - ancho_caja) / 2), max(0.0, (alto_img - alto_caja) / 2)
+    return img.resize(objetivo, Image.LANCZOS, box=(x0, y0, x0 + ancho_caja, y0 + alto_caja),
+                      reducing_gap=reduccion)
 
 
 def empaquetar_bn_bit_mas_significativo_primero(img1: Image.Image) -> bytes:
     """
     Empaqueta una imagen PIL de 1-bit (modo '1') en bytes, con el bit más significativo primero por byte,
     de izquierda a derecha, de arriba a abajo para pantallas de tinta electrónica Waveshare.
+
+    Misma salida que _empaquetar_bn_por_pixel (bit 0=negro, bit 1=blanco, relleno blanco al final
+    de cada fila), pero usando el codificador 'raw' de PIL sobre todo el búfer de una vez.
+    El codificador rellena con 0s (negro) los bits sobrantes de cada fila, así que se corrige
+    con una máscara sobre el último byte de cada fila (con NumPy si está disponible).
+    """
+    if img1.mode != "1":
+        raise ValueError("la imagen debe estar en modo '1'")
+    ancho, alto = img1.size
+    datos = img1.tobytes("raw", "1")
+    resto = ancho % 8
+    if resto == 0 or alto == 0:
+        return datos
+
+    bytes_por_fila = (ancho + 7) // 8
+    mascara = (1 << (8 - resto)) - 1  # bits de relleno → 1 (blanco)
+    if np is not None:
+        filas = np.frombuffer(datos, dtype=np.uint8).reshape(alto, bytes_por_fila).copy()
+        filas[:, -1] |= mascara
+        return filas.tobytes()
+
+    salida = bytearray(datos)
+    ultimos = salida[bytes_por_fila - 1::bytes_por_fila]
+    salida[bytes_por_fila - 1::bytes_por_fila] = bytes(b | mascara for b in ultimos)
+    return bytes(salida)
+
+
+def _empaquetar_bn_por_pixel(img1: Image.Image) -> bytes:
+    """
+    Implementación de referencia (píxel a píxel) del empaquetado.
+    Se conserva para verificar paridad con la versión rápida.
+
+    Empaqueta una imagen PIL de 1-bit (modo '1') en bytes, con el bit más significativo primero por byte,
+    de izquierda a derecha, de arriba a abajo para pantallas de tinta electrónica Waveshare.
     
     VERIFICADO desde prueba funcional de convertidor.py:
     - bytes 0x00 = píxeles negros
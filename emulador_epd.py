@@ -0,0 +1,379 @@
+from __future__ import annotations
+import argparse
+import logging
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import tramas
+from compresion import descomprimir_packbits
+
+
+class FirmwareEPD:
+    """
+    Implementación de referencia del protocolo serial del firmware ESP32/EPD, sin hardware.
+
+    Consume bytes tal como llegan por el cable y retorna las confirmaciones que respondería:
+      'S' + cuadro completo            → 's'  (refresco completo)
+      'Z' + largo (u32 BE) + PackBits   → 'z'  (refresco completo)
+      'W' + y0 + filas (u16 BE) + filas → 'w'  (refresco parcial de la franja)
+      'C'                              → 'c'  (limpia a blanco)
+      'Q'                              → 'q'  (duerme)
+      'B' + baudios en ASCII + LF       → 'b' + bloque (u16 BE) + créditos (u8), o 'E'
+      'V' + LF                         → 'v' + versión (u8): admite el protocolo en tramas
+      'F' + cabecera + bloques con CRC  → 'h', 'R' + faltantes por pasada, 'f' (ver tramas.py)
+    Ventanas fuera del panel o PackBits que no decodifica al tamaño del cuadro → 'E'.
+    Otros bytes sueltos (p.ej. el newline de despertar) se ignoran.
+
+    Tras una 'B' aceptada, emite un crédito '+' por cada `bloque` bytes que saca del búfer
+    (contados desde la última respuesta). `baudios_max=0` imita un firmware sin negociación y
+    `tramas=False` uno sin 'V'/'F'. Una transferencia en tramas sin datos por `plazo_trama_s`
+    se abandona.
+    """
+
+    def __init__(self, ancho: int = 104, alto: int = 212, baudios: int = 115200, baudios_max: int = 921600,
+                 bloque: int = 512, creditos: int = 2, tramas: bool = True,
+                 plazo_trama_s: float = tramas.PLAZO_ABANDONO_S):
+        self.ancho = ancho
+        self.alto = alto
+        self.bytes_por_fila = (ancho + 7) // 8
+        self.marco = bytearray([0xFF] * (self.bytes_por_fila * alto))
+        self.dormida = False
+        self.refrescos_completos = 0
+        self.refrescos_parciales = 0
+        self.bytes_recibidos = 0
+        self.baudios = baudios
+        self.baudios_max = baudios_max
+        self.bloque = bloque
+        self.creditos = creditos
+        self.flujo = False
+        self.creditos_emitidos = 0
+        self.tramas = tramas
+        self.plazo_trama_s = plazo_trama_s
+        self.bloques_rechazados = 0
+        self._sin_acreditar = 0
+        self._trama: _TramaEnCurso | None = None
+        self._ultimo_dato = 0.0
+        self._buf = bytearray()
+
+    def alimentar(self, datos: bytes) -> bytes:
+        return b"".join(self.respuestas(datos))
+
+    def respuestas(self, datos: bytes) -> list[bytes]:
+        """Como alimentar(), pero una entrada por respuesta (créditos incluidos), en orden."""
+        ahora = time.monotonic()
+        if self._trama is not None and ahora - self._ultimo_dato > self.plazo_trama_s:
+            logging.debug("[Emulador] Transferencia en tramas abandonada por el host")
+            self._trama = None
+        self._ultimo_dato = ahora
+        self._buf += datos
+        self.bytes_recibidos += len(datos)
+        salida = []
+        if self.flujo:
+            self._sin_acreditar += len(datos)
+            while self._sin_acreditar >= self.bloque:
+                self._sin_acreditar -= self.bloque
+                self.creditos_emitidos += 1
+                salida.append(b'+')
+        while self._buf:
+            respuesta = self._procesar()
+            if respuesta is None:  # comando incompleto: esperar más bytes
+                break
+            salida.extend(respuesta if isinstance(respuesta, list) else [respuesta] if respuesta else [])
+        if any(r != b'+' for r in salida):
+            self._sin_acreditar = 0  # el host empieza a contar créditos tras cada respuesta
+        return salida
+
+    def _procesar(self) -> bytes | list[bytes] | None:
+        buf = self._buf
+        if self._trama is not None:
+            return self._procesar_bloque()
+        cmd = buf[0:1]
+        if cmd == b'S':
+            n = len(self.marco)
+            if len(buf) < 1 + n:
+                return None
+            self.marco[:] = buf[1:1 + n]
+            del buf[:1 + n]
+            self.dormida = False
+            self.refrescos_completos += 1
+            return b's'
+        if cmd == b'Z':
+            if len(buf) < 5:
+                return None
+            (n,) = struct.unpack(">I", bytes(buf[1:5]))
+            if len(buf) < 5 + n:
+                return None
+            codificado = bytes(buf[5:5 + n])
+            del buf[:5 + n]
+            try:
+                self.marco[:] = descomprimir_packbits(codificado, len(self.marco))
+            except ValueError:
+                return b'E'
+            self.dormida = False
+            self.refrescos_completos += 1
+            return b'z'
+        if cmd == b'W':
+            if len(buf) < 5:
+                return None
+            y0, filas = struct.unpack(">HH", bytes(buf[1:5]))
+            if filas == 0 or y0 + filas > self.alto:
+                del buf[:5]
+                return b'E'
+            n = filas * self.bytes_por_fila
+            if len(buf) < 5 + n:
+                return None
+            inicio = y0 * self.bytes_por_fila
+            self.marco[inicio:inicio + n] = buf[5:5 + n]
+            del buf[:5 + n]
+            self.dormida = False
+            self.refrescos_parciales += 1
+            return b'w'
+        if cmd == b'C':
+            del buf[:1]
+            self.marco[:] = bytes([0xFF]) * len(self.marco)
+            self.dormida = False
+            self.refrescos_completos += 1
+            return b'c'
+        if cmd == b'Q':
+            del buf[:1]
+            self.dormida = True
+            return b'q'
+        if cmd == b'B' and self.baudios_max:
+            fin = buf.find(b'\n')
+            if fin < 0:
+                return None if len(buf) < 12 else self._descartar(1)
+            texto = bytes(buf[1:fin])
+            del buf[:fin + 1]
+            if not texto.isdigit() or int(texto) > self.baudios_max:
+                return b'E'
+            self.baudios = int(texto)
+            self.flujo = True
+            return b'b' + struct.pack(">HB", self.bloque, self.creditos)
+        if cmd == b'V' and self.tramas:
+            del buf[:1]
+            return b'v\x01'
+        if cmd == b'F' and self.tramas:
+            if len(buf) < tramas.TAM_CABECERA:
+                return None
+            cab = tramas.leer_cabecera(bytes(buf[:tramas.TAM_CABECERA]))
+            del buf[:tramas.TAM_CABECERA]
+            if (cab is None or not 16 <= cab.bloque <= 4096 or cab.tipo not in (tramas.TIPO_CRUDO, tramas.TIPO_PACKBITS)
+                    or (cab.tipo == tramas.TIPO_CRUDO and cab.largo != len(self.marco))):
+                return b'E'
+            self._trama = _TramaEnCurso(cab, list(range(cab.bloques)))
+            return b'h'
+        return self._descartar(1)
+
+    def _procesar_bloque(self) -> bytes | list[bytes] | None:
+        t = self._trama
+        seq = t.faltan[t.pos]
+        largo = tramas.TAM_SOBRE + t.cabecera.largo_bloque(seq)
+        if len(self._buf) < largo:
+            return None
+        pedazo = tramas.abrir_bloque(bytes(self._buf[:largo]), seq)
+        del self._buf[:largo]
+        if pedazo is None:
+            t.fallidos.append(seq)
+            self.bloques_rechazados += 1
+        else:
+            t.pedazos[seq] = pedazo
+        t.pos += 1
+        if t.pos < len(t.faltan):
+            return b''
+        # Fin de pasada: pedir solo lo que falló, o refrescar si está completo
+        if t.fallidos:
+            t.faltan, t.fallidos, t.pos = t.fallidos, [], 0
+            return tramas.lista_faltantes(t.faltan)
+        self._trama = None
+        carga = b"".join(t.pedazos[i] for i in range(t.cabecera.bloques))
+        if zlib.crc32(carga) != t.cabecera.crc:
+            return [tramas.lista_faltantes([]), b'E']
+        if t.cabecera.tipo == tramas.TIPO_PACKBITS:
+            try:
+                carga = descomprimir_packbits(carga, len(self.marco))
+            except ValueError:
+                return [tramas.lista_faltantes([]), b'E']
+        self.marco[:] = carga
+        self.dormida = False
+        self.refrescos_completos += 1
+        return [tramas.lista_faltantes([]), b'f']
+
+    def _descartar(self, n: int) -> bytes:
+        del self._buf[:n]
+        return b''
+
+
+class _TramaEnCurso:
+    def __init__(self, cabecera: tramas.Cabecera, faltan: list[int]):
+        self.cabecera = cabecera
+        self.faltan = faltan       # seqs que se esperan en esta pasada, en orden
+        self.pos = 0
+        self.fallidos: list[int] = []
+        self.pedazos: dict[int, bytes] = {}
+
+
+class EmuladorPTY:
+    """
+    Expone un FirmwareEPD en un pseudo-terminal: `puerto` se abre con pyserial como si fuera
+    /dev/ttyACM0. Solo POSIX.
+
+    Simula además el costo físico del enlace y del panel:
+      - `baudios`: cada byte recibido tarda 10/baudios s (8N1); 0 = instantáneo. Si el host
+        negocia otra velocidad ('B'), se simula la nueva.
+      - `refresco_s` / `refresco_parcial_s`: demora antes de confirmar 'S'/'Z'/'F'/'C' y 'W'.
+      - `tasa_error_bits`: probabilidad de invertir cada bit que llega del host (ruido en la
+        línea); se puede cambiar en caliente. `semilla` la hace reproducible.
+    Y permite inyectar fallos en las próximas respuestas con `inyectar()`.
+    """
+    FALLOS = ("silencio", "T", "E")  # sin respuesta (el host agota su plazo), 'T' o 'E' del firmware
+    _CONFIRMACIONES = (b's', b'z', b'f', b'w', b'c', b'q')  # las que puede reemplazar un fallo inyectado
+
+    def __init__(self, firmware: FirmwareEPD | None = None, baudios: int = 0,
+                 refresco_s: float = 0.0, refresco_parcial_s: float = 0.0,
+                 tasa_error_bits: float = 0.0, semilla: int | None = None):
+        self.firmware = firmware or FirmwareEPD()
+        self.tasa_error_bits = tasa_error_bits
+        self.bits_invertidos = 0
+        self._azar = random.Random(semilla)
+        self.baudios = baudios
+        if baudios:
+            self.firmware.baudios = baudios
+        self.refresco_s = refresco_s
+        self.refresco_parcial_s = refresco_parcial_s
+        self._fallos: deque[str] = deque()
+        self._maestro: int | None = None
+        self._esclavo: int | None = None
+        self._hilo: threading.Thread | None = None
+        self._parar = threading.Event()
+        self.puerto = ""
+
+    def inyectar(self, fallo: str, veces: int = 1) -> None:
+        """Reemplaza las próximas `veces` confirmaciones por `fallo` ('silencio' | 'T' | 'E')."""
+        if fallo not in self.FALLOS:
+            raise ValueError(f"fallo desconocido: {fallo!r} (opciones: {', '.join(self.FALLOS)})")
+        self._fallos.extend([fallo] * veces)
+
+    def iniciar(self) -> str:
+        import pty
+        import tty
+        self._maestro, self._esclavo = pty.openpty()
+        tty.setraw(self._esclavo)  # sin eco ni traducción de fin de línea
+        self.puerto = os.ttyname(self._esclavo)
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="EmuladorEPD", daemon=True)
+        self._hilo.start()
+        logging.debug(f"[Emulador] EPD emulada en {self.puerto}")
+        return self.puerto
+
+    def detener(self) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        for fd in (self._maestro, self._esclavo):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._maestro = self._esclavo = None
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.detener()
+
+    def _bucle(self) -> None:
+        while not self._parar.is_set():
+            listos, _, _ = select.select([self._maestro], [], [], 0.1)
+            if not listos:
+                continue
+            try:
+                datos = os.read(self._maestro, 65536)
+            except OSError:
+                return
+            if self.baudios:
+                time.sleep(len(datos) * 10.0 / self.firmware.baudios)
+            if self.tasa_error_bits > 0:
+                datos = self._corromper(datos)
+            for respuesta in self.firmware.respuestas(datos):
+                self._responder(respuesta)
+
+    def _corromper(self, datos: bytes) -> bytes:
+        """Invierte bits al azar con probabilidad `tasa_error_bits` (saltos geométricos entre errores)."""
+        buf = bytearray(datos)
+        log_q = math.log1p(-min(self.tasa_error_bits, 0.5))
+        pos = int(math.log(1.0 - self._azar.random()) / log_q)
+        while pos < len(buf) * 8:
+            buf[pos >> 3] ^= 1 << (pos & 7)
+            self.bits_invertidos += 1
+            pos += 1 + int(math.log(1.0 - self._azar.random()) / log_q)
+        return bytes(buf)
+
+    def _responder(self, confirmacion: bytes) -> None:
+        if confirmacion in (b's', b'z', b'f', b'c'):
+            time.sleep(self.refresco_s)
+        elif confirmacion == b'w':
+            time.sleep(self.refresco_parcial_s)
+        if self._fallos and confirmacion in self._CONFIRMACIONES:
+            fallo = self._fallos.popleft()
+            logging.debug(f"[Emulador] Fallo inyectado: {fallo} (en lugar de {confirmacion!r})")
+            if fallo == "silencio":
+                return
+            confirmacion = fallo.encode("ascii")
+        os.write(self._maestro, confirmacion)
+
+
+def principal():
+    analizador = argparse.ArgumentParser(description="EPD/ESP32 emulada en un pseudo-terminal")
+    analizador.add_argument("--ancho-pantalla", type=int, default=104, help="Ancho de pantalla (por defecto: 104)")
+    analizador.add_argument("--alto-pantalla", type=int, default=212, help="Alto de pantalla (por defecto: 212)")
+    analizador.add_argument("--baudios", type=int, default=115200,
+                            help="Velocidad simulada del enlace; 0 = instantáneo (por defecto: 115200)")
+    analizador.add_argument("--baudios-max", type=int, default=921600,
+                            help="Velocidad máxima que acepta al negociar ('B'); 0 = firmware sin negociación")
+    analizador.add_argument("--sin-tramas", action="store_true", help="Imita un firmware sin el protocolo en tramas ('F')")
+    analizador.add_argument("--tasa-error-bits", type=float, default=0.0,
+                            help="Probabilidad de invertir cada bit recibido (p.ej. 1e-5); por defecto: 0")
+    analizador.add_argument("--refresco", type=float, default=4.5, help="Segundos de refresco completo (por defecto: 4.5)")
+    analizador.add_argument("--refresco-parcial", type=float, default=0.6,
+                            help="Segundos de refresco parcial (por defecto: 0.6)")
+    analizador.add_argument("--enlace", help="Crea un symlink con este nombre apuntando al pty (ej., /tmp/epd)")
+    argumentos = analizador.parse_args()
+
+    firmware = FirmwareEPD(argumentos.ancho_pantalla, argumentos.alto_pantalla, baudios_max=argumentos.baudios_max,
+                           tramas=not argumentos.sin_tramas)
+    emulador = EmuladorPTY(firmware, baudios=argumentos.baudios, refresco_s=argumentos.refresco,
+                           refresco_parcial_s=argumentos.refresco_parcial, tasa_error_bits=argumentos.tasa_error_bits)
+    with emulador:
+        puerto = emulador.puerto
+        if argumentos.enlace:
+            if os.path.islink(argumentos.enlace):
+                os.unlink(argumentos.enlace)
+            os.symlink(puerto, argumentos.enlace)
+            puerto = argumentos.enlace
+        print(f"EPD emulada en {puerto} (Ctrl-C para salir)")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if argumentos.enlace and os.path.islink(argumentos.enlace):
+                os.unlink(argumentos.enlace)
+    print(f"Refrescos: {firmware.refrescos_completos} completos, {firmware.refrescos_parciales} parciales; "
+          f"{firmware.bytes_recibidos} bytes recibidos, {emulador.bits_invertidos} bits invertidos, "
+          f"{firmware.bloques_rechazados} bloques rechazados")
+
+
+if __name__ == "__main__":
+    principal()
@@ -1,14 +1,29 @@
 from __future__ import annotations
+import bisect
+import select
 import serial
+import struct
+import threading
 import time
+import weakref
+from collections import Counter, deque
+from dataclasses import dataclass
+
+import tramas
+from compresion import comprimir_packbits
+from utilidades import ABORTO
 
 CONFIRMACIONES = {
     b'c': 'limpieza-ok',
     b's': 'cuadro-ok',
+    b'w': 'ventana-ok',
+    b'z': 'comprimido-ok',
+    b'f': 'tramas-ok',
     b'q': 'dormir-ok',
     b'T': 'tiempo-agotado',
     b'E': 'error'
 }
+ABORTADO = 'abortado'  # la espera se cortó por abort(), no por el firmware
 
 def abrir_serial(puerto: str, baudios: int = 115200, tiempo_espera: float = 2.0) -> serial.Serial:
     """
@@ -27,73 +42,524 @@ def abrir_serial(puerto: str, baudios: int = 115200, tiempo_espera: float = 2.0)
     return ser
 
 
-def enviar_limpiar(ser: serial.Serial) -> str:
-    """Envía comando de limpieza (no recomendado salvo diagnóstico)."""
-    time.sleep(0.1)
-    while ser.in_waiting:
-        ser.read(ser.in_waiting)
-        time.sleep(0.02)
+# Velocidades que se intentan al negociar, de la mayor a la menor (todas estándar en CP210x/CH34x)
+BAUDIOS_ESTANDAR = (2000000, 1500000, 921600, 460800, 230400, 115200)
+_PLAZO_NEGOCIACION_S = 0.5
+_REVERSION_S = 1.0  # el firmware vuelve solo a la velocidad anterior si no se confirma en este plazo
+_PLAZO_CREDITO_S = 2.0
+
+
+@dataclass(frozen=True)
+class ControlFlujo:
+    """Créditos anunciados por el firmware: un '+' por cada `bloque` bytes que sacó de su búfer."""
+    bloque: int    # bytes por crédito
+    creditos: int  # bloques que caben en su búfer de recepción
+
+
+# Enlaces con control de flujo negociado; sin entrada → firmware viejo, escritura de una vez
+_FLUJO: "weakref.WeakKeyDictionary[serial.Serial, ControlFlujo]" = weakref.WeakKeyDictionary()
+
+
+def control_flujo(ser: serial.Serial) -> ControlFlujo | None:
+    return _FLUJO.get(ser)
+
+
+def negociar_baudios(ser: serial.Serial, baudios_max: int) -> int:
+    """
+    Sube el enlace a la mayor velocidad (≤ `baudios_max`) que acepte el firmware y activa el
+    control de flujo por créditos. Retorna la velocidad final.
+
+    Protocolo: 'B' + baudios en ASCII + salto de línea (solo dígitos: un firmware viejo los
+    ignora como bytes sueltos). El firmware responde 'b' + bloque (u16 BE) + créditos (u8) y cambia de
+    velocidad, o 'E' si no la soporta. El host repite el pedido ya a la nueva velocidad para
+    confirmarla; sin esa confirmación el firmware vuelve a la anterior tras `_REVERSION_S`.
+    Sin respuesta a la velocidad actual → firmware sin negociación: todo queda como estaba.
+    """
+    base = ser.baudrate
+    flujo = _pedir_baudios(ser, base)
+    if flujo is None:
+        return base
+    _FLUJO[ser] = flujo
+    for baudios in BAUDIOS_ESTANDAR:
+        if not base < baudios <= baudios_max:
+            continue
+        if _pedir_baudios(ser, baudios) is None:
+            continue  # 'E': no la soporta (o su UART no llega), probar la siguiente
+        ser.baudrate = baudios
+        time.sleep(0.05)
+        confirmado = _pedir_baudios(ser, baudios)
+        if confirmado is not None:
+            _FLUJO[ser] = confirmado
+            return baudios
+        ser.baudrate = base
+        time.sleep(_REVERSION_S)
+    return base
+
+
+def restaurar_baudios(ser: serial.Serial, baudios: int) -> None:
+    """
+    Devuelve el firmware a `baudios` (la velocidad de arranque) antes de cerrar, para que el
+    próximo proceso que abra el puerto a esa velocidad lo encuentre.
+    """
+    if ser.baudrate == baudios or control_flujo(ser) is None:
+        return
+    if _pedir_baudios(ser, baudios) is not None:
+        ser.baudrate = baudios
+        time.sleep(0.05)
+        _pedir_baudios(ser, baudios)  # confirmación a la nueva velocidad
+
+
+_TRAMAS: "weakref.WeakSet[serial.Serial]" = weakref.WeakSet()
+_PLAZO_TRAMA_S = 1.0      # para 'h' y para la lista de faltantes tras cada pasada
+_INTENTOS_CABECERA = 3
+MAX_PASADAS = 8
+
 
-    ser.write(b'C')
+def consultar_tramas(ser: serial.Serial) -> bool:
+    """
+    ¿El firmware entiende el protocolo en tramas ('F', ver tramas.py)? Pregunta con 'V' + salto
+    de línea, que un firmware viejo ignora. Si responde, los cuadros completos de este enlace
+    pasan a ir en tramas.
+    """
+    _vaciar_entrada(ser)
+    ser.write(b'V\n')
     ser.flush()
+    respuesta = _leer_hasta(ser, b'v', 1, time.monotonic() + _PLAZO_NEGOCIACION_S)
+    if isinstance(respuesta, bytes) and respuesta[0] >= 1:
+        _TRAMAS.add(ser)
+        return True
+    return False
 
-    limite_tiempo = time.time() + 10.0
-    while time.time() < limite_tiempo:
-        if ser.in_waiting:
-            b = ser.read(1)
-            if b == b'c':
-                return 'limpieza-ok'
-        time.sleep(0.01)
-    return "tiempo-agotado"
 
+def admite_tramas(ser: serial.Serial) -> bool:
+    return ser in _TRAMAS
 
-def enviar_dormir(ser: serial.Serial) -> str:
-    """Envía comando de dormir."""
+
+def _leer_hasta(ser: serial.Serial, marca: bytes | None, n: int, limite: float) -> bytes | str:
+    """
+    Descarta bytes (créditos, eco) hasta `marca` y retorna los `n` bytes que la siguen (sin
+    marca: los próximos `n`); o el resultado que cortó la espera ('T'/'E', plazo, abort).
+    """
+    leidos = None if marca is not None else b""
+    while leidos is None or len(leidos) < n:
+        restante = limite - time.monotonic()
+        if ABORTO.cancelado:
+            return ABORTADO
+        if restante <= 0:
+            return "tiempo-agotado"
+        b = _leer_byte(ser, restante)
+        if leidos is not None:
+            leidos += b
+        elif b == marca:
+            leidos = b""
+        elif b in (b'T', b'E'):
+            return CONFIRMACIONES[b]
+    return leidos
+
+
+def _pedir_baudios(ser: serial.Serial, baudios: int) -> ControlFlujo | None:
+    _vaciar_entrada(ser)
+    ser.write(b'B' + str(baudios).encode("ascii") + b'\n')
+    ser.flush()
+    limite = time.monotonic() + _PLAZO_NEGOCIACION_S
+    respuesta = b""
+    while len(respuesta) < 4:
+        restante = limite - time.monotonic()
+        if restante <= 0 or ABORTO.cancelado:
+            return None
+        b = _leer_byte(ser, restante)
+        if not respuesta and b != b'b':
+            if b == b'E':
+                return None
+            continue  # eco o basura previa a la respuesta
+        respuesta += b
+    bloque, creditos = struct.unpack(">HB", respuesta[1:])
+    return ControlFlujo(bloque, creditos) if bloque and creditos else None
+
+
+@dataclass
+class ResultadoEnvio:
+    confirmacion: str
+    modo: str            # 'completo' | 'comprimido' | 'ventana' | 'sin-cambios'
+    bytes_cuadro: int    # tamaño del cuadro completo
+    bytes_enviados: int  # bytes de payload que pasaron por el cable
+    espera_s: float = 0.0    # en la cola de la sesión antes de empezar
+    duracion_s: float = 0.0  # desde que la sesión lo tomó hasta la confirmación
+    apertura_s: float = 0.0  # abriendo el puerto (0 si la sesión ya estaba conectada)
+    escritura_s: float = 0.0  # dentro de write()+flush() (sin la pausa antes del payload)
+    ack_s: float = 0.0       # esperando la confirmación del firmware
+    retransmitidos: int = 0  # bloques reenviados (protocolo en tramas)
+
+    @property
+    def ratio(self) -> float | None:
+        """bytes_cuadro / bytes_enviados (1.0 = sin ahorro); None si no se envió nada."""
+        return self.bytes_cuadro / self.bytes_enviados if self.bytes_enviados else None
+
+    @property
+    def bytes_por_s(self) -> float | None:
+        """Velocidad efectiva de la transferencia (sin el refresco del panel)."""
+        return self.bytes_enviados / self.escritura_s if self.escritura_s else None
+
+    @property
+    def goodput(self) -> float | None:
+        """Bytes útiles del cuadro por segundo de transferencia (descuenta sobres y reenvíos)."""
+        return self.bytes_cuadro / self.escritura_s if self.escritura_s and self.bytes_enviados else None
+
+    def etapas(self) -> dict[str, float]:
+        """Desglose de tiempos con los nombres de etapa de perfil.py."""
+        return {"cola_epd": self.espera_s, "apertura_serial": self.apertura_s,
+                "transferencia": self.escritura_s, "ack": self.ack_s}
+
+
+class _TiemposHilo(threading.local):
+    """Tiempos acumulados por los comandos del hilo actual; la sesión los reinicia por cuadro."""
+    escritura_s = 0.0
+    ack_s = 0.0
+
+    def reiniciar(self) -> None:
+        self.escritura_s = self.ack_s = 0.0
+
+
+TIEMPOS_HILO = _TiemposHilo()
+
+
+@dataclass
+class RegistroComando:
+    comando: str        # 'S' | 'Z' | 'W' | 'C' | 'Q'
+    bytes: int          # bytes escritos (comando + payload)
+    escritura_s: float  # tiempo dentro de write()+flush()
+    ack_s: float        # desde el fin de la escritura hasta la confirmación (o el plazo)
+    resultado: str      # valor de CONFIRMACIONES, 'tiempo-agotado' o 'abortado'
+
+    @property
+    def bytes_s(self) -> float:
+        return self.bytes / self.escritura_s if self.escritura_s else 0.0
+
+
+class EstadisticasEPD:
+    """
+    Tiempos por comando enviados a la EPD (últimos `max_registros`), consultables desde otro hilo.
+    """
+    LIMITES_S = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 6.0, 8.0, 10.0, 20.0)
+
+    def __init__(self, max_registros: int = 512):
+        self._registros: deque[RegistroComando] = deque(maxlen=max_registros)
+        self._lock = threading.Lock()
+
+    def registrar(self, registro: RegistroComando) -> None:
+        with self._lock:
+            self._registros.append(registro)
+
+    def registros(self, comando: str | None = None) -> list[RegistroComando]:
+        with self._lock:
+            return [r for r in self._registros if comando is None or r.comando == comando]
+
+    def histograma(self, comando: str, campo: str = "ack_s") -> dict[str, int]:
+        """Conteo por cubeta '<=límite' (la última, '>máximo')."""
+        cubetas = [0] * (len(self.LIMITES_S) + 1)
+        for r in self.registros(comando):
+            cubetas[bisect.bisect_left(self.LIMITES_S, getattr(r, campo))] += 1
+        etiquetas = [f"<={l:g}s" for l in self.LIMITES_S] + [f">{self.LIMITES_S[-1]:g}s"]
+        return dict(zip(etiquetas, cubetas))
+
+    def resumen(self) -> dict[str, dict]:
+        por_comando: dict[str, list[RegistroComando]] = {}
+        for r in self.registros():
+            por_comando.setdefault(r.comando, []).append(r)
+        salida = {}
+        for comando, regs in por_comando.items():
+            salida[comando] = {
+                "n": len(regs),
+                "resultados": dict(Counter(r.resultado for r in regs)),
+                "escritura_s": _percentiles([r.escritura_s for r in regs]),
+                "bytes_s": _percentiles([r.bytes_s for r in regs]),
+                "ack_s": _percentiles([r.ack_s for r in regs]),
+            }
+        return salida
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self._registros.clear()
+
+
+def _percentiles(valores: list[float]) -> dict[str, float]:
+    ordenados = sorted(valores)
+    def p(q: float) -> float:
+        return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+    return {"p50": p(0.50), "p90": p(0.90), "max": ordenados[-1]}
+
+
+ESTADISTICAS = EstadisticasEPD()
+
+
+def _vaciar_entrada(ser: serial.Serial) -> None:
+    """Descarta cualquier eco pendiente antes de un comando."""
     time.sleep(0.1)
     while ser.in_waiting:
         ser.read(ser.in_waiting)
-        time.sleep(0.02)
+        time.sleep(0.01)
+
+
+def _leer_byte(ser: serial.Serial, restante: float) -> bytes:
+    """
+    Bloquea hasta que llegue un byte, venza `restante` segundos o haya abort, sin sondear.
+    Usa select() sobre el descriptor del puerto y el del token de abort; si el puerto no tiene
+    descriptor (p.ej. Windows), el timeout de read() en tramos cortos.
+    """
+    try:
+        fd = ser.fileno()
+    except Exception:
+        fd = None
+    if fd is not None:
+        if not ser.in_waiting:
+            listos, _, _ = select.select([fd, ABORTO.fileno()], [], [], restante)
+            if fd not in listos:
+                return b""
+        return ser.read(1)
+
+    timeout_original = ser.timeout
+    ser.timeout = min(restante, 0.1)
+    try:
+        return ser.read(1)
+    finally:
+        ser.timeout = timeout_original
+
+
+def _esperar_confirmacion(ser: serial.Serial, esperado: bytes, plazo_s: float) -> str:
+    """
+    Espera la confirmación `esperado` hasta `plazo_s`. Los códigos 'T'/'E' del firmware
+    terminan la espera; cualquier otro byte (eco, depuración) se ignora. Un abort la corta.
+    """
+    limite_tiempo = time.monotonic() + plazo_s
+    while True:
+        if ABORTO.cancelado:
+            return ABORTADO
+        restante = limite_tiempo - time.monotonic()
+        if restante <= 0:
+            return "tiempo-agotado"
+        b = _leer_byte(ser, restante)
+        if b == esperado or b in (b'T', b'E'):
+            return CONFIRMACIONES[b]
+
 
-    ser.write(b'Q')
+def _ejecutar_comando(ser: serial.Serial, comando: bytes, esperado: bytes, plazo_s: float,
+                      datos: bytes = b"", pausa_s: float = 0.0) -> str:
+    """
+    Escribe comando (+ payload tras `pausa_s`), espera la confirmación y registra los tiempos.
+    Con control de flujo negociado el payload va en bloques al ritmo de los créditos del
+    firmware, sin pausa fija.
+    """
+    _vaciar_entrada(ser)
+
+    flujo = control_flujo(ser)
+    corte = None
+    if flujo is not None and datos:
+        t0 = time.perf_counter()
+        corte = _escribir_con_creditos(ser, comando + datos, flujo)
+        escritura_s = time.perf_counter() - t0
+    else:
+        t0 = time.perf_counter()
+        ser.write(comando)
+        ser.flush()
+        escritura_s = time.perf_counter() - t0
+
+        if datos:
+            time.sleep(pausa_s)  # margen para que el firmware entre en modo recepción
+            t0 = time.perf_counter()
+            ser.write(datos)
+            ser.flush()
+            escritura_s += time.perf_counter() - t0
+
+    t_ack = time.perf_counter()
+    resultado = corte or _esperar_confirmacion(ser, esperado, plazo_s)
+    ack_s = time.perf_counter() - t_ack
+    ESTADISTICAS.registrar(RegistroComando(
+        comando=chr(comando[0]),
+        bytes=len(comando) + len(datos),
+        escritura_s=escritura_s,
+        ack_s=ack_s,
+        resultado=resultado,
+    ))
+    TIEMPOS_HILO.escritura_s += escritura_s
+    TIEMPOS_HILO.ack_s += ack_s
+    return resultado
+
+
+def _escribir_con_creditos(ser: serial.Serial, datos: bytes, flujo: ControlFlujo) -> str | None:
+    """
+    Escribe en bloques de `flujo.bloque` bytes con a lo sumo `flujo.creditos` bloques sin
+    acreditar, así nunca desborda el búfer de recepción del ESP32. Retorna None si todo salió,
+    o el resultado que cortó la escritura ('T'/'E' del firmware, plazo o abort).
+    """
+    pendientes = 0
+    for inicio in range(0, len(datos), flujo.bloque):
+        while pendientes >= flujo.creditos:
+            if ABORTO.cancelado:
+                return ABORTADO
+            b = _leer_byte(ser, _PLAZO_CREDITO_S)
+            if b == b'+':
+                pendientes -= 1
+            elif b in (b'T', b'E'):
+                return CONFIRMACIONES[b]
+            elif not b:
+                return ABORTADO if ABORTO.cancelado else "tiempo-agotado"
+        ser.write(datos[inicio:inicio + flujo.bloque])
+        pendientes += 1
     ser.flush()
+    return None
+
+
+def enviar_limpiar(ser: serial.Serial) -> str:
+    """Envía comando de limpieza (no recomendado salvo diagnóstico)."""
+    return _ejecutar_comando(ser, b'C', b'c', plazo_s=10.0)
 
-    limite_tiempo = time.time() + 5.0
-    while time.time() < limite_tiempo:
-        if ser.in_waiting:
-            b = ser.read(1)
-            if b == b'q':
-                return 'dormir-ok'
-        time.sleep(0.01)
-    return "tiempo-agotado"
+
+def enviar_dormir(ser: serial.Serial) -> str:
+    """Envía comando de dormir."""
+    return _ejecutar_comando(ser, b'Q', b'q', plazo_s=5.0)
 
 
 def enviar_cuadro_bn(ser: serial.Serial, datos: bytes) -> str:
     """
     Envía datos de cuadro. El firmware hace el refresco (toma ~4–6 s).
     Protocolo: 'S' + payload 1-bit (MSB->LSB por byte), sin tamaño explícito.
+    Confirmación: bloquea hasta 20 s.
     """
-    # Limpia cualquier eco pendiente
-    time.sleep(0.1)
-    while ser.in_waiting:
-        ser.read(ser.in_waiting)
-        time.sleep(0.01)
+    return _ejecutar_comando(ser, b'S', b's', plazo_s=20.0, datos=datos, pausa_s=0.3)
 
-    # Comando
-    ser.write(b'S')
-    ser.flush()
-    time.sleep(0.3)  # margen para que el firmware entre en modo recepción
 
-    # Datos
-    ser.write(datos)
-    ser.flush()
+def enviar_cuadro_comprimido(ser: serial.Serial, codificado: bytes) -> str:
+    """
+    Envía un cuadro completo codificado en PackBits.
+    Protocolo: 'Z' + largo codificado (u32 BE) + payload PackBits; el firmware lo decodifica
+    a (ancho+7)//8 * alto bytes, refresca igual que con 'S' y responde 'z'.
+    """
+    comando = b'Z' + struct.pack(">I", len(codificado))
+    return _ejecutar_comando(ser, comando, b'z', plazo_s=20.0, datos=codificado, pausa_s=0.3)
 
-    # Confirmación (bloquea hasta 20 s)
-    limite_tiempo = time.time() + 20.0
-    while time.time() < limite_tiempo:
-        if ser.in_waiting:
-            b = ser.read(1)
-            if b == b's':
-                return 'cuadro-ok'
-        time.sleep(0.01)
 
-    return "tiempo-agotado"
+def enviar_cuadro_tramas(ser: serial.Serial, datos: bytes, comprimir: bool = False,
+                         bloque: int = tramas.BLOQUE_POR_DEFECTO) -> ResultadoEnvio:
+    """
+    Envía el cuadro en bloques con CRC ('F', ver tramas.py) y reenvía solo los que el firmware
+    rechaza, hasta MAX_PASADAS. Con `comprimir` la carga va en PackBits si así ocupa menos.
+    Con control de flujo negociado cada pasada respeta los créditos del firmware.
+    """
+    carga, tipo = datos, tramas.TIPO_CRUDO
+    if comprimir:
+        codificado = comprimir_packbits(datos)
+        if len(codificado) < len(datos):
+            carga, tipo = codificado, tramas.TIPO_PACKBITS
+    bloques = tramas.partir(carga, bloque)
+    flujo = control_flujo(ser)
+    enviados = retransmitidos = 0
+    _vaciar_entrada(ser)
+
+    t0 = time.perf_counter()
+    cabecera = tramas.cabecera(tipo, carga, bloque)
+    corte: str | None = None
+    for _ in range(_INTENTOS_CABECERA):
+        ser.write(cabecera)
+        ser.flush()
+        enviados += len(cabecera)
+        listo = _leer_hasta(ser, b'h', 0, time.monotonic() + _PLAZO_TRAMA_S)
+        corte = None if listo == b"" else listo
+        if corte is None or corte == ABORTADO:
+            break
+        _vaciar_entrada(ser)  # cabecera dañada en el camino: otra vez
+
+    faltan = list(range(len(bloques))) if corte is None else []
+    pasadas = 0
+    while faltan:
+        if pasadas == MAX_PASADAS:
+            corte = CONFIRMACIONES[b'E']
+            break
+        rafaga = b"".join(bloques[i] for i in faltan)
+        if pasadas:
+            retransmitidos += len(faltan)
+        pasadas += 1
+        if flujo is not None:
+            corte = _escribir_con_creditos(ser, rafaga, flujo)
+        else:
+            ser.write(rafaga)
+            ser.flush()
+        enviados += len(rafaga)
+        if corte is not None:
+            break
+        faltan = _leer_faltantes(ser, _PLAZO_TRAMA_S + len(rafaga) * 10 / ser.baudrate)
+        if isinstance(faltan, str):
+            corte, faltan = faltan, []
+    escritura_s = time.perf_counter() - t0
+
+    if corte is not None and corte != ABORTADO:
+        ABORTO.esperar(tramas.PLAZO_ABANDONO_S + 0.1)  # que el firmware suelte la transferencia a medias
+    t_ack = time.perf_counter()
+    resultado = corte or _esperar_confirmacion(ser, b'f', 20.0)
+    ack_s = time.perf_counter() - t_ack
+    ESTADISTICAS.registrar(RegistroComando('F', enviados, escritura_s, ack_s, resultado))
+    TIEMPOS_HILO.escritura_s += escritura_s
+    TIEMPOS_HILO.ack_s += ack_s
+    conf = 'cuadro-ok' if resultado == 'tramas-ok' else resultado
+    return ResultadoEnvio(conf, 'tramas', len(datos), enviados, retransmitidos=retransmitidos)
+
+
+def _leer_faltantes(ser: serial.Serial, plazo_s: float) -> list[int] | str:
+    """
+    Lista 'R' que el firmware manda tras cada pasada: seqs a reenviar ([] = completo).
+    `plazo_s` cubre lo que la ráfaga tarda en salir del búfer del puerto a la velocidad del enlace.
+    """
+    limite = time.monotonic() + plazo_s
+    cabeza = _leer_hasta(ser, b'R', 2, limite)
+    if isinstance(cabeza, str):
+        return cabeza
+    (n,) = struct.unpack(">H", cabeza)
+    cuerpo = _leer_hasta(ser, None, 2 * n, limite)
+    if isinstance(cuerpo, str):
+        return cuerpo
+    return list(struct.unpack(f">{n}H", cuerpo))
+
+
+def enviar_cuadro_auto(ser: serial.Serial, datos: bytes, comprimir: bool = True) -> ResultadoEnvio:
+    """
+    Envía el cuadro comprimido si así viajan menos bytes (contando la cabecera de 'Z');
+    si no, cae al 'S' crudo de siempre. Si el firmware admite tramas (consultar_tramas),
+    va en tramas con CRC.
+    """
+    if admite_tramas(ser):
+        return enviar_cuadro_tramas(ser, datos, comprimir)
+    if comprimir:
+        codificado = comprimir_packbits(datos)
+        if len(codificado) + 4 < len(datos):
+            conf = enviar_cuadro_comprimido(ser, codificado)
+            conf = 'cuadro-ok' if conf == 'comprimido-ok' else conf
+            return ResultadoEnvio(conf, 'comprimido', len(datos), len(codificado) + 4)
+    return ResultadoEnvio(enviar_cuadro_bn(ser, datos), 'completo', len(datos), len(datos))
+
+
+def enviar_ventana_bn(ser: serial.Serial, y0: int, filas: int, datos: bytes) -> str:
+    """
+    Envía solo una franja de filas y pide refresco parcial.
+    Protocolo: 'W' + y0 (u16 BE) + filas (u16 BE) + filas * bytes_por_fila de payload.
+    El firmware conoce el ancho del panel; responde 'w'.
+    """
+    comando = b'W' + struct.pack(">HH", y0, filas)
+    return _ejecutar_comando(ser, comando, b'w', plazo_s=20.0, datos=datos, pausa_s=0.05)
+
+
+def calcular_ventana(anterior: bytes, nuevo: bytes, bytes_por_fila: int) -> tuple[int, int] | None:
+    """
+    Franja mínima de filas que cambió entre dos cuadros empaquetados.
+    Retorna (y0, filas) o None si son idénticos.
+    """
+    if len(anterior) != len(nuevo):
+        raise ValueError("los cuadros deben tener el mismo tamaño")
+    if anterior == nuevo:
+        return None
+    alto = len(nuevo) // bytes_por_fila
+    y0 = 0
+    while anterior[y0 * bytes_por_fila:(y0 + 1) * bytes_por_fila] == nuevo[y0 * bytes_por_fila:(y0 + 1) * bytes_por_fila]:
+        y0 += 1
+    y1 = alto - 1
+    while anterior[y1 * bytes_por_fila:(y1 + 1) * bytes_por_fila] == nuevo[y1 * bytes_por_fila:(y1 + 1) * bytes_por_fila]:
+        y1 -= 1
+    return y0, y1 - y0 + 1
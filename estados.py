@@ -1,13 +1,31 @@
 from __future__ import annotations
 import logging
+import time
+from contextlib import ExitStack
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 
 from imagen import PantallaSpec, preparar_imagen
-from ayudas_serial import mostrar_imagen_async, limpiar_y_dormir
+from cache_cuadros import CacheCuadros
+from artefactos import EscritorArtefactos
+from camara import Camara
+from ayudas_serial import esperar_envio, mostrar_imagen_async, limpiar_y_dormir
 from motores import Motores
-from cancion import EM, tocar_cancion_una_vez
-from utilidades import aborted
+from cancion import compilar_partitura, tocar_cancion_una_vez
+from grafo import GrafoEtapas
+from partituras import cargar_partitura
+from pantallas import (HILOS_POR_DEFECTO, Pantalla, enviar_a_pantallas, esperar_resultados,
+                       limpiar_pantallas, preparar_cuadros)
+from perfil import NULO, Perfil, RegistroCiclo
+from utilidades import ABORTO, aborted
+
+# Qué debe terminar, además del lanzamiento del envío, antes de la etapa final (limpiar/dormir).
+# Siempre la canción: limpiar mientras suena borraría el cuadro que el público está mirando.
+POLITICAS_FINAL = {
+    "cancion": ("cancion",),                # la confirmación del cuadro tiene --espera-epd extra
+    "todo": ("cancion", "confirmacion"),    # además, la confirmación sin plazo
+}
 
 @dataclass
 class Ctx:
@@ -19,51 +37,240 @@ class Ctx:
     modo_prueba: bool
     salida: Path
     difuminado: str
-    espera_epd: float = 0.0  # envío a la EPD en paralelo
+    espera_epd: float = 3.0  # plazo para la confirmación del cuadro tras la canción
+    delta: bool = False      # solo filas cambiadas (refresco parcial)
+    comprimir: bool = False  # cuadros en PackBits si conviene
+    cache: CacheCuadros | None = None
+    camara: Camara | None = None  # None → rpicam-still a captura.jpg
+    partitura: Path | None = None  # None → tocar_cancion_una_vez
+    pantallas: list[Pantalla] | None = None  # varias EPD: reemplaza puerto_epd/spec/difuminado
+    hilos_epd: int = HILOS_POR_DEFECTO
+    artefactos: EscritorArtefactos | None = None  # None → vista previa síncrona, sin historial
+    perfil: Perfil | None = None  # --perfil: tiempos por etapa de cada ciclo
+    baud_max: int | None = None   # negociar velocidad y control de flujo con el firmware
+    tramas: bool = False          # cuadros en bloques con CRC y reenvío selectivo (si el firmware lo admite)
+    final: str = "cancion"        # clave de POLITICAS_FINAL
 
-def run_ciclo(ctx: Ctx, ruta_fuente: Path | None, capturar: bool) -> bool:
-    # CAPTURAR/PROCESAR
+def run_ciclo(ctx: Ctx, ruta_fuente: Path | None, capturar: bool, motores: Motores | None = None) -> bool:
+    """
+    Un ciclo completo: la canción arranca mientras se captura y procesa (ver _correr_grafo).
+    Si se pasan `motores` ya abiertos (modo servicio) se usan y no se cierran.
+    """
     if aborted():
         return False
+    registro = nuevo_registro(ctx)
+    ok = False
+    try:
+        ok = _correr_grafo(ctx, lambda: preparar_cuadro(ctx, ruta_fuente, capturar, registro)[0], motores, registro)
+        return ok
+    finally:
+        emitir_registro(ctx, registro, ok)
+
+def nuevo_registro(ctx: Ctx) -> RegistroCiclo:
+    """Registro de tiempos del ciclo; sin --perfil es un registro nulo que no mide nada."""
+    return ctx.perfil.nuevo_ciclo() if ctx.perfil is not None else NULO
+
+def emitir_registro(ctx: Ctx, registro: RegistroCiclo, ok: bool) -> None:
+    if ctx.perfil is not None:
+        registro.ok = ok
+        ctx.perfil.emitir(registro)
+
+def preparar_cuadro(ctx: Ctx, ruta_fuente: Path | None, capturar: bool,
+                    registro: RegistroCiclo = NULO) -> tuple[bytes | dict[str, bytes], Path]:
+    """
+    Etapa de captura + difuminado + empaquetado; no toca ni la EPD ni los motores.
+    Con varias pantallas captura una sola vez y retorna {puerto: cuadro}.
+    """
+    if ctx.pantallas:
+        captura = None
+        if capturar:
+            with registro.etapa("captura"):
+                ruta_fuente, captura = _capturar_una_vez(ctx)
+        elif ruta_fuente is None:
+            raise RuntimeError("Proveer --imagen o --capturar")
+        with registro.etapa("preparar_pantallas"):
+            cuadros = preparar_cuadros(ctx.salida, ctx.pantallas, ruta_fuente, ctx.modo_prueba,
+                                       cache=None if capturar else ctx.cache, hilos=ctx.hilos_epd,
+                                       artefactos=ctx.artefactos,
+                                       captura=captura if ctx.artefactos is not None else None,
+                                       registro=registro)
+        registro.dato("bytes_cuadro", sum(len(c) for c in cuadros.values()))
+        return cuadros, ctx.salida
+
     datos, vista = preparar_imagen(
-        ctx.salida, ctx.spec, ctx.difuminado, ruta_fuente, capturar, ctx.modo_prueba
+        ctx.salida, ctx.spec, ctx.difuminado, ruta_fuente, capturar, ctx.modo_prueba,
+        cache=ctx.cache, camara=ctx.camara, artefactos=ctx.artefactos, registro=registro,
     )
+    registro.dato("bytes_cuadro", len(datos))
     logging.info(f"[Imagen] Vista previa: {vista}")
     esperado = ((ctx.spec.ancho + 7) // 8) * ctx.spec.alto
     logging.debug(f"[Imagen] Bytes empaquetados: {len(datos)} (esperado {esperado})")
+    return datos, vista
 
-    # MOSTRAR (asíncrono) — se envía mientras suena la canción
-    if not aborted():
-        th_envio = mostrar_imagen_async(ctx.puerto_epd, ctx.baud, datos, ctx.modo_prueba)
-        logging.info("[EPD] Envío de imagen lanzado en segundo plano")
-    else:
+def _capturar_una_vez(ctx: Ctx) -> tuple[Path, bytes | None]:
+    """
+    Una sola foto a captura.jpg, compartida por todas las pantallas. Retorna también sus bytes
+    (para el historial; en tubería la captura siguiente puede pisar el archivo), o None si no hubo foto.
+    """
+    ctx.salida.mkdir(parents=True, exist_ok=True)
+    ruta = ctx.salida / "captura.jpg"
+    if ctx.camara is not None:
+        jpeg = ctx.camara.capturar()
+        ruta.write_bytes(jpeg)
+        return ruta, jpeg
+    if not ctx.modo_prueba:
+        from capturar_enviar import capturar_con_rpicam  # import tardío
+        capturar_con_rpicam(ruta, ancho=800, alto=600)
+        return ruta, ruta.read_bytes()
+    return ruta, None
+
+def mostrar_y_tocar(ctx: Ctx, datos: bytes | dict[str, bytes], motores: Motores | None = None,
+                    registro: RegistroCiclo = NULO) -> bool:
+    """Etapa de salida con el cuadro ya preparado (tubería): envío a la EPD, canción y final."""
+    if aborted():
         return False
+    return _correr_grafo(ctx, lambda: datos, motores, registro)
+
+def _correr_grafo(ctx: Ctx, cuadro: Callable[[], bytes | dict[str, bytes]], motores: Motores | None,
+                  registro: RegistroCiclo) -> bool:
+    """
+    El ciclo como grafo; cada etapa arranca apenas terminan sus dependencias:
+
+        motores ───┐
+        partitura ─┴─ cancion ───────────┐
+        cuadro ──── envio ─ confirmacion ┴─ final
+
+    La canción suena mientras se captura, difumina y envía el cuadro (Motores.tocar_linea acorta
+    el intervalo del GIL para que el difuminado no retrase las notas). Qué espera `final` además
+    de `envio` lo decide ctx.final (POLITICAS_FINAL). Sin cuadro no hay canción: si falla la
+    captura, la preparación o el lanzamiento del envío, la canción se corta y el error se relanza
+    cuando ya terminaron las demás etapas (los motores no se cierran a media nota). Retorna False
+    si hubo abort.
+    """
+    inicio_ns = time.monotonic_ns()
+    grafo = GrafoEtapas("Ciclo")
+    corte = ABORTO.hijo()  # corta solo esta canción; un abort también la corta
 
-    # MUSICA (arranca de inmediato)
-    EM.bpm = ctx.bpm
-    EM.transposicion = 0
-    EM.direccionAlta = False
-    with Motores(gpiochip_index="auto", pin_enable=None) as m:
-        if aborted():
-            logging.info("[Sistema] Abortado antes de iniciar música")
-        else:
+    def _sin_cuadro_sin_cancion(fn: Callable) -> Callable:
+        def envuelta(*argumentos):
+            try:
+                return fn(*argumentos)
+            except BaseException:
+                if not aborted():
+                    logging.warning("[Sistema] Sin cuadro para mostrar: corto la canción")
+                corte.cancelar()
+                raise
+        return envuelta
+
+    with ExitStack() as pila:
+        def _motores() -> Motores:
+            if motores is not None:
+                return motores
+            with registro.etapa("motores"):
+                return pila.enter_context(Motores(gpiochip_index="auto", pin_enable=None))
+
+        def _partitura():
+            # La partitura compilada se memoriza entre ciclos
+            with registro.etapa("partitura"):
+                if ctx.partitura is not None:
+                    return cargar_partitura(ctx.partitura, ctx.bpm, 0,
+                                            directorio_cache=ctx.salida / "cache" / "partituras")
+                return compilar_partitura(tocar_cancion_una_vez, ctx.bpm, 0)
+
+        def _cancion(m: Motores, linea):
+            if corte.cancelado:
+                logging.info("[Sistema] Abortado antes de iniciar música" if aborted() else
+                             "[Sistema] Sin cuadro: no inicio la música")
+                return None
+            registro.dato("primera_nota_s", round((time.monotonic_ns() - inicio_ns) / 1e9, 6))
             logging.info("[Motores] 🎵 Iniciando canción...")
-            tocar_cancion_una_vez(m)
+            with registro.etapa("cancion"):
+                reproduccion = m.tocar_linea(linea, corte)
+            registro.dato("cancion", reproduccion.resumen())
             logging.info("[Motores] ✓ Canción terminada")
+            return reproduccion
+
+        def _envio(datos):
+            # MOSTRAR (asíncrono): la sesión de cada puerto envía en su propio hilo
+            if aborted():
+                return None
+            if isinstance(datos, dict):
+                envios = enviar_a_pantallas(ctx.pantallas, datos, ctx.modo_prueba, delta=ctx.delta,
+                                            comprimir=ctx.comprimir, hilos=ctx.hilos_epd)
+                logging.info(f"[EPD] Envío de imagen lanzado a {len(envios)} pantallas")
+                return envios
+            envio = mostrar_imagen_async(
+                ctx.puerto_epd, ctx.baud, datos, ctx.modo_prueba,
+                delta=ctx.delta, ancho=ctx.spec.ancho, comprimir=ctx.comprimir, baud_max=ctx.baud_max,
+                tramas=ctx.tramas,
+            )
+            logging.info("[EPD] Envío de imagen lanzado en segundo plano")
+            return envio
+
+        def _confirmacion(envio):
+            # Sin plazo: la sesión serial ya acota cada comando y corta ante abort
+            if envio is None:
+                return None
+            if isinstance(envio, list):
+                resultados = esperar_resultados(envio, "Imagen mostrada")
+                registro.dato("epd", [{"puerto": r.puerto, "confirmacion": r.confirmacion, "modo": r.modo,
+                                       "bytes_enviados": r.bytes_enviados, "cola_s": round(r.espera_s, 6),
+                                       "duracion_s": round(r.duracion_s, 6)} for r in resultados])
+                return resultados
+            res = esperar_envio(envio, None)
+            if res is not None:
+                for etapa, segundos in res.etapas().items():
+                    registro.anotar(etapa, segundos)
+                registro.dato("epd", {"confirmacion": res.confirmacion, "modo": res.modo,
+                                      "bytes_enviados": res.bytes_enviados, "retransmitidos": res.retransmitidos})
+            return res
+
+        def _final(*_) -> bool:
+            # Si hubo abort(), no toques la EPD (ni limpiar ni dormir)
+            if aborted():
+                logging.info("[Sistema] Abortado: no limpio ni duermo EPD; salgo de inmediato")
+                return False
+
+            # Si la política no incluye la confirmación, se le da --espera-epd más, no indefinidamente
+            en_vuelo = False
+            if grafo.resultado("envio") is not None:
+                with registro.etapa("espera_epd"):
+                    en_vuelo = not grafo.esperar("confirmacion", ctx.espera_epd)
+                if en_vuelo:
+                    logging.warning(f"[EPD] El cuadro sigue en vuelo tras {ctx.espera_epd:.1f}s")
+            registro.dato("en_vuelo", en_vuelo)
+
+            if ctx.sleep_epd and en_vuelo:
+                logging.warning("[EPD] No limpio ni duermo: el cuadro no se confirmó dentro de --espera-epd")
+            elif ctx.sleep_epd and ctx.pantallas:
+                logging.info("[EPD] Limpio y duermo (flag --sleep activado)")
+                with registro.etapa("limpiar_dormir"):
+                    esperar_resultados(limpiar_pantallas(ctx.pantallas, True, ctx.modo_prueba, ctx.comprimir,
+                                                         hilos=ctx.hilos_epd), "Limpiar y dormir")
+            elif ctx.sleep_epd:
+                logging.info("[EPD] Limpio y duermo (flag --sleep activado)")
+                with registro.etapa("limpiar_dormir"):
+                    limpiar_y_dormir(
+                        ctx.puerto_epd, ctx.baud, ctx.spec.ancho, ctx.spec.alto,
+                        dormir=True, modo_prueba=ctx.modo_prueba, comprimir=ctx.comprimir, baud_max=ctx.baud_max,
+                        tramas=ctx.tramas,
+                    )
+            else:
+                logging.info("[EPD] Mantengo la imagen; no limpio ni duermo")
+            return True
+
+        grafo.etapa("motores", _motores)
+        grafo.etapa("partitura", _partitura)
+        grafo.etapa("cancion", _cancion, ("motores", "partitura"))
+        grafo.etapa("cuadro", _sin_cuadro_sin_cancion(cuadro))
+        grafo.etapa("envio", _sin_cuadro_sin_cancion(_envio), ("cuadro",))
+        grafo.etapa("confirmacion", _confirmacion, ("envio",))
+        grafo.etapa("final", _final, ("envio",) + POLITICAS_FINAL[ctx.final])
+        grafo.iniciar()
+        # La confirmación puede seguir en vuelo (política "cancion"); el resto termina antes de cerrar motores
+        grafo.esperar_todas(excepto=("confirmacion",))
 
-    # Si hubo abort(), no toques la EPD (ni limpiar ni dormir)
     if aborted():
-        logging.info("[Sistema] Abortado: no limpio ni duermo EPD; salgo de inmediato")
         return False
-
-    # FINAL
-    if ctx.sleep_epd:
-        logging.info("[EPD] Limpio y duermo (flag --sleep activado)")
-        limpiar_y_dormir(
-            ctx.puerto_epd, ctx.baud, ctx.spec.ancho, ctx.spec.alto,
-            dormir=True, modo_prueba=ctx.modo_prueba
-        )
-    else:
-        logging.info("[EPD] Mantengo la imagen; no limpio ni duermo")
-
-    return True
+    grafo.comprobar()
+    return grafo.resultado("final")
@@ -0,0 +1,76 @@
+from __future__ import annotations
+import threading
+from typing import Any, Callable
+
+
+class _Etapa:
+    def __init__(self, nombre: str, fn: Callable[..., Any], depende: tuple[str, ...]):
+        self.nombre = nombre
+        self.fn = fn
+        self.depende = depende
+        self.hecha = threading.Event()
+        self.resultado: Any = None
+        self.error: BaseException | None = None
+
+
+class GrafoEtapas:
+    """
+    Etapas con dependencias: cada una corre en su hilo apenas terminan las que necesita y recibe
+    sus resultados como argumentos, en el orden de `depende`. Si una dependencia falla, la etapa
+    no corre y hereda el error (así la causa original llega hasta quien pide el resultado).
+    """
+
+    def __init__(self, nombre: str = "Grafo"):
+        self.nombre = nombre
+        self._etapas: dict[str, _Etapa] = {}
+        self._hilos: list[threading.Thread] = []
+
+    def etapa(self, nombre: str, fn: Callable[..., Any], depende: tuple[str, ...] = ()) -> None:
+        faltantes = [d for d in depende if d not in self._etapas]
+        if faltantes:
+            raise ValueError(f"la etapa {nombre!r} depende de etapas no declaradas: {faltantes}")
+        self._etapas[nombre] = _Etapa(nombre, fn, tuple(depende))
+
+    def iniciar(self) -> None:
+        for e in self._etapas.values():
+            hilo = threading.Thread(target=self._correr, args=(e,), name=f"{self.nombre}-{e.nombre}", daemon=True)
+            self._hilos.append(hilo)
+            hilo.start()
+
+    def _correr(self, e: _Etapa) -> None:
+        try:
+            argumentos = []
+            for d in e.depende:
+                dep = self._etapas[d]
+                dep.hecha.wait()
+                if dep.error is not None:
+                    e.error = dep.error
+                    return
+                argumentos.append(dep.resultado)
+            e.resultado = e.fn(*argumentos)
+        except BaseException as error:
+            e.error = error
+        finally:
+            e.hecha.set()
+
+    def esperar(self, nombre: str, plazo_s: float | None = None) -> bool:
+        """Bloquea hasta que termine la etapa (o venza `plazo_s`). True si terminó."""
+        return self._etapas[nombre].hecha.wait(plazo_s)
+
+    def esperar_todas(self, excepto: tuple[str, ...] = ()) -> None:
+        for nombre, e in self._etapas.items():
+            if nombre not in excepto:
+                e.hecha.wait()
+
+    def resultado(self, nombre: str) -> Any:
+        """Resultado de una etapa terminada; relanza su error (o el de la dependencia que la frenó)."""
+        e = self._etapas[nombre]
+        if e.error is not None:
+            raise e.error
+        return e.resultado
+
+    def comprobar(self) -> None:
+        """Relanza el primer error, en orden de declaración, entre las etapas ya terminadas."""
+        for e in self._etapas.values():
+            if e.hecha.is_set() and e.error is not None:
+                raise e.error
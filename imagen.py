@@ -1,8 +1,15 @@
 from __future__ import annotations
+import io
+import logging
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Tuple
-from dither import EspecificacionPantalla, cargar_y_preparar, empaquetar_bn_bit_mas_significativo_primero
+from dither import EspecificacionPantalla, MedicionEtapa, cargar_y_empaquetar
+from cache_cuadros import CacheCuadros
+from camara import Camara
+from artefactos import EscritorArtefactos, LoteArtefactos, png
+from perfil import NULO, RegistroCiclo
+from PIL import Image
 
 @dataclass
 class PantallaSpec:
@@ -12,22 +19,101 @@ class PantallaSpec:
     espejo: bool
 
 
-def preparar_imagen(dest_dir: Path, spec: PantallaSpec, difuminado: str, ruta_fuente: Path | None, capturar: bool, modo_prueba: bool) -> Tuple[bytes, Path]:
+def preparar_imagen(dest_dir: Path, spec: PantallaSpec, difuminado: str, ruta_fuente: Path | None, capturar: bool, modo_prueba: bool,
+                    cache: CacheCuadros | None = None, camara: Camara | None = None,
+                    nombre_vista: str = "vista_previa_1bit.png",
+                    artefactos: EscritorArtefactos | LoteArtefactos | None = None,
+                    registro: RegistroCiclo = NULO, captura: bytes | None = None) -> Tuple[bytes, Path]:
+    """
+    Retorna (cuadro empaquetado, ruta de la vista previa). Con `artefactos`, la vista previa, el
+    cuadro y la captura se escriben en segundo plano (la ruta puede no existir todavía).
+    `captura` es la foto ya tomada por quien llama (varias pantallas); va al historial con este cuadro.
+    Los tiempos de captura, de cada etapa de dither y del guardado van a `registro` (--perfil).
+    """
     dest_dir.mkdir(parents=True, exist_ok=True)
 
     if ruta_fuente is None and not capturar:
         raise RuntimeError("Proveer --imagen o --capturar")
 
+    vista = dest_dir / nombre_vista
+    esp = EspecificacionPantalla(ancho=spec.ancho, alto=spec.alto, rotacion=spec.rotacion, espejo=spec.espejo)
+
+    if capturar and camara is not None:
+        # Cuadro en memoria, sin pasar por captura.jpg
+        with registro.etapa("captura"):
+            jpeg = camara.capturar()
+        etapas = {}
+        img1, datos = cargar_y_empaquetar(Image.open(io.BytesIO(jpeg)), esp, difuminado=difuminado, etapas=etapas)
+        _registrar_etapas(etapas, registro)
+        with registro.etapa("guardar_vista"):
+            _guardar_artefactos(vista, img1, datos, artefactos, captura=jpeg)
+        return datos, vista
+
     if capturar:
         ruta_fuente = dest_dir / "captura.jpg"
         if not modo_prueba:
             from capturar_enviar import capturar_con_rpicam  # import tardío
-            capturar_con_rpicam(ruta_fuente, ancho=800, alto=600)
+            with registro.etapa("captura"):
+                capturar_con_rpicam(ruta_fuente, ancho=800, alto=600)
 
     assert ruta_fuente is not None
-    esp = EspecificacionPantalla(ancho=spec.ancho, alto=spec.alto, rotacion=spec.rotacion, espejo=spec.espejo)
-    img1 = cargar_y_preparar(str(ruta_fuente), esp, difuminado=difuminado)
-    vista = dest_dir / "vista_previa_1bit.png"
-    img1.save(vista)
-    datos = empaquetar_bn_bit_mas_significativo_primero(img1)
+
+    # Las capturas nunca se repiten: solo se cachean fuentes existentes (--imagen)
+    clave = None
+    if cache is not None and not capturar:
+        clave = cache.clave(ruta_fuente, spec.ancho, spec.alto, spec.rotacion, spec.espejo, difuminado)
+        guardado = cache.obtener(clave)
+        if guardado is not None:
+            datos, png_vista = guardado
+            registro.dato("cache", True)
+            # Sin PNG en la caché la vista anterior queda, pero el cuadro igual entra al historial
+            if png_vista is not None or artefactos is not None:
+                with registro.etapa("guardar_vista"):
+                    _guardar_artefactos(vista, png_vista, datos, artefactos, captura=captura)
+            logging.debug(f"[Imagen] Cuadro desde caché ({clave[:8]})")
+            return datos, vista
+
+    etapas = {}
+    img1, datos = cargar_y_empaquetar(str(ruta_fuente), esp, difuminado=difuminado, etapas=etapas)
+    _registrar_etapas(etapas, registro)
+    # Se lee ahora: en tubería la captura siguiente puede pisar captura.jpg antes que escriba el hilo
+    if captura is None and capturar and artefactos is not None and ruta_fuente.exists():
+        captura = ruta_fuente.read_bytes()
+    despues = None
+    if cache is not None and clave is not None:
+        despues = lambda producidos: cache.guardar(clave, datos, producidos[vista.name])
+    with registro.etapa("guardar_vista"):
+        _guardar_artefactos(vista, img1, datos, artefactos, captura=captura, despues=despues)
     return datos, vista
+
+
+def _guardar_artefactos(vista: Path, img1: Image.Image | bytes | None, datos: bytes,
+                        artefactos: EscritorArtefactos | LoteArtefactos | None, captura: bytes | None = None, despues=None) -> None:
+    """Vista previa (+ cuadro y captura en el historial): en segundo plano si hay escritor."""
+    if artefactos is None:
+        if img1 is None:
+            return
+        if isinstance(img1, bytes):
+            vista.write_bytes(img1)
+        else:
+            img1.save(vista)
+        if despues is not None:
+            despues({vista.name: vista.read_bytes()})
+        return
+    # Con varias pantallas cada vista tiene sufijo; el cuadro lleva el mismo
+    cuadro = "cuadro_bn" + vista.stem.removeprefix("vista_previa_1bit") + ".bin"
+    archivos = {cuadro: datos}
+    if img1 is not None:
+        archivos[vista.name] = img1 if isinstance(img1, bytes) else png(img1)
+    if captura is not None:
+        archivos["captura.jpg"] = captura  # solo al historial: captura.jpg es de la cámara
+    artefactos.guardar(archivos, ultimos=tuple(n for n in archivos if n != "captura.jpg"), despues=despues)
+
+
+def _registrar_etapas(etapas: dict[str, MedicionEtapa], registro: RegistroCiclo = NULO) -> None:
+    for nombre, m in etapas.items():
+        registro.anotar(nombre, m.pared_s)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("[Imagen] Etapas: " + ", ".join(
+            f"{nombre} {m.cpu_s * 1e3:.1f}ms cpu/{m.pared_s * 1e3:.1f}ms ({m.bytes_buffer / 1024:.0f} KiB)"
+            for nombre, m in etapas.items()))
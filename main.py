@@ -5,13 +5,20 @@ import logging
 from configuracion import parse_config
 from imagen import PantallaSpec
 from estados import Ctx, run_ciclo
-from utilidades import setup_logging, install_sigint_handler
+from cache_cuadros import CacheCuadros
+from artefactos import EscritorArtefactos
+from camara import crear_camara
+from servicio import Servicio
+from tuberia import run_ciclos
+from pantallas import cargar_pantallas
+from perfil import Perfil
+from utilidades import setup_logging, install_signal_handlers
 
 
 def main():
     cfg, difuminado = parse_config()
     setup_logging(True)
-    install_sigint_handler()
+    install_signal_handlers()
 
     spec = PantallaSpec(
         ancho=cfg.pantalla_ancho,
@@ -20,9 +27,24 @@ def main():
         espejo=cfg.espejo,
     )
 
+    cache = None
+    if cfg.cache:
+        cache = CacheCuadros(cfg.salida / "cache", max_bytes_disco=int(cfg.cache_max_mb * (1 << 20)))
+
+    # Vistas previas, cuadros y capturas se escriben en segundo plano, con historial rotativo
+    artefactos = EscritorArtefactos(cfg.salida, max_entradas=cfg.historial,
+                                    max_bytes=int(cfg.historial_max_mb * (1 << 20)))
+
+    camara = None
+    if cfg.capturar and cfg.camara != "archivo":
+        # En modo prueba no se toca el hardware: la cámara real se reemplaza por la falsa
+        camara = crear_camara("falsa" if cfg.modo_prueba else cfg.camara).iniciar()
+
     ctx = Ctx(
         puerto_epd=cfg.puerto_epd,
         baud=cfg.baud,
+        baud_max=cfg.baud_max,
+        tramas=cfg.tramas,
         spec=spec,
         bpm=cfg.bpm,
         sleep_epd=cfg.sleep_epd,     # << pasa el flag
@@ -30,11 +52,30 @@ def main():
         salida=cfg.salida,
         difuminado=difuminado,
         espera_epd=cfg.espera_epd,
+        final=cfg.final,
+        delta=cfg.delta,
+        comprimir=cfg.comprimir,
+        cache=cache,
+        camara=camara,
+        partitura=cfg.partitura,
+        pantallas=cargar_pantallas(cfg.pantallas, cfg.baud, difuminado, cfg.baud_max, cfg.tramas) if cfg.pantallas else None,
+        hilos_epd=cfg.hilos_epd,
+        artefactos=artefactos,
+        perfil=Perfil(cfg.perfil, cfg.perfil_prometheus) if cfg.perfil is not None else None,
     )
 
     ruta_fuente = cfg.ruta_imagen
     try:
-        ok = run_ciclo(ctx, ruta_fuente, capturar=cfg.capturar)
+        if cfg.servicio:
+            Servicio(ctx, cfg.socket, ruta_fuente, cfg.capturar, capacidad=cfg.cola,
+                     gpiochip=cfg.gpiochip, pin_enable=cfg.pin_enable).ejecutar()
+            return
+        if cfg.ciclos > 1:
+            ok = not run_ciclos(ctx, ruta_fuente, cfg.capturar, cfg.ciclos, profundidad=cfg.profundidad).abortada
+        else:
+            ok = run_ciclo(ctx, ruta_fuente, capturar=cfg.capturar)
+        if cache is not None:
+            logging.debug(f"[Cache] {cache.estadisticas()}")
         if not ok:
             logging.warning("[Sistema] Ciclo abortado")
             sys.exit(2)
@@ -44,6 +85,11 @@ def main():
     except Exception:
         logging.exception("[Sistema] Error no controlado")
         sys.exit(1)
+    finally:
+        if camara is not None:
+            camara.detener()
+        artefactos.cerrar()
+        logging.debug(f"[Artefactos] {artefactos.estadisticas()}")
 
 
 if __name__ == "__main__":
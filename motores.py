@@ -1,15 +1,18 @@
 from __future__ import annotations
+import sys
 import time
 import logging
 from contextlib import AbstractContextManager
+from dataclasses import dataclass, field
+from typing import Sequence
 
 try:
     import lgpio  # type: ignore
 except Exception:
     lgpio = None
 
-from cancion import F_MIN, F_MAX, PULSE_MIN_US, EM, duracion_ms, midi_a_hz, nota_a_midi
-from utilidades import aborted
+from cancion import EM, LineaTiempo, duracion_ms, hz_a_medio_periodo_us, midi_a_hz, nota_a_midi
+from utilidades import ABORTO, TokenCancelacion, aborted
 
 MOTORES = [
     {"dir": 17, "step": 4},   # Motor 1
@@ -18,6 +21,38 @@ MOTORES = [
     {"dir": 8,  "step": 25},  # Motor 4
     {"dir": 7,  "step": 21},  # Motor 5
 ]
+_PINES_DIR = [m["dir"] for m in MOTORES]
+_TODOS = (1 << len(MOTORES)) - 1  # máscara de grupo: bit i = motor i
+
+_GIRO_FINO_NS = 1_000_000      # último ms antes de un límite: giro con sleep(0)
+_UMBRAL_SOBRECARGA_US = 2_000   # una nota que arranca más tarde que esto cuenta como sobrecarga
+# Durante tocar_linea: otro hilo con trabajo de CPU en Python (difuminado del ciclo) suelta el GIL
+# cada 100 µs en vez de cada 5 ms, así la nota siguiente no espera su turno
+_INTERVALO_GIL_S = 1e-4
+
+
+@dataclass
+class EstadisticasReproduccion:
+    """Puntualidad de una reproducción: retraso de arranque de cada nota respecto a su instante ideal."""
+    jitter_us: list[int] = field(default_factory=list)
+    deriva_final_us: int = 0  # fin real - fin ideal de la canción
+    abortada: bool = False
+
+    def resumen(self) -> dict:
+        if not self.jitter_us:
+            return {"notas": 0, "abortada": self.abortada}
+        ordenados = sorted(self.jitter_us)
+        n = len(ordenados)
+        return {
+            "notas": n,
+            "jitter_p50_us": ordenados[n // 2],
+            "jitter_p99_us": ordenados[min(n - 1, int(0.99 * n))],
+            "jitter_max_us": ordenados[-1],
+            "sobrecargas": sum(1 for j in ordenados if j > _UMBRAL_SOBRECARGA_US),
+            "deriva_final_us": self.deriva_final_us,
+            "abortada": self.abortada,
+        }
+
 
 def _auto_gpiochip_index() -> int:
     if lgpio is None:
@@ -41,6 +76,10 @@ class Motores(AbstractContextManager):
         self.gpiochip_index = _auto_gpiochip_index() if gpiochip_index == "auto" else int(gpiochip_index)
         self.pin_enable = pin_enable
         self.handle = None
+        self.ultima_reproduccion: EstadisticasReproduccion | None = None
+        self._grupo_dir = False               # pines DIR reclamados como un grupo lgpio
+        self._dir_actual: int | None = None   # últimos bits escritos en DIR
+        self._activos: set[int] = set()       # motores con tren de pulsos en curso
 
     def __enter__(self):
         if lgpio is None:
@@ -52,8 +91,15 @@ class Motores(AbstractContextManager):
             lgpio.gpio_write(self.handle, self.pin_enable, 1)  # deshabilitado
         for m in MOTORES:
             lgpio.gpio_claim_output(self.handle, m["step"])
-            lgpio.gpio_claim_output(self.handle, m["dir"])
-            lgpio.gpio_write(self.handle, m["dir"], 1)
+        # DIR como grupo: una sola escritura cambia los cinco motores
+        if hasattr(lgpio, "group_claim_output"):
+            lgpio.group_claim_output(self.handle, _PINES_DIR, [1] * len(_PINES_DIR))
+            self._grupo_dir = True
+        else:
+            for pin in _PINES_DIR:
+                lgpio.gpio_claim_output(self.handle, pin)
+                lgpio.gpio_write(self.handle, pin, 1)
+        self._dir_actual = _TODOS
         logging.info(f"[Motores] gpiochip={self.gpiochip_index}")
         return self
 
@@ -68,70 +114,149 @@ class Motores(AbstractContextManager):
                     lgpio.gpio_write(self.handle, self.pin_enable, 1)
                 for m in MOTORES:
                     lgpio.gpio_write(self.handle, m["step"], 0)
-                    lgpio.gpio_write(self.handle, m["dir"], 0)
+                self._escribir_dir(0)
             finally:
                 lgpio.gpiochip_close(self.handle)
                 self.handle = None
+                self._grupo_dir = False
+                self._dir_actual = None
         logging.info("[Motores] Cerrados y deshabilitados")
 
     # --- Bajo nivel ---
     def _tone_off(self):
         if lgpio is None or self.handle is None:
             return
-        for m in MOTORES:
+        # Solo los motores que están sonando: en silencios no hay llamadas
+        for i in self._activos:
             try:
-                lgpio.tx_pulse(self.handle, m["step"], 0, 0, 0, 0)
-                lgpio.gpio_write(self.handle, m["step"], 0)
+                lgpio.tx_pulse(self.handle, MOTORES[i]["step"], 0, 0, 0, 0)
+                lgpio.gpio_write(self.handle, MOTORES[i]["step"], 0)
             except Exception:
                 pass
+        self._activos.clear()
+
+    def _escribir_dir(self, bits: int):
+        """Escribe DIR de todos los motores (bit i = motor i); no hace nada si no cambia."""
+        if lgpio is None or self.handle is None or bits == self._dir_actual:
+            return
+        if self._grupo_dir:
+            lgpio.group_write(self.handle, _PINES_DIR[0], bits, _TODOS)
+        else:
+            for i, pin in enumerate(_PINES_DIR):
+                lgpio.gpio_write(self.handle, pin, (bits >> i) & 1)
+        self._dir_actual = bits
 
     def _tone_on(self, freq_hz: float):
+        self._tone_on_us(hz_a_medio_periodo_us(freq_hz))
+
+    def _tone_on_us(self, half_us: int):
+        self._tone_on_voces((half_us,))
+
+    def _tone_on_voces(self, medios_us: Sequence[int]):
+        """Una voz por motor: el motor i toca medios_us[i % len(medios_us)] (0 = callado)."""
         if lgpio is None or self.handle is None:
             return
-        f = max(F_MIN, min(F_MAX, float(freq_hz)))
-        half_us = max(PULSE_MIN_US, int(round(1_000_000.0 / (2.0 * f))))
         self._tone_off()
-        for m in MOTORES:
-            lgpio.tx_pulse(self.handle, m["step"], half_us, half_us, 0, 0)
+        for i, m in enumerate(MOTORES):
+            half_us = medios_us[i % len(medios_us)]
+            if half_us > 0:
+                lgpio.tx_pulse(self.handle, m["step"], half_us, half_us, 0, 0)
+                self._activos.add(i)
 
     def _tocar(self, hz: float, ms: int, dirAlta: bool):
         """Toca una 'nota' por ms milisegundos, pero sale inmediatamente si hay abort()."""
-        if ms <= 0:
+        self._tocar_us(hz_a_medio_periodo_us(hz) if hz > 0 else 0, ms * 1000, dirAlta)
+
+    def _tocar_us(self, half_us: int | Sequence[int], dur_us: int, dirAlta: bool):
+        """
+        Bajo nivel de _tocar: semiperiodo ya calculado (0 = silencio) y duración en µs.
+        `half_us` puede ser una secuencia de voces (ver _tone_on_voces).
+        """
+        if dur_us <= 0:
             self._tone_off()
             return
+        fin_ns = time.monotonic_ns() + dur_us * 1000
+        self._iniciar_nota(half_us, dirAlta)
+        self._dormir_hasta(fin_ns)
+        self._terminar_nota()
 
-        # Simulación / sin hardware: solo espera pero respetando abort()
+    def _iniciar_nota(self, half_us: int | Sequence[int], dirAlta: bool):
         if lgpio is None or self.handle is None:
-            deadline = time.time() + (ms / 1000.0)
-            while time.time() < deadline:
-                if aborted():
-                    break
-                time.sleep(0.01)
-            return
-
-        # Set dirección y ENABLE
-        for m in MOTORES:
-            lgpio.gpio_write(self.handle, m["dir"], 1 if dirAlta else 0)
+            return  # simulación / sin hardware: solo se respeta el tiempo
+        # Set dirección (una escritura de grupo) y ENABLE
+        bits = _TODOS if dirAlta else 0
+        if bits != self._dir_actual:
+            self._escribir_dir(bits)
+            time.sleep(0.001)  # asentamiento de DIR antes del primer STEP
         if self.pin_enable is not None:
             lgpio.gpio_write(self.handle, self.pin_enable, 0)  # habilitar
-        time.sleep(0.001)
-
         # Arranca tono si corresponde
-        if hz > 0:
-            self._tone_on(hz)
-
-        # Espera con chequeo frecuente de abort()
-        deadline = time.time() + (ms / 1000.0)
-        while time.time() < deadline:
-            if aborted():
-                break
-            time.sleep(0.01)
+        medios = (half_us,) if isinstance(half_us, int) else half_us
+        if any(medios):
+            self._tone_on_voces(medios)
 
+    def _terminar_nota(self):
         # Apaga y deshabilita
         self._tone_off()
-        if self.pin_enable is not None:
+        if lgpio is not None and self.handle is not None and self.pin_enable is not None:
             lgpio.gpio_write(self.handle, self.pin_enable, 1)
 
+    @staticmethod
+    def _dormir_hasta(limite_ns: int, token: TokenCancelacion = ABORTO) -> bool:
+        """
+        Duerme hasta el instante absoluto `limite_ns` (time.monotonic_ns); cancelar `token` la
+        despierta al instante. Bloquea en el token hasta el último ms y gira con sleep(0) ese tramo
+        final para no pasarse. Retorna False si se canceló antes.
+        """
+        while True:
+            restante = limite_ns - time.monotonic_ns()
+            if restante <= 0:
+                return True
+            if restante > _GIRO_FINO_NS:
+                if token.esperar((restante - _GIRO_FINO_NS) / 1e9):
+                    return False
+            elif token.cancelado:
+                return False
+            else:
+                time.sleep(0)
+
+    def tocar_linea(self, linea: LineaTiempo, detener: TokenCancelacion | None = None) -> EstadisticasReproduccion:
+        """
+        Toca una partitura ya compilada (cancion.compilar_partitura): sin aritmética musical por nota.
+        Cada nota empieza en un instante absoluto medido desde el inicio de la canción, así que los
+        retrasos de GPIO/planificador no se acumulan en deriva de tempo ni dependen del reloj de pared.
+        `detener` (p.ej. ABORTO.hijo()) corta solo esta canción; sin él, la corta un abort.
+        """
+        token = detener if detener is not None else ABORTO
+        stats = EstadisticasReproduccion()
+        # Con voces, cada evento lleva una tupla de semiperiodos (uno por voz)
+        medios = zip(*linea.voces) if linea.voces else linea.medio_periodo_us
+        intervalo = sys.getswitchinterval()
+        sys.setswitchinterval(min(intervalo, _INTERVALO_GIL_S))
+        try:
+            fin_ns = time.monotonic_ns()
+            for half_us, dur_us, direccion in zip(medios, linea.duracion_us, linea.direccion):
+                inicio_ns = fin_ns
+                fin_ns = inicio_ns + dur_us * 1000
+                if not self._dormir_hasta(inicio_ns, token):
+                    stats.abortada = True
+                    break
+                if dur_us <= 0:
+                    continue
+                self._iniciar_nota(half_us, bool(direccion))
+                stats.jitter_us.append((time.monotonic_ns() - inicio_ns) // 1000)
+                ok = self._dormir_hasta(fin_ns, token)
+                self._terminar_nota()
+                if not ok:
+                    stats.abortada = True
+                    break
+        finally:
+            sys.setswitchinterval(intervalo)
+        stats.deriva_final_us = (time.monotonic_ns() - fin_ns) // 1000
+        self.ultima_reproduccion = stats
+        logging.info(f"[Motores] Reproducción: {stats.resumen()}")
+        return stats
+
     # --- API musical ---
     def nota(self, n: int, octava: int, figura: int, alt: int = 0) -> None:
         if aborted():
@@ -145,3 +270,16 @@ class Motores(AbstractContextManager):
         if aborted():
             return
         self._tocar(0.0, duracion_ms(figura), EM.direccionAlta)
+
+    def acorde(self, notas: Sequence[tuple], figura: int) -> None:
+        """Varias notas a la vez, p.ej. [(RE, 4), (FA, 4, SOSTENIDO), (LA, 4)]; el motor i toca notas[i % n]."""
+        if aborted():
+            return
+        medios = [hz_a_medio_periodo_us(midi_a_hz(nota_a_midi(*n) + EM.transposicion)) for n in notas]
+        self._tocar_us(medios, duracion_ms(figura) * 1000, EM.direccionAlta)
+        EM.direccionAlta = not EM.direccionAlta
+
+    def voces(self, frecuencias_hz: Sequence[float], ms: int, dirAlta: bool = False) -> None:
+        """Una frecuencia por motor (0 = callado) durante `ms`."""
+        medios = [hz_a_medio_periodo_us(f) if f > 0 else 0 for f in frecuencias_hz]
+        self._tocar_us(medios, ms * 1000, dirAlta)
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+
+from artefactos import LoteArtefactos
+from difuminado import ALGORITMOS
+from imagen import PantallaSpec, preparar_imagen
+from perfil import NULO, RegistroCiclo
+from sesion_epd import obtener_sesion
+
+HILOS_POR_DEFECTO = 4
+_CONFIRMACIONES_OK = {"cuadro-ok", "ventana-ok", "sin-cambios", "dormir-ok", "prueba"}
+
+
+@dataclass
+class Pantalla:
+    puerto: str
+    spec: PantallaSpec
+    difuminado: str
+    baud: int
+    baud_max: int | None = None  # negociar velocidad y control de flujo hasta este valor
+    tramas: bool = False         # cuadros en bloques con CRC si el firmware lo admite
+
+    def clave_spec(self) -> tuple:
+        """Pantallas con la misma clave comparten el cuadro preparado."""
+        s = self.spec
+        return (s.ancho, s.alto, s.rotacion, s.espejo, self.difuminado)
+
+    def nombre_vista(self) -> str:
+        s = self.spec
+        return f"vista_previa_1bit_{s.ancho}x{s.alto}_r{s.rotacion}{'_espejo' if s.espejo else ''}_{self.difuminado}.png"
+
+
+@dataclass
+class ResultadoPantalla:
+    puerto: str
+    confirmacion: str    # valor de CONFIRMACIONES, 'prueba' (modo prueba) o 'fallo'
+    modo: str            # ver ResultadoEnvio.modo; 'ninguno' si no se envió
+    bytes_enviados: int
+    espera_s: float      # en la cola del pool antes de empezar
+    duracion_s: float    # desde el primer byte hasta la confirmación
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.confirmacion in _CONFIRMACIONES_OK
+
+
+def cargar_pantallas(ruta: Path, baud: int, difuminado: str, baud_max: int | None = None,
+                     tramas: bool = False) -> list[Pantalla]:
+    """
+    Lee la lista de pantallas de un JSON:
+      [{"puerto": "/dev/ttyACM0", "ancho": 104, "alto": 212, "rotacion": 90,
+        "espejo": false, "difuminado": "bayer", "baud": 115200, "baud_max": 921600, "tramas": true}, ...]
+    Solo `puerto` es obligatorio; el resto hereda de la línea de comandos.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        entradas = json.load(f)
+    if not isinstance(entradas, list) or not entradas:
+        raise ValueError(f"{ruta}: se esperaba una lista no vacía de pantallas")
+    pantallas = []
+    for i, e in enumerate(entradas):
+        if "puerto" not in e:
+            raise ValueError(f"{ruta}: la pantalla #{i + 1} no tiene 'puerto'")
+        if e.get("difuminado", difuminado) not in ALGORITMOS:
+            raise ValueError(f"{ruta}: la pantalla #{i + 1} pide un difuminado desconocido "
+                             f"{e['difuminado']!r} (opciones: {', '.join(ALGORITMOS)})")
+        pantallas.append(Pantalla(
+            puerto=e["puerto"],
+            spec=PantallaSpec(ancho=int(e.get("ancho", 104)), alto=int(e.get("alto", 212)),
+                              rotacion=int(e.get("rotacion", 0)), espejo=bool(e.get("espejo", False))),
+            difuminado=e.get("difuminado", difuminado),
+            baud=int(e.get("baud", baud)),
+            baud_max=int(e["baud_max"]) if e.get("baud_max") is not None else baud_max,
+            tramas=bool(e.get("tramas", tramas)),
+        ))
+    puertos = [p.puerto for p in pantallas]
+    if len(set(puertos)) != len(puertos):
+        raise ValueError(f"{ruta}: puertos repetidos")
+    return pantallas
+
+
+_ejecutores: dict[str, tuple[ThreadPoolExecutor, int]] = {}
+_ejecutores_lock = threading.Lock()
+
+
+def obtener_ejecutor(nombre: str, hilos: int = HILOS_POR_DEFECTO) -> ThreadPoolExecutor:
+    """
+    Pool acotado y compartido por todos los ciclos; se crea la primera vez que se usa y se
+    reemplaza si cambia `hilos` (el viejo termina lo que ya tiene en cola).
+    Envíos y preparación tienen pools separados: en tubería, la preparación del ciclo siguiente
+    no debe quedar en cola detrás de envíos que esperan segundos la confirmación del panel.
+    """
+    hilos = max(1, hilos)
+    with _ejecutores_lock:
+        ejecutor, actuales = _ejecutores.get(nombre, (None, 0))
+        if ejecutor is None or actuales != hilos:
+            if ejecutor is not None:
+                ejecutor.shutdown(wait=False)
+            ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix=f"Pantallas-{nombre}")
+            _ejecutores[nombre] = (ejecutor, hilos)
+        return ejecutor
+
+
+def preparar_cuadros(dest_dir: Path, pantallas: list[Pantalla], ruta_fuente: Path, modo_prueba: bool,
+                     cache=None, hilos: int = HILOS_POR_DEFECTO, artefactos=None,
+                     captura: bytes | None = None, registro: RegistroCiclo = NULO) -> dict[str, bytes]:
+    """
+    Prepara un cuadro por especificación distinta (no por pantalla) en paralelo y lo reparte a
+    las pantallas que la comparten. La fuente ya debe estar en disco (captura hecha una sola vez);
+    Con `artefactos`, los cuadros de todas las especificaciones y la `captura` (si se da) van a
+    una sola entrada del historial por ciclo.
+    Las etapas de cada especificación se suman en `registro` y quedan aparte bajo su vista previa.
+    """
+    grupos: dict[tuple, list[Pantalla]] = {}
+    for p in pantallas:
+        grupos.setdefault(p.clave_spec(), []).append(p)
+
+    ejecutor = obtener_ejecutor("preparar", hilos)
+    lote = LoteArtefactos(artefactos) if artefactos is not None else None
+    parciales = {clave: registro.parcial() for clave in grupos}
+    futuros = {
+        clave: ejecutor.submit(preparar_imagen, dest_dir, grupo[0].spec, grupo[0].difuminado, ruta_fuente,
+                               False, modo_prueba, cache=cache, nombre_vista=grupo[0].nombre_vista(),
+                               artefactos=lote, registro=parciales[clave],
+                               captura=captura if i == 0 else None)
+        for i, (clave, grupo) in enumerate(grupos.items())
+    }
+    cuadros = {}
+    for clave, futuro in futuros.items():
+        datos, vista = futuro.result()
+        registro.sumar(parciales[clave], vista.stem)
+        logging.info(f"[Imagen] Vista previa: {vista}")
+        for p in grupos[clave]:
+            cuadros[p.puerto] = datos
+    if lote is not None:
+        lote.confirmar()
+    logging.debug(f"[Pantallas] {len(grupos)} cuadros preparados para {len(pantallas)} pantallas")
+    return cuadros
+
+
+def enviar_a_pantallas(pantallas: list[Pantalla], cuadros: dict[str, bytes], modo_prueba: bool,
+                       delta: bool = False, comprimir: bool = False,
+                       hilos: int = HILOS_POR_DEFECTO) -> list[Future]:
+    """Despacha un envío por pantalla en el pool; cada Future resuelve a un ResultadoPantalla."""
+    ejecutor = obtener_ejecutor("envios", hilos)
+    return [ejecutor.submit(_enviar, p, cuadros[p.puerto], modo_prueba, delta, comprimir, time.perf_counter())
+            for p in pantallas]
+
+
+def limpiar_pantallas(pantallas: list[Pantalla], dormir: bool, modo_prueba: bool, comprimir: bool = False,
+                      hilos: int = HILOS_POR_DEFECTO) -> list[Future]:
+    blancos = {p.puerto: bytes([0xFF]) * (((p.spec.ancho + 7) // 8) * p.spec.alto) for p in pantallas}
+    ejecutor = obtener_ejecutor("envios", hilos)
+    return [ejecutor.submit(_limpiar, p, blancos[p.puerto], dormir, modo_prueba, comprimir, time.perf_counter())
+            for p in pantallas]
+
+
+def esperar_resultados(futuros: list[Future], etiqueta: str, plazo_s: float | None = None) -> list[ResultadoPantalla]:
+    """
+    Espera los envíos (hasta `plazo_s` si se da) y registra el resultado de cada pantalla y el
+    tiempo de pared. Retorna solo los terminados; los que siguen en vuelo se avisan en el log.
+    """
+    t0 = time.perf_counter()
+    hechos, pendientes = wait(futuros, timeout=plazo_s)
+    if pendientes:
+        logging.warning(f"[EPD] {etiqueta}: {len(pendientes)} pantallas siguen en vuelo tras {plazo_s:.1f}s")
+    resultados = [f.result() for f in futuros if f in hechos]
+    for r in resultados:
+        detalle = f" — {r.error}" if r.error else ""
+        logging.info(f"[EPD] {etiqueta} {r.puerto}: {r.confirmacion} ({r.modo}, {r.bytes_enviados} bytes, "
+                     f"{r.duracion_s:.2f}s + {r.espera_s:.2f}s en cola){detalle}")
+    if resultados:
+        mas_lenta = max(r.espera_s + r.duracion_s for r in resultados)
+        ok = sum(r.ok for r in resultados)
+        logging.info(f"[EPD] {etiqueta}: {ok}/{len(resultados)} pantallas OK; la más lenta {mas_lenta:.2f}s "
+                     f"(espera final {time.perf_counter() - t0:.2f}s)")
+    return resultados
+
+
+def _enviar(p: Pantalla, datos: bytes, modo_prueba: bool, delta: bool, comprimir: bool,
+            encolado: float) -> ResultadoPantalla:
+    inicio = time.perf_counter()
+    if modo_prueba:
+        return ResultadoPantalla(p.puerto, "prueba", "ninguno", 0, inicio - encolado, 0.0)
+    try:
+        sesion = obtener_sesion(p.puerto, p.baud, p.baud_max, p.tramas)
+        if delta:
+            res = sesion.cuadro_delta(datos, (p.spec.ancho + 7) // 8, comprimir=comprimir)
+        else:
+            res = sesion.cuadro(datos, comprimir=comprimir)
+        return ResultadoPantalla(p.puerto, res.confirmacion, res.modo, res.bytes_enviados,
+                                 inicio - encolado, time.perf_counter() - inicio)
+    except Exception as e:
+        return ResultadoPantalla(p.puerto, "fallo", "ninguno", 0, inicio - encolado,
+                                 time.perf_counter() - inicio, error=str(e))
+
+
+def _limpiar(p: Pantalla, blanco: bytes, dormir: bool, modo_prueba: bool, comprimir: bool,
+             encolado: float) -> ResultadoPantalla:
+    inicio = time.perf_counter()
+    if modo_prueba:
+        return ResultadoPantalla(p.puerto, "prueba", "ninguno", 0, inicio - encolado, 0.0)
+    try:
+        sesion = obtener_sesion(p.puerto, p.baud, p.baud_max, p.tramas)
+        res = sesion.cuadro(blanco, comprimir=comprimir)
+        conf = res.confirmacion
+        if dormir:
+            # Se duerme igual, pero un limpiar fallido no queda tapado por un 'dormir-ok'
+            conf_dormir = sesion.dormir()
+            if conf in _CONFIRMACIONES_OK:
+                conf = conf_dormir
+        return ResultadoPantalla(p.puerto, conf, res.modo, res.bytes_enviados,
+                                 inicio - encolado, time.perf_counter() - inicio)
+    except Exception as e:
+        return ResultadoPantalla(p.puerto, "fallo", "ninguno", 0, inicio - encolado,
+                                 time.perf_counter() - inicio, error=str(e))
@@ -0,0 +1,338 @@
+from __future__ import annotations
+import hashlib
+import heapq
+import logging
+import os
+import re
+from array import array
+from pathlib import Path
+from typing import Iterator
+
+import cancion
+from cancion import LineaTiempo, NATURAL, SOSTENIDO, BEMOL, Grabadora, hz_a_medio_periodo_us, midi_a_hz
+from motores import MOTORES
+
+# Cambiar al modificar el compilador o el formato: invalida la caché en disco
+_VERSION = 2
+
+NOTAS = {"DO": cancion.DO, "RE": cancion.RE, "MI": cancion.MI, "FA": cancion.FA,
+         "SOL": cancion.SOL, "LA": cancion.LA, "SI": cancion.SI}
+FIGURAS = {nombre: getattr(cancion, nombre) for nombre in (
+    "REDONDA", "BLANCA", "NEGRA", "CORCHEA", "SEMICORCHEA", "FUSA", "SEMIFUSA",
+    "P_REDONDA", "P_BLANCA", "P_NEGRA", "P_CORCHEA", "T_NEGRA", "T_CORCHEA", "T_SEMICORCHEA")}
+_ALTERACIONES = {"": NATURAL, "#": SOSTENIDO, "b": BEMOL}
+_NOTA = re.compile(r"^(DO|RE|MI|FA|SOL|LA|SI)([#b]?)(-?\d)$")
+_CANAL_PERCUSION = 9  # canal 10 en numeración MIDI 1..16: no tiene altura
+
+
+# --- Texto ---
+def _eventos_texto(ruta: Path) -> Iterator[tuple]:
+    """
+    Notación de texto, línea a línea (varios eventos por línea separados por ';'):
+        RE4 P_NEGRA; SIL T_CORCHEA
+        FA#4 T_CORCHEA; SIb4 CORCHEA
+        [RE4 FA#4 LA4] NEGRA          # acorde
+    Notas DO..SI con '#'/'b' opcional y octava; figuras con los nombres de cancion.py.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        for num, linea in enumerate(f, 1):
+            linea = re.split(r"(?:^|\s)#", linea, maxsplit=1)[0]
+            for evento in linea.split(";"):
+                evento = evento.strip()
+                if evento:
+                    try:
+                        yield _parsear_evento(evento)
+                    except ValueError as e:
+                        raise ValueError(f"{ruta}:{num}: {e}") from None
+
+
+def _parsear_evento(evento: str) -> tuple:
+    if evento.startswith("["):
+        cierre = evento.find("]")
+        if cierre < 0:
+            raise ValueError(f"acorde sin cerrar: {evento!r}")
+        notas = [_parsear_nota(t) for t in evento[1:cierre].split()]
+        return ("acorde", notas, _parsear_figura(evento[cierre + 1:].strip()))
+    partes = evento.split()
+    if len(partes) != 2:
+        raise ValueError(f"evento inválido: {evento!r}")
+    if partes[0] == "SIL":
+        return ("silencio", _parsear_figura(partes[1]))
+    return ("nota", _parsear_nota(partes[0]), _parsear_figura(partes[1]))
+
+
+def _parsear_nota(token: str) -> tuple[int, int, int]:
+    m = _NOTA.match(token)
+    if not m:
+        raise ValueError(f"nota inválida: {token!r}")
+    return NOTAS[m.group(1)], int(m.group(3)), _ALTERACIONES[m.group(2)]
+
+
+def _parsear_figura(token: str) -> int:
+    if token not in FIGURAS:
+        raise ValueError(f"figura inválida: {token!r}")
+    return FIGURAS[token]
+
+
+def compilar_texto(ruta: Path, bpm: float, transposicion: int = 0) -> LineaTiempo:
+    g = Grabadora(bpm, transposicion, direccion_inicial=False)
+    for evento in _eventos_texto(ruta):
+        if evento[0] == "nota":
+            (n, octava, alt), figura = evento[1], evento[2]
+            g.nota(n, octava, figura, alt)
+        elif evento[0] == "silencio":
+            g.silencio(evento[1])
+        else:
+            g.acorde(evento[1], evento[2])
+    return g.linea()
+
+
+# --- MIDI (SMF 0/1) ---
+class _Lector:
+    """Lectura secuencial con búfer propio sobre un tramo [inicio, inicio+largo) del archivo."""
+
+    def __init__(self, f, inicio: int, largo: int):
+        self.f = f
+        self.f.seek(inicio)
+        self.restante = largo
+        self.buf = b""
+        self.pos = 0
+
+    def byte(self) -> int:
+        if self.pos >= len(self.buf):
+            if self.restante <= 0:
+                raise EOFError
+            self.buf = self.f.read(min(self.restante, 1 << 16))
+            if not self.buf:
+                raise EOFError
+            self.restante -= len(self.buf)
+            self.pos = 0
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def leer(self, n: int) -> bytes:
+        return bytes(self.byte() for _ in range(n))
+
+    def vlq(self) -> int:
+        valor = 0
+        while True:
+            b = self.byte()
+            valor = (valor << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return valor
+
+
+# Orden dentro de un mismo tick: tempo, luego apagados, luego encendidos; el fin de pista al final
+_TEMPO, _APAGAR, _ENCENDER, _FIN = 0, 1, 2, 3
+
+
+def _eventos_pista(ruta: Path, inicio: int, largo: int, pista: int) -> Iterator[tuple[int, int, int, int, int]]:
+    """(tick, tipo, pista, canal, valor) de una pista, leyendo el archivo a medida que se consume."""
+    with open(ruta, "rb") as f:
+        lector = _Lector(f, inicio, largo)
+        tick = 0
+        estado = 0
+        try:
+            while True:
+                tick += lector.vlq()
+                b = lector.byte()
+                if b == 0xFF:  # meta
+                    tipo = lector.byte()
+                    datos = lector.leer(lector.vlq())
+                    if tipo == 0x51 and len(datos) == 3:
+                        yield tick, _TEMPO, pista, 0, int.from_bytes(datos, "big")
+                    elif tipo == 0x2F:
+                        yield tick, _FIN, pista, 0, 0
+                        return
+                    estado = 0  # meta y sysex cancelan el running status
+                    continue
+                if b in (0xF0, 0xF7):  # sysex
+                    lector.leer(lector.vlq())
+                    estado = 0
+                    continue
+                if b & 0x80:
+                    estado = b
+                    d1 = lector.byte()
+                elif estado:  # running status
+                    d1 = b
+                else:
+                    raise ValueError(f"{ruta}: pista {pista}: dato sin byte de estado en el tick {tick}")
+                tipo, canal = estado & 0xF0, estado & 0x0F
+                if tipo in (0xC0, 0xD0):
+                    continue
+                d2 = lector.byte()
+                if tipo == 0x90 and d2 > 0:
+                    yield tick, _ENCENDER, pista, canal, d1
+                elif tipo == 0x80 or tipo == 0x90:
+                    yield tick, _APAGAR, pista, canal, d1
+        except EOFError:
+            return
+
+
+def _pistas(ruta: Path) -> tuple[int, list[tuple[int, int]]]:
+    """División (ticks por negra) y (inicio, largo) de cada pista, sin leer su contenido."""
+    with open(ruta, "rb") as f:
+        cabecera = f.read(14)
+        if cabecera[:4] != b"MThd":
+            raise ValueError(f"{ruta} no es un archivo MIDI")
+        division = int.from_bytes(cabecera[12:14], "big")
+        if division & 0x8000:
+            raise ValueError("MIDI con división SMPTE no soportado")
+        f.seek(8 + int.from_bytes(cabecera[4:8], "big"))
+        pistas = []
+        while True:
+            trozo = f.read(8)
+            if len(trozo) < 8:
+                break
+            largo = int.from_bytes(trozo[4:8], "big")
+            if trozo[:4] == b"MTrk":
+                pistas.append((f.tell(), largo))
+            f.seek(largo, os.SEEK_CUR)
+    return division, pistas
+
+
+def compilar_midi(ruta: Path, transposicion: int = 0, mapa: dict[int, int] | None = None) -> LineaTiempo:
+    """
+    Compila un MIDI a LineaTiempo polifónica sin cargarlo entero: cada pista se lee en su propio
+    flujo y se intercalan por tick. Cada canal va a una voz (motor) según `mapa` {canal: voz}
+    (0-15 → 0..len(MOTORES)-1); los que no están en `mapa` toman la voz libre más baja en orden
+    de aparición. Dentro de una voz manda la última nota.
+    """
+    n_max = len(MOTORES)
+    voz_de: dict[int, int] = dict(mapa or {})
+    for canal, voz in voz_de.items():
+        if not 0 <= canal < 16 or not 0 <= voz < n_max:
+            raise ValueError(f"mapa de canales inválido {canal}→{voz}: canales 0-15, voces 0-{n_max - 1}")
+    division, pistas = _pistas(ruta)
+    sonando: list[int | None] = [None] * n_max
+    medios: list[int] = [0] * n_max
+    voces = [array("I") for _ in range(n_max)]
+    duracion_us = array("I")
+    direccion = array("B")
+    descartados: set[int] = set()
+
+    tempo = 500_000  # µs por negra (120 bpm) hasta el primer evento de tempo
+    tick_prev = 0
+    t_us = 0.0
+    t_seg = 0.0
+    estado = tuple(medios)
+    dir_alta = False
+
+    flujos = [_eventos_pista(ruta, inicio, largo, i) for i, (inicio, largo) in enumerate(pistas)]
+    for tick, tipo, _, canal, valor in heapq.merge(*flujos, key=lambda e: (e[0], e[1])):
+        t_us += (tick - tick_prev) * tempo / division
+        tick_prev = tick
+        if tipo == _TEMPO:
+            tempo = valor
+            continue
+        if tipo == _FIN:
+            continue  # solo avanza el reloj: las notas que siguen sonando duran hasta aquí
+        if canal == _CANAL_PERCUSION:
+            continue
+        voz = voz_de.get(canal)
+        if voz is None:
+            libres = set(range(n_max)).difference(voz_de.values())
+            if not libres:
+                descartados.add(canal)
+                continue
+            voz = voz_de[canal] = min(libres)
+        if tipo == _ENCENDER:
+            sonando[voz] = valor
+            medios[voz] = hz_a_medio_periodo_us(midi_a_hz(valor + transposicion))  # acota a F_MIN..F_MAX
+        elif sonando[voz] == valor:
+            sonando[voz] = None
+            medios[voz] = 0
+
+        nuevo = tuple(medios)
+        if nuevo == estado:
+            continue
+        if t_us > t_seg and (len(duracion_us) or any(estado)):  # sin silencio inicial
+            for v in range(n_max):
+                voces[v].append(estado[v])
+            duracion_us.append(int(round(t_us - t_seg)))
+            direccion.append(1 if dir_alta else 0)
+            dir_alta = not dir_alta
+        t_seg = t_us
+        estado = nuevo
+
+    # Último segmento: notas sin note-off que suenan hasta el fin de la pista más larga
+    if t_us > t_seg and any(estado):
+        for v in range(n_max):
+            voces[v].append(estado[v])
+        duracion_us.append(int(round(t_us - t_seg)))
+        direccion.append(1 if dir_alta else 0)
+
+    if descartados:
+        logging.warning(f"[Partitura] Más canales que motores; ignorados: {sorted(c + 1 for c in descartados)}")
+    usadas = max(voz_de.values(), default=0) + 1
+    voces_usadas = tuple(voces[:usadas])
+    return LineaTiempo(voces_usadas[0], duracion_us, direccion, voces_usadas if usadas > 1 else None)
+
+
+# --- Caché en disco y punto de entrada ---
+def _clave(ruta: Path, bpm: float, transposicion: int, mapa: dict[int, int] | None = None) -> str:
+    h = hashlib.sha256(f"{_VERSION}|{bpm}|{transposicion}|{sorted((mapa or {}).items())}|".encode("utf-8"))
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloque)
+    return h.hexdigest()[:32]
+
+
+def _guardar(ruta: Path, linea: LineaTiempo) -> None:
+    voces = linea.voces or (linea.medio_periodo_us,)
+    tmp = ruta.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(f"OTL{_VERSION} {len(linea)} {len(voces)}\n".encode("ascii"))
+        linea.duracion_us.tofile(f)
+        linea.direccion.tofile(f)
+        for voz in voces:
+            voz.tofile(f)
+    os.replace(tmp, ruta)
+
+
+def _cargar(ruta: Path) -> LineaTiempo:
+    with open(ruta, "rb") as f:
+        magia, n, n_voces = f.readline().decode("ascii").split()
+        if magia != f"OTL{_VERSION}":
+            raise ValueError("versión de caché distinta")
+        n, n_voces = int(n), int(n_voces)
+        duracion_us, direccion = array("I"), array("B")
+        duracion_us.fromfile(f, n)
+        direccion.fromfile(f, n)
+        voces = []
+        for _ in range(n_voces):
+            voz = array("I")
+            voz.fromfile(f, n)
+            voces.append(voz)
+    return LineaTiempo(voces[0], duracion_us, direccion, tuple(voces) if n_voces > 1 else None)
+
+
+def cargar_partitura(ruta: Path, bpm: float, transposicion: int = 0,
+                     directorio_cache: Path | None = None, mapa: dict[int, int] | None = None) -> LineaTiempo:
+    """
+    Partitura desde archivo: .mid/.midi (tempo del propio archivo; `mapa` {canal: voz} como en
+    compilar_midi) o texto (tempo `bpm`).
+    Con `directorio_cache`, lo compilado se guarda y la próxima vez se carga sin recompilar.
+    """
+    es_midi = ruta.suffix.lower() in (".mid", ".midi")
+    ruta_cache = None
+    if directorio_cache is not None:
+        directorio_cache.mkdir(parents=True, exist_ok=True)
+        ruta_cache = directorio_cache / f"{_clave(ruta, 0.0 if es_midi else bpm, transposicion, mapa if es_midi else None)}.lin"
+        try:
+            linea = _cargar(ruta_cache)
+            logging.debug(f"[Partitura] {ruta.name} desde caché ({len(linea)} eventos)")
+            return linea
+        except (OSError, ValueError, EOFError):
+            pass
+
+    linea = compilar_midi(ruta, transposicion, mapa) if es_midi else compilar_texto(ruta, bpm, transposicion)
+    logging.info(f"[Partitura] {ruta.name}: {len(linea)} eventos, {linea.duracion_total_us / 1e6:.1f}s, "
+                 f"{len(linea.voces) if linea.voces else 1} voces")
+    if ruta_cache is not None:
+        try:
+            _guardar(ruta_cache, linea)
+        except OSError as e:
+            logging.warning(f"[Partitura] No se pudo guardar en caché: {e}")
+    return linea
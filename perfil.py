@@ -0,0 +1,151 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+
+class RegistroCiclo:
+    """
+    Tiempos (time.monotonic_ns) de las etapas de un ciclo y datos sueltos (bytes, confirmación...).
+    Una etapa repetida en el mismo ciclo acumula.
+    """
+
+    def __init__(self, ciclo: int):
+        self.ciclo = ciclo
+        self.marca = time.time()
+        self._inicio_ns = time.monotonic_ns()
+        self.etapas: dict[str, float] = {}
+        self.datos: dict[str, object] = {}
+        self.ok: bool | None = None
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t0 = time.monotonic_ns()
+        try:
+            yield
+        finally:
+            self.anotar(nombre, (time.monotonic_ns() - t0) / 1e9)
+
+    def anotar(self, nombre: str, segundos: float) -> None:
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    def dato(self, clave: str, valor: object) -> None:
+        self.datos[clave] = valor
+
+    def espera(self, nombre: str, segundos: float) -> None:
+        """Tiempo en que el ciclo solo esperó (p.ej. en la cola de la tubería): etapa propia, fuera de total_s."""
+        self.anotar(nombre, segundos)
+        self._inicio_ns += int(segundos * 1e9)
+
+    def parcial(self) -> RegistroCiclo:
+        """Registro aparte para una tarea en otro hilo (anotar no es atómico); se junta con `sumar`."""
+        return RegistroCiclo(self.ciclo)
+
+    def sumar(self, otro: RegistroCiclo, clave: str | None = None) -> None:
+        """
+        Acumula las etapas de un registro parcial. Con `clave` también quedan aparte en
+        datos["por_tarea"][clave] (con tareas en paralelo, la suma supera el tiempo de pared).
+        """
+        for nombre, s in otro.etapas.items():
+            self.anotar(nombre, s)
+        self.datos.update(otro.datos)
+        if clave is not None:
+            self.datos.setdefault("por_tarea", {})[clave] = {k: round(v, 6) for k, v in otro.etapas.items()}
+
+    def total_s(self) -> float:
+        return (time.monotonic_ns() - self._inicio_ns) / 1e9
+
+    def como_dict(self) -> dict:
+        return {"ciclo": self.ciclo, "marca": round(self.marca, 3), "ok": self.ok,
+                "total_s": round(self.total_s(), 6),
+                "etapas": {k: round(v, 6) for k, v in self.etapas.items()}, **self.datos}
+
+
+class _RegistroNulo:
+    """Sin --perfil: mismas llamadas, sin relojes ni diccionarios (costo de una llamada vacía)."""
+    ciclo = 0
+    ok = None
+    _nulo = nullcontext()
+
+    def etapa(self, nombre: str):
+        return self._nulo
+
+    def anotar(self, nombre: str, segundos: float) -> None:
+        pass
+
+    def dato(self, clave: str, valor: object) -> None:
+        pass
+
+    def espera(self, nombre: str, segundos: float) -> None:
+        pass
+
+    def parcial(self) -> _RegistroNulo:
+        return self
+
+    def sumar(self, otro, clave: str | None = None) -> None:
+        pass
+
+
+NULO = _RegistroNulo()
+
+
+class Perfil:
+    """
+    Telemetría por ciclo: una línea JSON por ciclo en `ruta_jsonl` y, si se da `ruta_prometheus`,
+    un textfile para el node_exporter (último ciclo por etapa + contadores acumulados).
+    """
+
+    def __init__(self, ruta_jsonl: Path, ruta_prometheus: Path | None = None):
+        self.ruta_jsonl = ruta_jsonl
+        self.ruta_prometheus = ruta_prometheus
+        self._lock = threading.Lock()
+        self._secuencia = 0
+        self._ciclos = 0
+        self._fallidos = 0
+        self._sumas: dict[str, float] = {}
+        ruta_jsonl.parent.mkdir(parents=True, exist_ok=True)
+
+    def nuevo_ciclo(self) -> RegistroCiclo:
+        with self._lock:
+            self._secuencia += 1
+            return RegistroCiclo(self._secuencia)
+
+    def emitir(self, registro: RegistroCiclo) -> None:
+        linea = json.dumps(registro.como_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._ciclos += 1
+            self._fallidos += registro.ok is False
+            for etapa, s in registro.etapas.items():
+                self._sumas[etapa] = self._sumas.get(etapa, 0.0) + s
+            try:
+                with open(self.ruta_jsonl, "a", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+                if self.ruta_prometheus is not None:
+                    self._escribir_prometheus(registro)
+            except OSError as e:
+                logging.warning(f"[Perfil] No se pudo escribir la telemetría: {e}")
+
+    def _escribir_prometheus(self, registro: RegistroCiclo) -> None:
+        lineas = [
+            "# HELP oraculo_etapa_segundos Duración de cada etapa en el último ciclo",
+            "# TYPE oraculo_etapa_segundos gauge",
+            *(f'oraculo_etapa_segundos{{etapa="{e}"}} {s:.6f}' for e, s in registro.etapas.items()),
+            "# HELP oraculo_etapa_segundos_total Tiempo acumulado por etapa desde el arranque",
+            "# TYPE oraculo_etapa_segundos_total counter",
+            *(f'oraculo_etapa_segundos_total{{etapa="{e}"}} {s:.6f}' for e, s in self._sumas.items()),
+            "# HELP oraculo_ciclo_segundos Duración total del último ciclo",
+            "# TYPE oraculo_ciclo_segundos gauge",
+            f"oraculo_ciclo_segundos {registro.total_s():.6f}",
+            "# TYPE oraculo_ciclos_total counter",
+            f"oraculo_ciclos_total {self._ciclos}",
+            "# TYPE oraculo_ciclos_fallidos_total counter",
+            f"oraculo_ciclos_fallidos_total {self._fallidos}",
+        ]
+        # Escritura atómica: el node_exporter nunca lee un archivo a medias
+        tmp = self.ruta_prometheus.with_suffix(self.ruta_prometheus.suffix + ".tmp")
+        tmp.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+        os.replace(tmp, self.ruta_prometheus)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import queue
+import select
+import socket
+import threading
+import time
+from pathlib import Path
+
+from estados import Ctx, run_ciclo
+from motores import Motores
+from utilidades import ABORTO, aborted
+
+SOCKET_POR_DEFECTO = "/tmp/oraculo.sock"
+
+
+class Servicio:
+    """
+    Modo servicio: inicializa motores, enlace EPD y cámara una sola vez y ejecuta ciclos a pedido.
+
+    Las órdenes llegan por un socket UNIX, una línea por conexión:
+      "ciclo"            → ciclo con la fuente por defecto (--imagen / --capturar)
+      "ciclo <ruta>"     → ciclo con esa imagen
+      "estado"           → JSON con contadores y largo de la cola
+    Respuesta: "encolado <n>", "ocupado" (cola llena: contrapresión, el cliente reintenta) o
+    "error <motivo>". Los ciclos corren de a uno, en orden de llegada.
+    """
+
+    def __init__(self, ctx: Ctx, ruta_socket: str, ruta_fuente: Path | None, capturar: bool,
+                 capacidad: int = 2, gpiochip: str | int = "auto", pin_enable: int | None = None):
+        self.ctx = ctx
+        self.ruta_socket = ruta_socket
+        self.ruta_fuente = ruta_fuente
+        self.capturar = capturar
+        self.gpiochip = gpiochip
+        self.pin_enable = pin_enable
+        # Sin maxsize: la capacidad la impone atender(), así el aviso de parada (None) siempre entra
+        self._cola: queue.Queue[tuple[int, Path | None, bool] | None] = queue.Queue()
+        self.capacidad = max(1, capacidad)
+        self._secuencia = 0
+        self._lock = threading.Lock()
+        self.completados = 0
+        self.fallidos = 0
+        self.rechazados = 0
+
+    def ejecutar(self) -> None:
+        """Bloquea hasta abort() (SIGINT/SIGTERM)."""
+        servidor = self._abrir_socket()
+        aceptador = threading.Thread(target=self._aceptar, args=(servidor,), name="ServicioSocket", daemon=True)
+        try:
+            with Motores(gpiochip_index=self.gpiochip, pin_enable=self.pin_enable) as m:
+                aceptador.start()
+                logging.info(f"[Servicio] Escuchando en {self.ruta_socket}")
+                while True:
+                    item = self._cola.get()  # el abort despierta con un None (ver _aceptar)
+                    if item is None or aborted():
+                        break
+                    self._correr(*item, m)
+        finally:
+            servidor.close()
+            try:
+                os.unlink(self.ruta_socket)
+            except OSError:
+                pass
+            logging.info("[Servicio] Detenido")
+
+    def _correr(self, n: int, ruta: Path | None, capturar: bool, m: Motores) -> None:
+        logging.info(f"[Servicio] Ciclo #{n} ({ruta or 'captura'})")
+        t0 = time.monotonic()
+        try:
+            ok = run_ciclo(self.ctx, ruta, capturar, motores=m)
+        except Exception:
+            logging.exception(f"[Servicio] Ciclo #{n} falló")
+            ok = False
+        with self._lock:
+            if ok:
+                self.completados += 1
+            else:
+                self.fallidos += 1
+        logging.info(f"[Servicio] Ciclo #{n} {'OK' if ok else 'fallido'} en {time.monotonic() - t0:.2f}s")
+
+    # --- Socket ---
+    def _abrir_socket(self) -> socket.socket:
+        try:
+            os.unlink(self.ruta_socket)  # socket viejo de una ejecución anterior
+        except FileNotFoundError:
+            pass
+        servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        servidor.bind(self.ruta_socket)
+        servidor.listen(8)
+        return servidor
+
+    def _aceptar(self, servidor: socket.socket) -> None:
+        try:
+            while True:
+                listos, _, _ = select.select([servidor, ABORTO.fileno()], [], [])
+                if servidor not in listos:
+                    return
+                try:
+                    conexion, _ = servidor.accept()
+                except OSError:
+                    return
+                self._atender_conexion(conexion)
+        finally:
+            self._cola.put(None)  # despierta al bucle de ciclos aunque haya ciclos pendientes
+
+    def _atender_conexion(self, conexion: socket.socket) -> None:
+        with conexion:
+            try:
+                conexion.settimeout(2.0)
+                orden = conexion.makefile("r", encoding="utf-8").readline().strip()
+                conexion.sendall((self.atender(orden) + "\n").encode("utf-8"))
+            except OSError as e:
+                logging.debug(f"[Servicio] Conexión no crítica: {e}")
+
+    def atender(self, orden: str) -> str:
+        partes = orden.split(maxsplit=1)
+        if not partes:
+            return "error orden vacía"
+        if partes[0] == "estado":
+            with self._lock:
+                return json.dumps({
+                    "en_cola": self._cola.qsize(), "completados": self.completados,
+                    "fallidos": self.fallidos, "rechazados": self.rechazados,
+                })
+        if partes[0] != "ciclo":
+            return f"error orden desconocida: {partes[0]}"
+
+        ruta, capturar = self.ruta_fuente, self.capturar
+        if len(partes) == 2:
+            ruta, capturar = Path(partes[1]).resolve(), False
+            if not ruta.exists():
+                return f"error imagen no encontrada: {ruta}"
+        if ruta is None and not capturar:
+            return "error sin fuente: iniciar con --imagen o --capturar, o pasar una ruta"
+        with self._lock:
+            self._secuencia += 1
+            n = self._secuencia
+            # Solo atender() encola (bajo el lock) y el bucle solo saca: qsize no puede crecer entre medio
+            if self._cola.qsize() >= self.capacidad:
+                self.rechazados += 1
+                return "ocupado"
+            self._cola.put((n, ruta, capturar))
+        return f"encolado {n}"
+
+
+def enviar_orden(orden: str, ruta_socket: str = SOCKET_POR_DEFECTO, tiempo_espera: float = 5.0) -> str:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as cliente:
+        cliente.settimeout(tiempo_espera)
+        cliente.connect(ruta_socket)
+        cliente.sendall((orden + "\n").encode("utf-8"))
+        return cliente.makefile("r", encoding="utf-8").readline().strip()
+
+
+def principal():
+    analizador = argparse.ArgumentParser(description="Cliente del modo servicio (main.py --servicio)")
+    analizador.add_argument("orden", nargs="+", help='p.ej. "ciclo", "ciclo foto.jpg" o "estado"')
+    analizador.add_argument("--socket", default=SOCKET_POR_DEFECTO, help=f"Socket UNIX (por defecto: {SOCKET_POR_DEFECTO})")
+    argumentos = analizador.parse_args()
+    orden = argumentos.orden
+    if orden[0] == "ciclo" and len(orden) > 1:
+        orden = ["ciclo", str(Path(" ".join(orden[1:])).resolve())]  # el servicio puede tener otro cwd
+    print(enviar_orden(" ".join(orden), argumentos.socket))
+
+
+if __name__ == "__main__":
+    principal()
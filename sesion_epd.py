@@ -0,0 +1,281 @@
+from __future__ import annotations
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import serial
+
+from enviar_serial import (TIEMPOS_HILO, ResultadoEnvio, abrir_serial, calcular_ventana, consultar_tramas,
+                           control_flujo, enviar_cuadro_auto, enviar_dormir, enviar_limpiar, enviar_ventana_bn,
+                           negociar_baudios, restaurar_baudios)
+from utilidades import ABORTO
+
+try:
+    from serial.tools import list_ports  # type: ignore
+except Exception:
+    list_ports = None
+
+
+class SesionEPD:
+    """
+    Enlace serial de larga vida con la EPD.
+
+    Un solo hilo dueño del `serial.Serial` ejecuta los comandos (S/W/C/Q) en el orden en que
+    llegan a la cola, así que varios hilos pueden usar la sesión sin pisarse. El puerto se abre
+    una vez (se paga la pausa de `abrir_serial` solo al conectar) y, si el dispositivo
+    desaparece o se re-enumera, se reconecta de forma transparente y se reintenta el comando.
+
+    Modo delta (`cuadro_delta`): recuerda el último cuadro mostrado y envía solo la franja de
+    filas que cambió ('W', refresco parcial). Si la franja supera `umbral_ventana` del alto, o
+    tras `refresco_completo_cada` parciales seguidos (evita fantasmas), envía el cuadro completo.
+
+    Con `baud_max`, al conectar se negocia la mayor velocidad que acepte el firmware y el
+    control de flujo por créditos (ver enviar_serial.negociar_baudios). Con `tramas`, si el
+    firmware lo admite, los cuadros completos viajan en bloques con CRC y reenvío selectivo
+    (tramas.py); si no, se sigue con 'S'/'Z'.
+    """
+
+    def __init__(self, puerto: str, baud: int, intentos: int = 3, pausa_s: float = 0.25,
+                 refresco_completo_cada: int = 10, umbral_ventana: float = 0.6, baud_max: int | None = None,
+                 tramas: bool = False):
+        self.puerto = puerto
+        self.baud = baud
+        self.baud_max = baud_max
+        self.tramas = tramas
+        self.intentos = intentos
+        self.pausa_s = pausa_s
+        self.refresco_completo_cada = refresco_completo_cada
+        self.umbral_ventana = umbral_ventana
+        self._ultimo: bytes | None = None  # último cuadro que el panel confirmó
+        self._parciales = 0
+        self._ser: serial.Serial | None = None
+        self._apertura_s = 0.0  # tiempo abriendo el puerto durante el comando en curso
+        self._huella: tuple | None = None  # (vid, pid, serial_number) del USB conectado
+        self._cola: queue.Queue = queue.Queue()
+        self._hilo: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._cerrada = False
+
+    # --- API pública ---
+    def cuadro_async(self, datos: bytes, comprimir: bool = False) -> Future:
+        """Encola el cuadro y retorna enseguida un Future[ResultadoEnvio]."""
+        return self._encolar(self._cuadro_completo, datos, comprimir)
+
+    def cuadro_delta_async(self, datos: bytes, bytes_por_fila: int, comprimir: bool = False) -> Future:
+        return self._encolar(self._cuadro_delta, datos, bytes_por_fila, comprimir)
+
+    def cuadro(self, datos: bytes, comprimir: bool = False) -> ResultadoEnvio:
+        return self.cuadro_async(datos, comprimir).result()
+
+    def cuadro_delta(self, datos: bytes, bytes_por_fila: int, comprimir: bool = False) -> ResultadoEnvio:
+        return self.cuadro_delta_async(datos, bytes_por_fila, comprimir).result()
+
+    def limpiar(self) -> str:
+        return self._encolar(self._olvidar_tras, enviar_limpiar).result()
+
+    def dormir(self) -> str:
+        return self._encolar(self._olvidar_tras, enviar_dormir).result()
+
+    def cerrar(self) -> None:
+        with self._lock:
+            if self._cerrada:
+                return
+            self._cerrada = True
+            hilo = self._hilo
+        if hilo is not None:
+            self._cola.put(None)
+            hilo.join()
+        self._desconectar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cerrar()
+
+    # --- Cola de comandos ---
+    def _encolar(self, fn: Callable, *args) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            if self._cerrada:
+                raise RuntimeError(f"Sesión EPD {self.puerto} cerrada")
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name=f"EPDSesion[{self.puerto}]", daemon=True)
+                self._hilo.start()
+            self._cola.put((fut, fn, args, time.perf_counter()))
+        return fut
+
+    def _bucle(self) -> None:
+        while True:
+            item = self._cola.get()
+            if item is None:
+                return
+            fut, fn, args, encolado = item
+            if ABORTO.cancelado:
+                fut.cancel()  # tras un abort no se toca más la EPD
+            if not fut.set_running_or_notify_cancel():
+                continue
+            inicio = time.perf_counter()
+            self._apertura_s = 0.0
+            TIEMPOS_HILO.reiniciar()
+            try:
+                res = self._ejecutar(fn, args)
+            except BaseException as e:
+                fut.set_exception(e)
+                continue
+            if isinstance(res, ResultadoEnvio):
+                res.espera_s = inicio - encolado
+                res.duracion_s = time.perf_counter() - inicio
+                res.apertura_s = self._apertura_s
+                res.escritura_s = TIEMPOS_HILO.escritura_s
+                res.ack_s = TIEMPOS_HILO.ack_s
+            fut.set_result(res)
+
+    def _ejecutar(self, fn: Callable, args: tuple):
+        """Ejecuta un comando; ante un fallo del enlace reconecta y lo reintenta una vez."""
+        try:
+            return fn(self._conectar(), *args)
+        except (serial.SerialException, OSError) as e:
+            logging.warning(f"[EPD] Enlace perdido en {self.puerto} ({e}); reconectando...")
+            self._desconectar()
+            self._ultimo = None  # el firmware pudo reiniciarse: no confiar en su búfer
+            return fn(self._conectar(), *args)
+
+    # --- Comandos (corren en el hilo de la sesión) ---
+    def _cuadro_completo(self, ser: serial.Serial, datos: bytes, comprimir: bool) -> ResultadoEnvio:
+        res = enviar_cuadro_auto(ser, datos, comprimir)
+        self._ultimo = datos if res.confirmacion == 'cuadro-ok' else None
+        self._parciales = 0
+        return res
+
+    def _cuadro_delta(self, ser: serial.Serial, datos: bytes, bytes_por_fila: int,
+                      comprimir: bool) -> ResultadoEnvio:
+        ventana = None
+        if self._ultimo is not None and len(self._ultimo) == len(datos):
+            ventana = calcular_ventana(self._ultimo, datos, bytes_por_fila)
+            if ventana is None:
+                return ResultadoEnvio('sin-cambios', 'sin-cambios', len(datos), 0)
+        alto = len(datos) // bytes_por_fila
+        if (ventana is None or ventana[1] > self.umbral_ventana * alto
+                or self._parciales >= self.refresco_completo_cada):
+            return self._cuadro_completo(ser, datos, comprimir)
+
+        y0, filas = ventana
+        franja = datos[y0 * bytes_por_fila:(y0 + filas) * bytes_por_fila]
+        conf = enviar_ventana_bn(ser, y0, filas, franja)
+        if conf == 'ventana-ok':
+            self._ultimo = datos
+            self._parciales += 1
+        else:
+            self._ultimo = None
+        return ResultadoEnvio(conf, 'ventana', len(datos), len(franja))
+
+    def _olvidar_tras(self, ser: serial.Serial, fn: Callable) -> str:
+        """Limpiar/dormir dejan el búfer del panel en estado desconocido para el modo delta."""
+        self._ultimo = None
+        return fn(ser)
+
+    # --- Conexión ---
+    def _conectar(self) -> serial.Serial:
+        if self._ser is not None and self._ser.is_open:
+            return self._ser
+        ultimo = None
+        t0 = time.perf_counter()  # incluye los intentos fallidos: el ciclo también los paga
+        for i in range(self.intentos):
+            puerto = self._resolver_puerto()
+            try:
+                self._ser = abrir_serial(puerto, self.baud)
+                if self.baud_max:
+                    self._negociar(self._ser)
+                if self.tramas and not consultar_tramas(self._ser):
+                    logging.warning(f"[EPD] El firmware de {puerto} no admite tramas; sigo con 'S'/'Z'")
+                self._apertura_s += time.perf_counter() - t0
+                if puerto != self.puerto:
+                    logging.info(f"[EPD] Dispositivo re-enumerado: {self.puerto} → {puerto}")
+                    self.puerto = puerto
+                self._huella = self._huella or self._huella_de(puerto)
+                logging.debug(f"[EPD] Sesión serial abierta en {puerto}")
+                return self._ser
+            except Exception as e:
+                ultimo = e
+                logging.warning(f"[EPD] Serial fallo intento {i+1}/{self.intentos}: {e}")
+                time.sleep(self.pausa_s)
+        raise RuntimeError(f"No se pudo abrir serial {self.puerto}: {ultimo}")
+
+    def _negociar(self, ser: serial.Serial) -> None:
+        baudios = negociar_baudios(ser, self.baud_max)
+        flujo = control_flujo(ser)
+        if flujo is None:
+            logging.info(f"[EPD] Firmware sin negociación en {ser.port}: {baudios} baudios, escritura de una vez")
+        else:
+            logging.info(f"[EPD] Enlace a {baudios} baudios; bloques de {flujo.bloque} bytes, "
+                         f"{flujo.creditos} créditos")
+
+    def _desconectar(self) -> None:
+        ser, self._ser = self._ser, None
+        if ser is not None:
+            try:
+                if self.baud_max:
+                    restaurar_baudios(ser, self.baud)
+            except Exception:
+                pass
+            try:
+                ser.close()
+            except Exception:
+                pass
+
+    def _resolver_puerto(self) -> str:
+        """Si el puerto original ya no existe, busca el mismo USB (vid/pid/serie) con otro nombre."""
+        if list_ports is None or self._huella is None:
+            return self.puerto
+        puertos = list(list_ports.comports())
+        if any(p.device == self.puerto for p in puertos):
+            return self.puerto
+        for p in puertos:
+            if (p.vid, p.pid, p.serial_number) == self._huella:
+                return p.device
+        return self.puerto
+
+    @staticmethod
+    def _huella_de(puerto: str) -> tuple | None:
+        if list_ports is None:
+            return None
+        for p in list_ports.comports():
+            if p.device == puerto and p.vid is not None:
+                return (p.vid, p.pid, p.serial_number)
+        return None
+
+
+_sesiones: dict[tuple[str, int], SesionEPD] = {}
+_sesiones_lock = threading.Lock()
+
+
+def obtener_sesion(puerto: str, baud: int, baud_max: int | None = None, tramas: bool = False) -> SesionEPD:
+    """
+    Devuelve la sesión compartida para (puerto, baud), creándola si hace falta; `baud_max` y
+    `tramas` solo cuentan al crearla.
+    """
+    with _sesiones_lock:
+        sesion = _sesiones.get((puerto, baud))
+        if sesion is None or sesion._cerrada:
+            sesion = SesionEPD(puerto, baud, baud_max=baud_max, tramas=tramas)
+            _sesiones[(puerto, baud)] = sesion
+        return sesion
+
+
+def cerrar_sesiones() -> None:
+    with _sesiones_lock:
+        sesiones = list(_sesiones.values())
+        _sesiones.clear()
+    for sesion in sesiones:
+        try:
+            sesion.cerrar()
+        except Exception as e:
+            logging.debug(f"[EPD] Cierre de sesión no crítico: {e}")
+
+
+atexit.register(cerrar_sesiones)
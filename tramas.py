@@ -0,0 +1,69 @@
+from __future__ import annotations
+import struct
+import zlib
+from dataclasses import dataclass
+
+# Protocolo 'F' (opt-in): el cuadro viaja en bloques numerados, cada uno con su CRC-32.
+#   cabecera: 'F' + tipo (u8) + largo (u32) + bloque (u16) + crc de la carga (u32) + crc de lo anterior (u32)
+#   bloque:   seq (u16) + hasta `bloque` bytes + crc32(seq + bytes) (u32)
+# El firmware responde 'h' a una cabecera válida ('E' si no) y, al final de cada pasada,
+# 'R' + n (u16) + n seqs (u16) con los bloques que fallaron; el host reenvía solo esos.
+# Con n = 0 el cuadro está completo: refresca y responde 'f'.
+TIPO_CRUDO = 0
+TIPO_PACKBITS = 1
+TAM_CABECERA = 16
+TAM_SOBRE = 6  # seq + crc de cada bloque
+BLOQUE_POR_DEFECTO = 256
+PLAZO_ABANDONO_S = 2.0  # sin datos por este plazo, el firmware descarta la transferencia a medias
+_CABECERA = struct.Struct(">cBIHI")
+
+
+@dataclass(frozen=True)
+class Cabecera:
+    tipo: int
+    largo: int
+    bloque: int
+    crc: int
+
+    @property
+    def bloques(self) -> int:
+        return -(-self.largo // self.bloque)
+
+    def largo_bloque(self, seq: int) -> int:
+        """Bytes de carga del bloque `seq` (el último puede ser más corto)."""
+        return min(self.bloque, self.largo - seq * self.bloque)
+
+
+def cabecera(tipo: int, carga: bytes, bloque: int = BLOQUE_POR_DEFECTO) -> bytes:
+    cuerpo = _CABECERA.pack(b'F', tipo, len(carga), bloque, zlib.crc32(carga))
+    return cuerpo + struct.pack(">I", zlib.crc32(cuerpo))
+
+
+def leer_cabecera(datos: bytes) -> Cabecera | None:
+    """Cabecera de TAM_CABECERA bytes → Cabecera, o None si su CRC no coincide."""
+    cuerpo, (crc,) = datos[:12], struct.unpack(">I", datos[12:16])
+    if zlib.crc32(cuerpo) != crc:
+        return None
+    _, tipo, largo, bloque, crc_carga = _CABECERA.unpack(cuerpo)
+    return Cabecera(tipo, largo, bloque, crc_carga)
+
+
+def partir(carga: bytes, bloque: int = BLOQUE_POR_DEFECTO) -> list[bytes]:
+    """Bloques ya encapsulados (seq + datos + crc), en orden de seq."""
+    bloques = []
+    for seq, inicio in enumerate(range(0, len(carga), bloque)):
+        cuerpo = struct.pack(">H", seq) + carga[inicio:inicio + bloque]
+        bloques.append(cuerpo + struct.pack(">I", zlib.crc32(cuerpo)))
+    return bloques
+
+
+def abrir_bloque(datos: bytes, seq: int) -> bytes | None:
+    """Carga del bloque si el CRC cuadra y trae el seq esperado; None si llegó dañado."""
+    cuerpo, (crc,) = datos[:-4], struct.unpack(">I", datos[-4:])
+    if zlib.crc32(cuerpo) != crc or struct.unpack(">H", cuerpo[:2])[0] != seq:
+        return None
+    return cuerpo[2:]
+
+
+def lista_faltantes(seqs: list[int]) -> bytes:
+    return b'R' + struct.pack(f">H{len(seqs)}H", len(seqs), *seqs)
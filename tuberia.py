@@ -0,0 +1,115 @@
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from estados import Ctx, emitir_registro, mostrar_y_tocar, nuevo_registro, preparar_cuadro
+from motores import Motores
+from perfil import RegistroCiclo
+from utilidades import aborted
+
+ETAPAS = ("preparar", "mostrar")
+
+
+@dataclass
+class EstadisticasTuberia:
+    """
+    Ocupación por etapa: `ocupado_s` es tiempo trabajando y `espera_s` tiempo bloqueado en la
+    cola (el preparador esperando lugar = contrapresión; el mostrador esperando cuadro = hambre).
+    """
+    ciclos: int = 0
+    fallidos: int = 0
+    abortada: bool = False
+    pared_s: float = 0.0
+    ocupado_s: dict[str, float] = field(default_factory=lambda: dict.fromkeys(ETAPAS, 0.0))
+    espera_s: dict[str, float] = field(default_factory=lambda: dict.fromkeys(ETAPAS, 0.0))
+
+    def ocupacion(self, etapa: str) -> float:
+        return self.ocupado_s[etapa] / self.pared_s if self.pared_s else 0.0
+
+    def resumen(self) -> str:
+        tasa = self.ciclos / self.pared_s if self.pared_s else 0.0
+        etapas = ", ".join(f"{e} {self.ocupacion(e):.0%} (espera {self.espera_s[e]:.2f}s)" for e in ETAPAS)
+        return (f"{self.ciclos} ciclos en {self.pared_s:.2f}s ({tasa * 60:.1f}/min), "
+                f"{self.fallidos} fallidos; ocupación: {etapas}")
+
+
+def run_ciclos(ctx: Ctx, ruta_fuente: Path | None, capturar: bool, ciclos: int,
+               motores: Motores | None = None, profundidad: int = 1) -> EstadisticasTuberia:
+    """
+    Corre `ciclos` ciclos en tubería: un hilo prepara el cuadro N+1 (captura, difuminado,
+    empaquetado) mientras el hilo actual envía el cuadro N y toca la canción.
+
+    Garantías de orden: hay un solo preparador que produce en orden de ciclo, la cola es FIFO y
+    un solo consumidor envía a la EPD (cuya sesión también es FIFO), así que la pantalla muestra
+    los cuadros en el orden de los ciclos. Un cuadro que falla al prepararse se salta, nunca se
+    reordena. `profundidad` acota los cuadros preparados en espera (memoria y frescura de la foto).
+    """
+    est = EstadisticasTuberia()
+    cola: queue.Queue[tuple[int, bytes | None, RegistroCiclo, float] | None] = queue.Queue(maxsize=max(1, profundidad))
+    parar = threading.Event()
+
+    def _preparar() -> None:
+        for n in range(1, ciclos + 1):
+            if aborted() or parar.is_set():
+                break
+            t0 = time.perf_counter()
+            registro = nuevo_registro(ctx)  # viaja con el cuadro: el consumidor lo completa y emite
+            try:
+                datos, _ = preparar_cuadro(ctx, ruta_fuente, capturar, registro)
+            except Exception:
+                logging.exception(f"[Tubería] Ciclo #{n}: falló la preparación")
+                datos = None
+            t1 = time.perf_counter()
+            cola.put((n, datos, registro, t1))
+            est.ocupado_s["preparar"] += t1 - t0
+            est.espera_s["preparar"] += time.perf_counter() - t1
+        cola.put(None)
+
+    inicio = time.perf_counter()
+    preparador = threading.Thread(target=_preparar, name="TuberiaPreparar", daemon=True)
+    preparador.start()
+    try:
+        with (nullcontext(motores) if motores is not None else Motores(gpiochip_index="auto", pin_enable=None)) as m:
+            while True:
+                t0 = time.perf_counter()
+                item = cola.get()
+                t1 = time.perf_counter()
+                est.espera_s["mostrar"] += t1 - t0
+                if item is None:
+                    break
+                n, datos, registro, listo = item
+                # Lo que el cuadro esperó ya listo no es trabajo del ciclo: etapa aparte, fuera de total_s
+                registro.espera("cola_tuberia", t1 - listo)
+                if datos is None:
+                    est.fallidos += 1
+                    emitir_registro(ctx, registro, False)
+                    continue
+                logging.info(f"[Tubería] Ciclo #{n}/{ciclos}")
+                registro.anotar("espera_tuberia", t1 - t0)
+                ok = False
+                try:
+                    ok = mostrar_y_tocar(ctx, datos, m, registro)
+                finally:
+                    emitir_registro(ctx, registro, ok)
+                est.ocupado_s["mostrar"] += time.perf_counter() - t1
+                if not ok:
+                    est.abortada = True
+                    break
+                est.ciclos += 1
+    finally:
+        # Libera al preparador si quedó bloqueado en una cola llena
+        parar.set()
+        while preparador.is_alive():
+            try:
+                cola.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        est.pared_s = time.perf_counter() - inicio
+    est.abortada = est.abortada or aborted()
+    logging.info(f"[Tubería] {est.resumen()}")
+    return est
@@ -1,18 +1,151 @@
 import logging
+import os
+import select
 import signal
+import subprocess
+import threading
+import weakref
+from pathlib import Path
 
-_abort = False
+
+class TokenCancelacion:
+    """
+    Señal de abort compartida por todo el pipeline, basada en threading.Event.
+
+    Las esperas bloquean en `esperar(timeout)` y despiertan apenas se cancela, sin sondeo.
+    Para esperas sobre descriptores (serial, subprocesos) `fileno()` da un pipe que se vuelve
+    legible al cancelar, así que puede ir en el mismo select() que el descriptor esperado.
+    """
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._pipe: tuple[int, int] | None = None
+        self._hijos: weakref.WeakSet[TokenCancelacion] = weakref.WeakSet()
+
+    def cancelar(self) -> None:
+        with self._lock:
+            self._evento.set()
+            hijos = list(self._hijos)
+        if self._pipe is not None:
+            try:
+                os.write(self._pipe[1], b"!")
+            except OSError:
+                pass
+        for hijo in hijos:
+            hijo.cancelar()
+
+    def hijo(self) -> "TokenCancelacion":
+        """Token que se cancela junto con este (no al revés): corta una sola tarea sin abortar el resto."""
+        hijo = TokenCancelacion()
+        with self._lock:
+            if not self._evento.is_set():
+                self._hijos.add(hijo)
+                return hijo
+        hijo.cancelar()
+        return hijo
+
+    @property
+    def cancelado(self) -> bool:
+        return self._evento.is_set()
+
+    def esperar(self, timeout: float | None = None) -> bool:
+        """Bloquea hasta que se cancele o venza `timeout`. Retorna True si se canceló."""
+        return self._evento.wait(timeout)
+
+    def fileno(self) -> int:
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                os.set_blocking(self._pipe[1], False)
+                if self._evento.is_set():
+                    os.write(self._pipe[1], b"!")
+            return self._pipe[0]
+
+
+ABORTO = TokenCancelacion()
 
 def setup_logging(verbose: bool = True):
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO,
                         format="%(message)s")
 
+_vigia_senales: threading.Thread | None = None
+
+def _on_signal(sig, frame):
+    # Nada de locks aquí: el handler puede interrumpir al hilo principal dentro de Event.wait (lock
+    # no reentrante). El intérprete ya escribió la señal en el pipe de set_wakeup_fd; la atiende
+    # _vigilar_senales desde su propio hilo.
+    pass
+
+def _vigilar_senales(fd: int, senales: frozenset[int]) -> None:
+    while True:
+        try:
+            datos = os.read(fd, 64)
+        except OSError:
+            return
+        if any(s in senales for s in datos):
+            ABORTO.cancelar()
+            logging.warning("[Sistema] Interrupción recibida; limpiando...")
+
+def _instalar_senales(*senales: signal.Signals) -> None:
+    """Desde el hilo principal: cada señal solo escribe un byte en un pipe que vigila un hilo aparte."""
+    global _vigia_senales
+    if _vigia_senales is None:
+        lectura, escritura = os.pipe()
+        os.set_blocking(escritura, False)
+        signal.set_wakeup_fd(escritura)
+        _vigia_senales = threading.Thread(target=_vigilar_senales, args=(lectura, frozenset(senales)),
+                                          name="Senales", daemon=True)
+        _vigia_senales.start()
+    for s in senales:
+        signal.signal(s, _on_signal)
+
 def install_sigint_handler():
-    def _on_sigint(sig, frame):
-        global _abort
-        _abort = True
-        logging.warning("[Sistema] Interrupción recibida; limpiando...")
-    signal.signal(signal.SIGINT, _on_sigint)
+    _instalar_senales(signal.SIGINT)
+
+def install_signal_handlers():
+    """SIGINT y SIGTERM (systemd, kill) marcan abort(): el ciclo en curso y el servicio terminan limpio."""
+    _instalar_senales(signal.SIGINT, signal.SIGTERM)
 
 def aborted() -> bool:
-    return _abort
+    return ABORTO.cancelado
+
+def esperar_aborto(timeout: float | None = None) -> bool:
+    """Duerme hasta `timeout` o hasta un abort (lo que ocurra primero). True si hubo abort."""
+    return ABORTO.esperar(timeout)
+
+def esperar_proceso(proc: subprocess.Popen) -> int:
+    """
+    Espera a que termine `proc` o a un abort; ante abort lo termina y lanza InterruptedError.
+    Usa un pidfd (Linux) para bloquear en select() junto al token, sin sondeo.
+    """
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            pass
+    if pidfd is not None:
+        try:
+            listos, _, _ = select.select([pidfd, ABORTO.fileno()], [], [])
+        finally:
+            os.close(pidfd)
+        if pidfd in listos:
+            return proc.wait()
+    else:
+        while proc.poll() is None and not ABORTO.esperar(0.05):
+            pass
+        if proc.poll() is not None:
+            return proc.returncode
+    proc.terminate()
+    try:
+        proc.wait(timeout=2.0)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    raise InterruptedError(f"{proc.args[0]} interrumpido por abort")
+
+def escribir_atomico(ruta: Path, datos: bytes) -> None:
+    """Escribe a <ruta>.tmp y renombra: un lector nunca ve el archivo a medio escribir."""
+    tmp = ruta.with_suffix(ruta.suffix + ".tmp")
+    tmp.write_bytes(datos)
+    os.replace(tmp, ruta)